@@ -0,0 +1,1528 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+An in-process stand-in for the parts of the ECS, Auto Scaling, EC2 and
+ELBv2 APIs the lifecycle functions use, backed by a simulated cluster that runs
+on a virtual clock.
+
+Nothing here talks to AWS.  The fake clients emit botocore's before-call
+events so the functions' rate limiting and metrics see every call, and
+the virtual clock replaces time.sleep so an hour of draining runs in
+well under a second.
+"""
+
+import base64
+import contextlib
+import datetime
+import heapq
+import itertools
+import json
+import re
+import threading
+import time
+import types
+
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+
+ACCOUNT = "123456789012"
+REGION = "us-east-1"
+
+# The ports the ECS agent reserves on every container instance.
+RESERVED_PORTS = ["22", "2375", "2376", "51678", "51679"]
+
+
+class VirtualClock(object):
+
+    """
+    A clock which only moves when something sleeps on it.  Sleeping runs
+    any simulated cluster events that fall due along the way.
+
+    Threads running concurrent invocations register as participants.  A
+    participant's sleep waits until every participant is asleep, then the
+    clock jumps to the earliest wake up, so concurrent invocations see
+    the same timeline they would on a real clock.  Any other thread, such
+    as a worker in a function's own thread pool, moves the clock straight
+    on when it sleeps.
+    """
+
+    def __init__(self, start=None):
+        self._now = time.time() if start is None else start
+        self.lock = threading.RLock()
+        self._woken = threading.Condition(self.lock)
+        self._local = threading.local()
+        self._participants = 0
+        self._sleepers = []
+        self._events = []
+        self._sequence = itertools.count()
+
+    def now(self):
+        return(self._now)
+
+    @contextlib.contextmanager
+    def participant(self):
+        with self.lock:
+            self._participants += 1
+        self._local.participant = True
+        try:
+            yield
+        finally:
+            self._local.participant = False
+            with self.lock:
+                self._participants -= 1
+                self._advance_sleepers()
+
+    def sleep(self, seconds):
+        with self.lock:
+            wake = self._now + max(0, seconds)
+            if not getattr(self._local, "participant", False):
+                self.advance_to(wake)
+                return
+            heapq.heappush(self._sleepers, wake)
+            self._advance_sleepers()
+            while self._now < wake:
+                self._woken.wait()
+
+    def _advance_sleepers(self):
+        if self._sleepers and len(self._sleepers) >= self._participants:
+            self.advance_to(self._sleepers[0])
+
+    def schedule(self, delay, callback):
+        with self.lock:
+            heapq.heappush(
+                self._events,
+                (self._now + delay, next(self._sequence), callback)
+            )
+
+    def advance_to(self, when):
+        with self.lock:
+            while self._events and self._events[0][0] <= when:
+                due, _, callback = heapq.heappop(self._events)
+                self._now = max(self._now, due)
+                callback()
+            self._now = max(self._now, when)
+            while self._sleepers and self._sleepers[0] <= self._now:
+                heapq.heappop(self._sleepers)
+            self._woken.notify_all()
+
+
+class FakeContext(object):
+
+    """
+    The parts of the Lambda context object the functions use, counting
+    down against the virtual clock.
+    """
+
+    def __init__(self, clock, timeout=300, function_name="lifecycle-hook"):
+        self._clock = clock
+        self._deadline = clock.now() + timeout
+        self.function_name = function_name
+        self.invoked_function_arn = "arn:aws:lambda:{}:{}:function:{}".format(
+            REGION, ACCOUNT, function_name
+        )
+
+    def get_remaining_time_in_millis(self):
+        return(int(max(0, self._deadline - self._clock.now()) * 1000))
+
+
+def _client_error(code, operation, message=""):
+    return(ClientError(
+        {"Error": {"Code": code, "Message": message}},
+        operation
+    ))
+
+
+def _camel(operation):
+    return("".join(part.title() for part in operation.split("_")))
+
+
+class _Paginator(object):
+
+    def __init__(self, client, operation, result_key):
+        self._client = client
+        self._operation = operation
+        self._result_key = result_key
+
+    def paginate(self, **kwargs):
+        config = kwargs.pop("PaginationConfig", {})
+        if "PageSize" in config:
+            kwargs[self._client.PAGE_SIZE_PARAMS.get(
+                self._operation, "maxResults"
+            )] = config["PageSize"]
+
+        token_key, next_key = self._client.TOKEN_PARAMS.get(
+            self._operation, ("nextToken", "nextToken")
+        )
+        while True:
+            page = getattr(self._client, self._operation)(**kwargs)
+            yield page
+            if not page.get(next_key):
+                return
+            kwargs[token_key] = page[next_key]
+
+
+class _FakeClient(object):
+
+    """
+    Base for the fake clients.  Every call is counted, emits botocore's
+    before-call event and optionally costs some virtual time.
+    """
+
+    SERVICE = None
+    PAGINATORS = {}
+    PAGE_SIZE_PARAMS = {}
+    TOKEN_PARAMS = {}
+
+    def __init__(self, simulator):
+        self._simulator = simulator
+        self.meta = types.SimpleNamespace(
+            events=HierarchicalEmitter(),
+            service_model=types.SimpleNamespace(service_name=self.SERVICE)
+        )
+
+    def _call(self, operation):
+        name = _camel(operation)
+        model = types.SimpleNamespace(
+            name=name,
+            service_model=self.meta.service_model
+        )
+        self.meta.events.emit(
+            "before-call.{}.{}".format(self.SERVICE, name),
+            model=model,
+            params={}
+        )
+        self._simulator.count_call("{}.{}".format(self.SERVICE, name))
+
+    def get_paginator(self, operation):
+        return(_Paginator(self, operation, self.PAGINATORS[operation]))
+
+
+def _page(items, max_results, next_token, limit):
+    start = int(next_token or 0)
+    size = min(max_results or limit, limit)
+    page = items[start:start + size]
+    token = str(start + size) if start + size < len(items) else None
+    return(page, token)
+
+
+class FakeECS(_FakeClient):
+
+    SERVICE = "ecs"
+    PAGINATORS = {
+        "list_container_instances": "containerInstanceArns",
+        "list_services": "serviceArns",
+        "list_tasks": "taskArns",
+    }
+
+    def list_container_instances(self, cluster, filter=None, status=None,
+                                 maxResults=None, nextToken=None):
+        self._call("list_container_instances")
+        with self._simulator.lock:
+            instances = self._simulator.match_instances(filter, status)
+            arns, token = _page(
+                [i["containerInstanceArn"] for i in instances],
+                maxResults, nextToken, 100
+            )
+        return({"containerInstanceArns": arns, "nextToken": token})
+
+    def describe_container_instances(self, cluster, containerInstances):
+        self._call("describe_container_instances")
+        if len(containerInstances) > 100:
+            raise(_client_error(
+                "InvalidParameterException", "DescribeContainerInstances",
+                "containerInstances can have at most 100 items."
+            ))
+        with self._simulator.lock:
+            found, failures = [], []
+            for arn in containerInstances:
+                arn = self._simulator.instance_arn(arn)
+                if arn in self._simulator.instances:
+                    found.append(self._simulator.describe_instance(arn))
+                else:
+                    failures.append({"arn": arn, "reason": "MISSING"})
+        return({"containerInstances": found, "failures": failures})
+
+    def update_container_instances_state(self, cluster, containerInstances,
+                                         status):
+        self._call("update_container_instances_state")
+        if len(containerInstances) > 10:
+            raise(_client_error(
+                "InvalidParameterException", "UpdateContainerInstancesState",
+                "containerInstances can have at most 10 items."
+            ))
+        with self._simulator.lock:
+            updated = []
+            for arn in containerInstances:
+                arn = self._simulator.instance_arn(arn)
+                self._simulator.set_instance_status(arn, status)
+                updated.append(self._simulator.describe_instance(arn))
+        return({"containerInstances": updated, "failures": []})
+
+    def list_services(self, cluster, maxResults=None, nextToken=None,
+                      launchType=None, schedulingStrategy=None):
+        self._call("list_services")
+        with self._simulator.lock:
+            arns, token = _page(
+                [s["serviceArn"] for s in self._simulator.services.values()],
+                maxResults, nextToken, 100
+            )
+        return({"serviceArns": arns, "nextToken": token})
+
+    def describe_services(self, cluster, services, include=None):
+        self._call("describe_services")
+        if len(services) > 10:
+            raise(_client_error(
+                "InvalidParameterException", "DescribeServices",
+                "services can have at most 10 items."
+            ))
+        with self._simulator.lock:
+            found, failures = [], []
+            for name in services:
+                service = self._simulator.find_service(name)
+                if service is None:
+                    failures.append({"arn": name, "reason": "MISSING"})
+                else:
+                    found.append(self._simulator.describe_service(service))
+        return({"services": found, "failures": failures})
+
+    def list_tasks(self, cluster, containerInstance=None, serviceName=None,
+                   desiredStatus="RUNNING", maxResults=None, nextToken=None,
+                   family=None, startedBy=None, launchType=None):
+        self._call("list_tasks")
+        with self._simulator.lock:
+            tasks = self._simulator.match_tasks(
+                containerInstance, serviceName, desiredStatus
+            )
+            arns, token = _page(
+                [t["taskArn"] for t in tasks], maxResults, nextToken, 100
+            )
+        return({"taskArns": arns, "nextToken": token})
+
+    def describe_tasks(self, cluster, tasks, include=None):
+        self._call("describe_tasks")
+        if len(tasks) > 100:
+            raise(_client_error(
+                "InvalidParameterException", "DescribeTasks",
+                "tasks can have at most 100 items."
+            ))
+        with self._simulator.lock:
+            found, failures = [], []
+            for arn in tasks:
+                if arn in self._simulator.tasks:
+                    found.append(dict(self._simulator.tasks[arn]))
+                else:
+                    failures.append({"arn": arn, "reason": "MISSING"})
+        return({"tasks": found, "failures": failures})
+
+    def stop_task(self, cluster, task, reason=None):
+        self._call("stop_task")
+        with self._simulator.lock:
+            self._simulator.stop_task(task)
+            return({"task": dict(self._simulator.tasks[task])})
+
+    def describe_task_definition(self, taskDefinition, include=None):
+        self._call("describe_task_definition")
+        with self._simulator.lock:
+            definition = self._simulator.task_definitions.get(taskDefinition)
+        if definition is None:
+            raise(_client_error(
+                "ClientException", "DescribeTaskDefinition",
+                "Unable to describe task definition."
+            ))
+        return({"taskDefinition": definition})
+
+
+class FakeAutoScaling(_FakeClient):
+
+    SERVICE = "autoscaling"
+    PAGINATORS = {
+        "describe_scaling_activities": "Activities",
+    }
+    PAGE_SIZE_PARAMS = {
+        "describe_scaling_activities": "MaxRecords",
+    }
+    TOKEN_PARAMS = {
+        "describe_scaling_activities": ("NextToken", "NextToken"),
+    }
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames=None,
+                                     **kwargs):
+        self._call("describe_auto_scaling_groups")
+        simulator = self._simulator
+        with simulator.lock:
+            group = {
+                "AutoScalingGroupName": simulator.asg_name,
+                "Tags": [
+                    {
+                        "Key": key,
+                        "Value": value,
+                        "ResourceId": simulator.asg_name,
+                        "ResourceType": "auto-scaling-group",
+                        "PropagateAtLaunch": False
+                    }
+                    for key, value in simulator.asg_tags.items()
+                ],
+                "Instances": [
+                    {
+                        "InstanceId": instance_id,
+                        "LifecycleState": "Terminating:Wait"
+                        if instance_id in simulator.terminating
+                        else simulator.lifecycle_states.get(
+                            instance_id, "InService"
+                        )
+                    }
+                    for instance_id in simulator.ec2_instances
+                ]
+            }
+        return({"AutoScalingGroups": [group]})
+
+    def describe_auto_scaling_instances(self, InstanceIds=None, **kwargs):
+        self._call("describe_auto_scaling_instances")
+        simulator = self._simulator
+        with simulator.lock:
+            return({"AutoScalingInstances": [
+                {
+                    "InstanceId": instance_id,
+                    "AutoScalingGroupName": simulator.asg_name,
+                    "LifecycleState": simulator.lifecycle_states.get(
+                        instance_id, "InService"
+                    )
+                }
+                for instance_id in InstanceIds or []
+                if instance_id in simulator.ec2_instances
+            ]})
+
+    def describe_scaling_activities(self, AutoScalingGroupName=None,
+                                    MaxRecords=None, NextToken=None,
+                                    **kwargs):
+        self._call("describe_scaling_activities")
+        with self._simulator.lock:
+            activities, token = _page(
+                list(reversed(self._simulator.activities)),
+                MaxRecords, NextToken, 100
+            )
+        response = {"Activities": activities}
+        if token is not None:
+            response["NextToken"] = token
+        return(response)
+
+    def complete_lifecycle_action(self, LifecycleHookName,
+                                  AutoScalingGroupName, LifecycleActionResult,
+                                  LifecycleActionToken=None, InstanceId=None):
+        self._call("complete_lifecycle_action")
+        with self._simulator.lock:
+            self._simulator.complete_hook(
+                LifecycleActionToken, LifecycleActionResult
+            )
+        return({})
+
+    def record_lifecycle_action_heartbeat(self, LifecycleHookName,
+                                          AutoScalingGroupName,
+                                          LifecycleActionToken=None,
+                                          InstanceId=None):
+        self._call("record_lifecycle_action_heartbeat")
+        with self._simulator.lock:
+            self._simulator.heartbeats[LifecycleActionToken] += 1
+        return({})
+
+
+class FakeEC2(_FakeClient):
+
+    SERVICE = "ec2"
+
+    def describe_instance_attribute(self, InstanceId, Attribute):
+        self._call("describe_instance_attribute")
+        user_data = "#!/bin/bash\necho ECS_CLUSTER={} >> /etc/ecs/ecs.config\n"
+        return({
+            "InstanceId": InstanceId,
+            "UserData": {
+                "Value": base64.b64encode(user_data.format(
+                    self._simulator.cluster_name
+                ).encode()).decode()
+            }
+        })
+
+
+class FakeSQS(_FakeClient):
+
+    SERVICE = "sqs"
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._call("change_message_visibility_batch")
+        return({
+            "Successful": [{"Id": entry["Id"]} for entry in Entries],
+            "Failed": []
+        })
+
+
+class FakeLambda(_FakeClient):
+
+    SERVICE = "lambda"
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse",
+               **kwargs):
+        self._call("invoke")
+        with self._simulator.lock:
+            self._simulator.add_continuation(
+                json.loads(Payload),
+                self._simulator.async_invoke_seconds
+            )
+        return({"StatusCode": 202})
+
+
+class FakeScheduler(_FakeClient):
+
+    SERVICE = "scheduler"
+
+    def create_schedule(self, Name, ScheduleExpression, FlexibleTimeWindow,
+                        Target, **kwargs):
+        self._call("create_schedule")
+        at = datetime.datetime.strptime(
+            ScheduleExpression, "at(%Y-%m-%dT%H:%M:%S)"
+        ).replace(tzinfo=datetime.timezone.utc).timestamp()
+        with self._simulator.lock:
+            self._simulator.add_continuation(
+                json.loads(Target["Input"]),
+                max(0, at - self._simulator.clock.now())
+            )
+        return({"ScheduleArn": "arn:aws:scheduler:{}:{}:schedule/default/"
+                "{}".format(REGION, ACCOUNT, Name)})
+
+
+class FakeELBv2(_FakeClient):
+
+    SERVICE = "elbv2"
+
+    def deregister_targets(self, TargetGroupArn, Targets):
+        self._call("deregister_targets")
+        with self._simulator.lock:
+            if TargetGroupArn not in self._simulator.target_groups:
+                raise(_client_error(
+                    "TargetGroupNotFound", "DeregisterTargets",
+                    "One or more target groups not found"
+                ))
+            for target in Targets:
+                self._simulator.deregister_target(
+                    TargetGroupArn, (target["Id"], target["Port"])
+                )
+        return({})
+
+    def describe_target_health(self, TargetGroupArn, Targets=None):
+        self._call("describe_target_health")
+        with self._simulator.lock:
+            registered = self._simulator.target_groups.get(TargetGroupArn)
+            if registered is None:
+                raise(_client_error(
+                    "TargetGroupNotFound", "DescribeTargetHealth",
+                    "One or more target groups not found"
+                ))
+            if Targets is None:
+                keys = list(registered)
+            else:
+                keys = [(t["Id"], t["Port"]) for t in Targets]
+            descriptions = []
+            for key in keys:
+                target = registered.get(key)
+                health = {"State": "unused",
+                          "Reason": "Target.NotRegistered"}
+                if target is not None and target["state"] == "draining":
+                    health = {"State": "draining",
+                              "Reason": "Target.DeregistrationInProgress"}
+                elif target is not None:
+                    health = {"State": target["state"]}
+                descriptions.append({
+                    "Target": {"Id": key[0], "Port": key[1]},
+                    "HealthCheckPort": str(key[1]),
+                    "TargetHealth": health
+                })
+        return({"TargetHealthDescriptions": descriptions})
+
+
+class ClusterSimulator(object):
+
+    """
+    A simulated ECS cluster backed by one AutoScaling group.
+
+    Draining an instance behaves the way ECS does for REPLICA services: a
+    replacement for each service task is placed on another ACTIVE instance
+    with room for it, and once it is RUNNING the old task is stopped (or
+    the other way round when a service's maximumPercent leaves no room to
+    start first).  Replacements that fit nowhere wait and retry, leaving
+    the drain stuck just like a real cluster short of capacity.  DAEMON
+    tasks and standalone tasks stay put until the instance terminates.
+
+    Given a deregistration_delay, the services built sit behind ELBv2
+    target groups.  Their tasks bind dynamic host ports, are registered as
+    targets once RUNNING, and only stop once their targets have
+    deregistered, starting the deregistration if nobody else has.
+
+    All timings are in virtual seconds on the simulator's clock.
+    """
+
+    def __init__(self, clock=None, cluster_name="benchmark",
+                 asg_name="benchmark-asg", placement_delay=5,
+                 task_start_seconds=30, task_stop_seconds=30,
+                 retry_placement_seconds=30, api_latency=0.0,
+                 instance_cpu=2048, instance_memory=7936,
+                 async_invoke_seconds=1, deregistration_delay=None):
+        self.clock = clock or VirtualClock()
+        self.lock = self.clock.lock
+        self.cluster_name = cluster_name
+        self.asg_name = asg_name
+        self.asg_tags = {"ecs-cluster-manager:cluster-name": cluster_name}
+        self.placement_delay = placement_delay
+        self.task_start_seconds = task_start_seconds
+        self.task_stop_seconds = task_stop_seconds
+        self.retry_placement_seconds = retry_placement_seconds
+        self.api_latency = api_latency
+        self.instance_cpu = instance_cpu
+        self.instance_memory = instance_memory
+        self.async_invoke_seconds = async_invoke_seconds
+        self.deregistration_delay = deregistration_delay
+
+        self.instances = {}
+        self.ec2_instances = {}
+        self.services = {}
+        self.tasks = {}
+        self.task_definitions = {}
+        self._instance_tasks_index = {}
+        self._service_tasks_index = {}
+        self._placement_cursor = 0
+        self.target_groups = {}
+        self._task_targets = {}
+        self._host_ports = itertools.count(32768)
+        self.activities = []
+        self.hook_results = {}
+        self.spot_results = {}
+        self.lowest_healthy = {}
+        self.lifecycle_states = {}
+        self.heartbeats = {}
+        self.continuations = {}
+        self.terminating = set()
+        self._hooks = {}
+        self.calls = {}
+        self._ids = itertools.count(1)
+
+        self.ecs = FakeECS(self)
+        self.autoscaling = FakeAutoScaling(self)
+        self.ec2 = FakeEC2(self)
+        self.sqs = FakeSQS(self)
+        self.lambda_ = FakeLambda(self)
+        self.scheduler = FakeScheduler(self)
+        self.elbv2 = FakeELBv2(self)
+
+    def _arn(self, resource, name):
+        return("arn:aws:ecs:{}:{}:{}/{}/{}".format(
+            REGION, ACCOUNT, resource, self.cluster_name, name
+        ))
+
+    def _now(self):
+        return(datetime.datetime.fromtimestamp(
+            self.clock.now(), datetime.timezone.utc
+        ))
+
+    def count_call(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.api_latency:
+            self.clock.sleep(self.api_latency)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+    # Building the cluster
+
+    def add_instance(self, instance_id=None, register_after=None):
+        instance_id = instance_id or "i-{:017x}".format(next(self._ids))
+        self.ec2_instances[instance_id] = None
+        if register_after is None:
+            self._register(instance_id)
+        else:
+            self.clock.schedule(
+                register_after, lambda: self._register(instance_id)
+            )
+        return(instance_id)
+
+    def _register(self, instance_id):
+        arn = self._arn("container-instance", "{:032x}".format(
+            next(self._ids)
+        ))
+        self.instances[arn] = {
+            "containerInstanceArn": arn,
+            "ec2InstanceId": instance_id,
+            "status": "ACTIVE",
+            "agentConnected": True,
+            "registeredAt": self._now()
+        }
+        self.ec2_instances[instance_id] = arn
+        self._instance_tasks_index[arn] = {}
+
+    def add_service(self, name, desired_count, cpu=256, memory=512,
+                    scheduling_strategy="REPLICA", minimum_healthy_percent=100,
+                    maximum_percent=200, load_balancers=None, host_ports=None):
+        service = {
+            "serviceArn": self._arn("service", name),
+            "serviceName": name,
+            "clusterArn": self._arn("cluster", "")[:-1],
+            "status": "ACTIVE",
+            "schedulingStrategy": scheduling_strategy,
+            "desiredCount": desired_count,
+            "cpu": cpu,
+            "memory": memory,
+            "deploymentConfiguration": {
+                "minimumHealthyPercent": minimum_healthy_percent,
+                "maximumPercent": maximum_percent
+            },
+            "loadBalancers": load_balancers or [],
+            "createdAt": self._now(),
+            "events": [],
+            "taskDefinition": self._task_definition(name, cpu, memory,
+                                                    host_ports)
+        }
+        self.services[name] = service
+        self._service_tasks_index[name] = {}
+        for load_balancer in service["loadBalancers"]:
+            self.target_groups.setdefault(
+                load_balancer["targetGroupArn"], {}
+            )
+
+        if scheduling_strategy == "DAEMON":
+            targets = list(self.instances)
+            service["desiredCount"] = len(targets)
+        else:
+            targets = [None] * desired_count
+        for target in targets:
+            target = target or self._next_instance(service)
+            if target is None:
+                raise(ValueError(
+                    "Not enough capacity to place service {}".format(name)
+                ))
+            self._start_task(service, target, "RUNNING")
+        self._service_event(service, "has reached a steady state.")
+        return(service)
+
+    def _task_definition(self, family, cpu, memory, host_ports=None):
+        arn = "arn:aws:ecs:{}:{}:task-definition/{}:1".format(
+            REGION, ACCOUNT, family
+        )
+        self.task_definitions[arn] = {
+            "taskDefinitionArn": arn,
+            "family": family,
+            "revision": 1,
+            "networkMode": "bridge",
+            "containerDefinitions": [{
+                "name": family,
+                "cpu": cpu,
+                "memory": memory,
+                "portMappings": [
+                    {"containerPort": port, "hostPort": port,
+                     "protocol": "tcp"}
+                    for port in host_ports or []
+                ]
+            }]
+        }
+        return(arn)
+
+    def add_standalone_task(self, container_instance_arn, cpu=128,
+                            memory=256, family="batch-job"):
+        task = self._new_task(
+            None, container_instance_arn, "RUNNING", cpu, memory
+        )
+        task["taskDefinitionArn"] = self._task_definition(family, cpu, memory)
+        task["group"] = "family:{}".format(family)
+        task["startedBy"] = "benchmark"
+        return(task)
+
+    @classmethod
+    def build(cls, instance_count, service_count, tasks_per_service,
+              standalone_per_instance=0, daemon_services=0,
+              minimum_healthy_percent=100, maximum_percent=200, **kwargs):
+
+        """
+        Builds a cluster of instance_count instances running service_count
+        REPLICA services of tasks_per_service tasks each, with the given
+        deployment configuration, plus optional DAEMON services and
+        standalone tasks.  With a deregistration_delay each REPLICA
+        service gets a target group of its own.
+        """
+
+        simulator = cls(**kwargs)
+        for _ in range(instance_count):
+            simulator.add_instance()
+        for n in range(daemon_services):
+            simulator.add_service(
+                "daemon-{}".format(n), 0, cpu=64, memory=128,
+                scheduling_strategy="DAEMON"
+            )
+        for n in range(service_count):
+            name = "service-{}".format(n)
+            load_balancers = None
+            if simulator.deregistration_delay is not None:
+                load_balancers = [{
+                    "targetGroupArn": "arn:aws:elasticloadbalancing:{}:{}:"
+                    "targetgroup/{}/{:016x}".format(
+                        REGION, ACCOUNT, name, next(simulator._ids)
+                    ),
+                    "containerName": name,
+                    "containerPort": 80
+                }]
+            simulator.add_service(
+                name, tasks_per_service,
+                minimum_healthy_percent=minimum_healthy_percent,
+                maximum_percent=maximum_percent,
+                load_balancers=load_balancers
+            )
+        for arn in list(simulator.instances):
+            for _ in range(standalone_per_instance):
+                simulator.add_standalone_task(arn)
+        return(simulator)
+
+    # Lifecycle hooks
+
+    def _hook_event(self, instance_id, transition, hook_name,
+                    origin="EC2", destination="AutoScalingGroup"):
+        token = "{:08x}-0000-4000-8000-{:012x}".format(
+            next(self._ids), next(self._ids)
+        )
+        self.heartbeats[token] = 0
+        self._hooks[token] = (instance_id, transition)
+        return({
+            "version": "0",
+            "id": token,
+            "detail-type": "EC2 Instance-{} Lifecycle Action".format(
+                "launch" if transition == "Launching" else "terminate"
+            ),
+            "source": "aws.autoscaling",
+            "account": ACCOUNT,
+            "region": REGION,
+            "detail": {
+                "LifecycleActionToken": token,
+                "AutoScalingGroupName": self.asg_name,
+                "LifecycleHookName": hook_name,
+                "EC2InstanceId": instance_id,
+                "LifecycleTransition": "autoscaling:EC2_INSTANCE_{}".format(
+                    "LAUNCHING" if transition == "Launching"
+                    else "TERMINATING"
+                ),
+                "Origin": origin,
+                "Destination": destination
+            }
+        })
+
+    def _activity(self, description):
+        self.activities.append({
+            "ActivityId": "{:032x}".format(next(self._ids)),
+            "AutoScalingGroupName": self.asg_name,
+            "Description": description,
+            "StartTime": self._now(),
+            "StatusCode": "InProgress"
+        })
+
+    def begin_termination(self, instance_id=None, hook_name="terminate-hook"):
+
+        """
+        Starts terminating an instance, picking the oldest one not already
+        terminating if none is given, and returns the EventBridge event
+        AutoScaling would send.
+        """
+
+        with self.lock:
+            if instance_id is None:
+                instance_id = next(
+                    i["ec2InstanceId"] for i in self.instances.values()
+                    if i["ec2InstanceId"] not in self.terminating
+                )
+            self.terminating.add(instance_id)
+            self._activity("Terminating EC2 instance: {}".format(instance_id))
+            return(self._hook_event(
+                instance_id, "Terminating", hook_name,
+                "AutoScalingGroup", "EC2"
+            ))
+
+    def begin_launch(self, register_after=60, hook_name="launch-hook",
+                     warm_pool=None):
+
+        """
+        Launches a new instance whose ECS agent registers after
+        register_after seconds and returns the EventBridge event AutoScaling
+        would send.
+
+        With warm_pool "into" the instance launches into the group's warm
+        pool instead, and like an agent with ECS_WARM_POOLS_CHECK set it
+        never registers.  With warm_pool "from" the instance comes out of
+        the warm pool: it registered before it was stopped, and its agent
+        reconnects after register_after seconds.
+        """
+
+        with self.lock:
+            if warm_pool == "into":
+                instance_id = "i-{:017x}".format(next(self._ids))
+                self.ec2_instances[instance_id] = None
+                self.lifecycle_states[instance_id] = "Warmed:Pending:Wait"
+                self._activity("Launching a new EC2 instance into warm "
+                               "pool: {}".format(instance_id))
+                return(self._hook_event(
+                    instance_id, "Launching", hook_name, "EC2", "WarmPool"
+                ))
+
+            if warm_pool == "from":
+                instance_id = self.add_instance()
+                instance = self.instances[self.ec2_instances[instance_id]]
+                instance["agentConnected"] = False
+                self.clock.schedule(
+                    register_after,
+                    lambda: instance.update(agentConnected=True)
+                )
+                self._activity("Launching a new EC2 instance from warm "
+                               "pool: {}".format(instance_id))
+                return(self._hook_event(
+                    instance_id, "Launching", hook_name,
+                    "WarmPool", "AutoScalingGroup"
+                ))
+
+            instance_id = self.add_instance(register_after=register_after)
+            self._activity("Launching a new EC2 instance: {}".format(
+                instance_id
+            ))
+            return(self._hook_event(instance_id, "Launching", hook_name))
+
+    def begin_spot_interruption(self, instance_id=None, rebalance=False):
+
+        """
+        Warns that a Spot instance, the oldest one not already terminating
+        if none is given, is about to be interrupted, and returns the
+        EventBridge event EC2 would send.  Two minutes later EC2 reclaims
+        it, and spot_results records "DRAINED" if its REPLICA service tasks
+        had all been replaced by then, or how many were lost.
+
+        With rebalance we send a rebalance recommendation instead, and the
+        instance isn't reclaimed.
+        """
+
+        with self.lock:
+            if instance_id is None:
+                instance_id = next(
+                    i["ec2InstanceId"] for i in self.instances.values()
+                    if i["ec2InstanceId"] not in self.terminating
+                )
+            self.terminating.add(instance_id)
+
+            event = {
+                "version": "0",
+                "id": "{:08x}-0000-4000-8000-{:012x}".format(
+                    next(self._ids), next(self._ids)
+                ),
+                "source": "aws.ec2",
+                "account": ACCOUNT,
+                "region": REGION,
+                "time": self._now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "resources": [
+                    "arn:aws:ec2:{}:{}:instance/{}".format(
+                        REGION, ACCOUNT, instance_id
+                    )
+                ],
+                "detail": {"instance-id": instance_id}
+            }
+            if rebalance:
+                event["detail-type"] = "EC2 Instance Rebalance Recommendation"
+                return(event)
+
+            event["detail-type"] = "EC2 Spot Instance Interruption Warning"
+            event["detail"]["instance-action"] = "terminate"
+
+            def reclaim():
+                lost = self.terminate_instance(instance_id)
+                self.spot_results[instance_id] = \
+                    "LOST-{}".format(lost) if lost else "DRAINED"
+            # The warning's time is in whole seconds, so we reclaim the
+            # instance two minutes from the start of the second.
+            self.clock.schedule(120 - self.clock.now() % 1, reclaim)
+            return(event)
+
+    def termination_policy_event(self, capacity=1, zones=("a", "b")):
+
+        """
+        The event AutoScaling sends a custom termination policy, offering
+        every instance in the group spread across the given zones.
+        """
+
+        with self.lock:
+            instances = [
+                {
+                    "AvailabilityZone": REGION + zones[n % len(zones)],
+                    "InstanceId": instance_id,
+                    "InstanceType": "m5.large",
+                    "InstanceMarketOption": "on-demand"
+                }
+                for n, instance_id in enumerate(self.ec2_instances)
+            ]
+        return({
+            "AutoScalingGroupARN": (
+                "arn:aws:autoscaling:{}:{}:autoScalingGroup:0:"
+                "autoScalingGroupName/{}".format(
+                    REGION, ACCOUNT, self.asg_name
+                )
+            ),
+            "AutoScalingGroupName": self.asg_name,
+            "CapacityToTerminate": [
+                {
+                    "AvailabilityZone": REGION + zones[0],
+                    "Capacity": capacity,
+                    "InstanceMarketOption": "on-demand"
+                }
+            ],
+            "Instances": instances,
+            "Cause": "SCALE_IN",
+            "HasMoreInstances": False
+        })
+
+    def heartbeat_event(self, event):
+
+        """
+        The CloudTrail event EventBridge delivers after a heartbeat, which
+        is how the functions get re-invoked to carry on.
+        """
+
+        detail = event["detail"]
+        return({
+            "version": "0",
+            "id": detail["LifecycleActionToken"],
+            "detail-type": "AWS API Call via CloudTrail",
+            "source": "aws.autoscaling",
+            "detail": {
+                "eventName": "RecordLifecycleActionHeartbeat",
+                "requestParameters": {
+                    "lifecycleHookName": detail["LifecycleHookName"],
+                    "autoScalingGroupName": detail["AutoScalingGroupName"],
+                    "lifecycleActionToken": detail["LifecycleActionToken"],
+                    "instanceId": detail["EC2InstanceId"]
+                }
+            }
+        })
+
+    def add_continuation(self, event, delay):
+
+        """
+        Records an invocation a function arranged for itself, to carry on
+        with a hook delay seconds from now.
+        """
+
+        token = event["detail"]["LifecycleActionToken"]
+        self.continuations.setdefault(token, []).append(
+            (self.clock.now() + delay, event)
+        )
+
+    def next_continuation(self, token):
+
+        """
+        Returns the earliest invocation arranged to carry on with a hook,
+        as its due time and event, or None if there isn't one.
+        """
+
+        pending = self.continuations.get(token)
+        if not pending:
+            return(None)
+        pending.sort(key=lambda continuation: continuation[0])
+        return(pending.pop(0))
+
+    def sqs_record(self, event):
+
+        """
+        The SQS record the batch function receives when an EventBridge
+        rule forwards a lifecycle event to its queue.
+        """
+
+        message_id = "{:08x}-0000-4000-8000-{:012x}".format(
+            next(self._ids), next(self._ids)
+        )
+        return({
+            "messageId": message_id,
+            "receiptHandle": "receipt-" + message_id,
+            "body": json.dumps(event),
+            "attributes": {"ApproximateReceiveCount": "1"},
+            "eventSource": "aws:sqs",
+            "eventSourceARN": "arn:aws:sqs:{}:{}:{}-lifecycle-hooks".format(
+                REGION, ACCOUNT, self.cluster_name
+            ),
+            "awsRegion": REGION
+        })
+
+    def complete_hook(self, token, result):
+
+        """
+        Records a hook's result.  An instance allowed to terminate leaves
+        the cluster, taking anything still running on it with it.
+        """
+
+        self.hook_results[token] = result
+        instance_id, transition = self._hooks.get(token, (None, None))
+        if transition == "Terminating" and result == "CONTINUE":
+            self.terminate_instance(instance_id)
+
+    def terminate_instance(self, instance_id):
+
+        """
+        Removes an instance from the cluster, taking anything still running
+        on it with it.  Returns how many REPLICA service tasks it took,
+        which ECS would then have to start again elsewhere.
+        """
+
+        arn = self.ec2_instances.pop(instance_id, None)
+        if arn is None:
+            return(0)
+        lost = 0
+        for task in self._instance_tasks(arn):
+            service = self.services.get(task.get("serviceName"))
+            if service is not None and \
+                    service["schedulingStrategy"] == "REPLICA" and \
+                    task["desiredStatus"] == "RUNNING":
+                lost += 1
+            task["desiredStatus"] = "STOPPED"
+            self._stopped(task)
+            if service is not None:
+                self._track_healthy(service)
+        del self.instances[arn]
+        return(lost)
+
+    # Container instances
+
+    def instance_arn(self, arn_or_id):
+        if arn_or_id in self.instances:
+            return(arn_or_id)
+        for arn in self.instances:
+            if arn.endswith("/" + arn_or_id):
+                return(arn)
+        return(arn_or_id)
+
+    def match_instances(self, filter_expression=None, status=None):
+        instances = list(self.instances.values())
+        if filter_expression:
+            for clause in re.split(r"\s+and\s+", filter_expression.strip()):
+                instances = self._filter(instances, clause)
+        if status is not None:
+            instances = [i for i in instances if i["status"] == status]
+        return(instances)
+
+    def _filter(self, instances, clause):
+
+        """
+        Applies one clause of a cluster query language filter.  We only
+        understand == and in against ec2InstanceId and agentConnected.
+        """
+
+        match = re.match(
+            r"^(ec2InstanceId|agentConnected)\s*(==|in)\s*(.+)$", clause
+        )
+        if match is None:
+            raise(_client_error(
+                "InvalidParameterException", "ListContainerInstances",
+                "Unsupported filter expression in the simulator."
+            ))
+        attribute, operator, value = match.groups()
+        if operator == "in":
+            values = [v.strip() for v in value.strip("[] ").split(",")]
+        else:
+            values = [value.strip()]
+        if attribute == "agentConnected":
+            values = [v.lower() == "true" for v in values]
+        return([i for i in instances if i[attribute] in values])
+
+    def _instance_tasks(self, arn):
+        return([
+            t for t in self._instance_tasks_index.get(arn, {}).values()
+            if t["lastStatus"] != "STOPPED"
+        ])
+
+    def _remaining(self, arn):
+        cpu, memory = self.instance_cpu, self.instance_memory
+        for task in self._instance_tasks(arn):
+            cpu -= int(task["cpu"])
+            memory -= int(task["memory"])
+        return(cpu, memory)
+
+    def _used_ports(self, arn):
+        ports = set(RESERVED_PORTS)
+        for task in self._instance_tasks(arn):
+            definition = self.task_definitions.get(
+                task.get("taskDefinitionArn"), {}
+            )
+            for container in definition.get("containerDefinitions", []):
+                for mapping in container["portMappings"]:
+                    ports.add(str(mapping["hostPort"]))
+        return(ports)
+
+    def describe_instance(self, arn):
+        instance = dict(self.instances[arn])
+        tasks = self._instance_tasks(arn)
+        cpu, memory = self._remaining(arn)
+        instance["runningTasksCount"] = len(
+            [t for t in tasks if t["lastStatus"] == "RUNNING"]
+        )
+        instance["pendingTasksCount"] = len(
+            [t for t in tasks if t["lastStatus"] == "PENDING"]
+        )
+        instance["registeredResources"] = [
+            {"name": "CPU", "type": "INTEGER",
+             "integerValue": self.instance_cpu},
+            {"name": "MEMORY", "type": "INTEGER",
+             "integerValue": self.instance_memory},
+            {"name": "PORTS", "type": "STRINGSET",
+             "stringSetValue": list(RESERVED_PORTS)},
+        ]
+        instance["remainingResources"] = [
+            {"name": "CPU", "type": "INTEGER", "integerValue": cpu},
+            {"name": "MEMORY", "type": "INTEGER", "integerValue": memory},
+            {"name": "PORTS", "type": "STRINGSET",
+             "stringSetValue": sorted(self._used_ports(arn))},
+        ]
+        return(instance)
+
+    def set_instance_status(self, arn, status):
+        instance = self.instances[arn]
+        if instance["status"] == status:
+            return
+        instance["status"] = status
+        if status != "DRAINING":
+            return
+        for task in self._instance_tasks(arn):
+            service = self.services.get(task.get("serviceName"))
+            if service is None or service["schedulingStrategy"] == "DAEMON":
+                continue
+            if task["desiredStatus"] == "RUNNING":
+                self.clock.schedule(
+                    self.placement_delay,
+                    lambda task=task, service=service:
+                        self._replace(service, task)
+                )
+
+    # Services and tasks
+
+    def find_service(self, name_or_arn):
+        name = name_or_arn.rsplit("/", 1)[-1]
+        return(self.services.get(name))
+
+    def describe_service(self, service):
+        service_tasks = self._service_tasks_index[service["serviceName"]]
+        tasks = [
+            t for t in service_tasks.values()
+            if t["desiredStatus"] == "RUNNING"
+        ]
+        running = len([t for t in tasks if t["lastStatus"] == "RUNNING"])
+        pending = len([t for t in tasks if t["lastStatus"] == "PENDING"])
+        description = {
+            key: value for key, value in service.items()
+            if key not in ("cpu", "memory", "events")
+        }
+        description.update({
+            "runningCount": running,
+            "pendingCount": pending,
+            "events": list(service["events"][:100]),
+            "deployments": [{
+                "id": "ecs-svc/{}".format(service["serviceName"]),
+                "status": "PRIMARY",
+                "desiredCount": service["desiredCount"],
+                "runningCount": running,
+                "pendingCount": pending,
+                "rolloutState": "COMPLETED",
+                "createdAt": service["createdAt"],
+                "updatedAt": service["createdAt"]
+            }]
+        })
+        return(description)
+
+    def match_tasks(self, container_instance=None, service_name=None,
+                    desired_status="RUNNING"):
+        if container_instance is not None:
+            container_instance = self.instance_arn(container_instance)
+        return([
+            t for t in self.tasks.values()
+            if t["desiredStatus"] == desired_status
+            and (container_instance is None
+                 or t["containerInstanceArn"] == container_instance)
+            and (service_name is None
+                 or t.get("serviceName") == service_name.rsplit("/", 1)[-1])
+        ])
+
+    def _service_event(self, service, message):
+        service["events"].insert(0, {
+            "id": "{:032x}".format(next(self._ids)),
+            "createdAt": self._now(),
+            "message": "(service {}) {}".format(
+                service["serviceName"], message
+            )
+        })
+
+    def _new_task(self, service, container_instance_arn, status, cpu, memory):
+        arn = self._arn("task", "{:032x}".format(next(self._ids)))
+        task = {
+            "taskArn": arn,
+            "clusterArn": self._arn("cluster", "")[:-1],
+            "containerInstanceArn": container_instance_arn,
+            "lastStatus": status,
+            "desiredStatus": "RUNNING",
+            "cpu": str(cpu),
+            "memory": str(memory),
+            "launchType": "EC2",
+            "createdAt": self._now()
+        }
+        self.tasks[arn] = task
+        self._instance_tasks_index[container_instance_arn][arn] = task
+        return(task)
+
+    def _start_task(self, service, container_instance_arn, status):
+        task = self._new_task(
+            service, container_instance_arn, status,
+            service["cpu"], service["memory"]
+        )
+        task["taskDefinitionArn"] = service["taskDefinition"]
+        task["group"] = "service:{}".format(service["serviceName"])
+        task["startedBy"] = "ecs-svc/{}".format(service["serviceName"])
+        task["serviceName"] = service["serviceName"]
+        if service["loadBalancers"]:
+            task["containers"] = [{
+                "name": load_balancer["containerName"],
+                "networkBindings": [{
+                    "containerPort": load_balancer["containerPort"],
+                    "hostPort": next(self._host_ports),
+                    "protocol": "tcp"
+                }]
+            } for load_balancer in service["loadBalancers"]]
+        service_tasks = self._service_tasks_index[service["serviceName"]]
+        service_tasks[task["taskArn"]] = task
+        if status == "RUNNING":
+            self._register_targets(service, task)
+        return(task)
+
+    # Load balancer targets
+
+    def _register_targets(self, service, task):
+        instance_id = self.instances[
+            task["containerInstanceArn"]
+        ]["ec2InstanceId"]
+        keys = []
+        for load_balancer, container in zip(
+                service["loadBalancers"], task.get("containers", [])
+                ):
+            key = (instance_id, container["networkBindings"][0]["hostPort"])
+            self.target_groups[load_balancer["targetGroupArn"]][key] = {
+                "state": "healthy",
+                "deregistered_at": None,
+                "service": service["serviceName"]
+            }
+            keys.append((load_balancer["targetGroupArn"], key))
+        if keys:
+            self._task_targets[task["taskArn"]] = keys
+
+    def deregister_target(self, target_group_arn, key):
+
+        """
+        Starts a target's deregistration delay, unless it has already
+        started.  Returns when the target will have deregistered, or None
+        if it isn't registered.
+        """
+
+        target = self.target_groups.get(target_group_arn, {}).get(key)
+        if target is None:
+            return(None)
+        if target["state"] != "draining":
+            target["state"] = "draining"
+            target["deregistered_at"] = \
+                self.clock.now() + self.deregistration_delay
+            self.clock.schedule(
+                self.deregistration_delay,
+                lambda: self.target_groups.get(
+                    target_group_arn, {}
+                ).pop(key, None)
+            )
+            self._track_healthy(self.services[target["service"]])
+        return(target["deregistered_at"])
+
+    def _deregistering(self, task):
+        for target_group_arn, key in self._task_targets.get(
+                task["taskArn"], []
+                ):
+            target = self.target_groups.get(target_group_arn, {}).get(key)
+            if target is not None and target["state"] == "draining":
+                return(True)
+        return(False)
+
+    def _fits(self, arn, service):
+        cpu, memory = self._remaining(arn)
+        if cpu < service["cpu"] or memory < service["memory"]:
+            return(False)
+        definition = self.task_definitions[service["taskDefinition"]]
+        wanted = set(
+            str(mapping["hostPort"])
+            for container in definition["containerDefinitions"]
+            for mapping in container["portMappings"]
+        )
+        return(not wanted or not wanted & self._used_ports(arn))
+
+    def _next_instance(self, service):
+
+        """
+        Spreads tasks round robin while building the cluster, which is much
+        cheaper than searching for the least loaded instance every time.
+        """
+
+        arns = list(self.instances)
+        for _ in range(len(arns)):
+            arn = arns[self._placement_cursor % len(arns)]
+            self._placement_cursor += 1
+            if self._fits(arn, service):
+                return(arn)
+        return(None)
+
+    def _place(self, service):
+        best, best_tasks = None, None
+        for arn, instance in self.instances.items():
+            if instance["status"] != "ACTIVE":
+                continue
+            if not self._fits(arn, service):
+                continue
+            count = len(self._instance_tasks(arn))
+            if best is None or count < best_tasks:
+                best, best_tasks = arn, count
+        return(best)
+
+    def _track_healthy(self, service):
+
+        """
+        Records the lowest share of a REPLICA service's desired count
+        we've seen running, not being stopped and taking connections from
+        its load balancers, as a percentage.
+        """
+
+        if service["schedulingStrategy"] != "REPLICA" or \
+                not service["desiredCount"]:
+            return
+        healthy = len([
+            t for t in self._service_tasks_index[service["serviceName"]]
+            .values()
+            if t["desiredStatus"] == "RUNNING" and
+            t["lastStatus"] == "RUNNING" and not self._deregistering(t)
+        ])
+        name = service["serviceName"]
+        self.lowest_healthy[name] = min(
+            self.lowest_healthy.get(name, 100),
+            100.0 * healthy / service["desiredCount"]
+        )
+
+    def stop_task(self, task_arn):
+        task = self.tasks[task_arn]
+        if task["desiredStatus"] == "STOPPED":
+            return
+        task["desiredStatus"] = "STOPPED"
+        service = self.services.get(task.get("serviceName"))
+        if service is not None:
+            self._track_healthy(service)
+        # ECS deregisters the task's targets and waits out their
+        # deregistration delay before stopping its containers.
+        wait = 0
+        for target_group_arn, key in self._task_targets.get(task_arn, []):
+            deregistered_at = self.deregister_target(target_group_arn, key)
+            if deregistered_at is not None:
+                wait = max(wait, deregistered_at - self.clock.now())
+        self.clock.schedule(
+            wait + self.task_stop_seconds, lambda: self._stopped(task)
+        )
+
+    def _stopped(self, task):
+        task["lastStatus"] = "STOPPED"
+        for target_group_arn, key in self._task_targets.pop(
+                task["taskArn"], []
+                ):
+            self.target_groups.get(target_group_arn, {}).pop(key, None)
+        service = self.services.get(task.get("serviceName"))
+        if service is not None and service["schedulingStrategy"] == "DAEMON":
+            # ECS doesn't run daemons on instances that aren't ACTIVE, so
+            # one stopped on a draining instance isn't wanted any more.
+            instance = self.instances[task["containerInstanceArn"]]
+            if instance["status"] != "ACTIVE":
+                service["desiredCount"] -= 1
+        if service is not None:
+            self._check_steady(service)
+
+    def _replace(self, service, old_task):
+        if old_task["desiredStatus"] != "RUNNING":
+            return
+        deployment = service["deploymentConfiguration"]
+        start_first = deployment["maximumPercent"] > 100
+
+        target = self._place(service)
+        if target is None:
+            self._service_event(
+                service,
+                "was unable to place a task because no container instance "
+                "met all of its requirements."
+            )
+            if not start_first:
+                self.stop_task(old_task["taskArn"])
+            self.clock.schedule(
+                self.retry_placement_seconds,
+                lambda: self._replace(service, old_task)
+                if start_first else self._start_replacement(service)
+            )
+            return
+
+        new_task = self._start_task(service, target, "PENDING")
+        self._service_event(service, "has started 1 tasks: (task {}).".format(
+            new_task["taskArn"].rsplit("/", 1)[-1]
+        ))
+        if start_first:
+            self.clock.schedule(
+                self.task_start_seconds,
+                lambda: self._running(service, new_task, old_task)
+            )
+        else:
+            self.stop_task(old_task["taskArn"])
+            self.clock.schedule(
+                self.task_start_seconds,
+                lambda: self._running(service, new_task, None)
+            )
+
+    def _start_replacement(self, service):
+        target = self._place(service)
+        if target is None:
+            self.clock.schedule(
+                self.retry_placement_seconds,
+                lambda: self._start_replacement(service)
+            )
+            return
+        new_task = self._start_task(service, target, "PENDING")
+        self.clock.schedule(
+            self.task_start_seconds,
+            lambda: self._running(service, new_task, None)
+        )
+
+    def _running(self, service, new_task, old_task):
+        new_task["lastStatus"] = "RUNNING"
+        self._register_targets(service, new_task)
+        if old_task is not None:
+            self._service_event(
+                service, "has stopped 1 running tasks: (task {}).".format(
+                    old_task["taskArn"].rsplit("/", 1)[-1]
+                )
+            )
+            self.stop_task(old_task["taskArn"])
+        self._check_steady(service)
+
+    def _check_steady(self, service):
+        for task in self._service_tasks_index[service["serviceName"]].values():
+            if task["lastStatus"] != task["desiredStatus"]:
+                return
+        self._service_event(service, "has reached a steady state.")
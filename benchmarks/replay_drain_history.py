@@ -0,0 +1,74 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Replays a recorded drain time history offline, predicting each wait from
+the ones before it, to see how well different percentiles would have
+predicted when drains and stabilizations finish.
+
+The history is the JSON the terminate function keeps in its state store
+under drain-model:<cluster name>, or what run_benchmarks.py writes with
+--dump-drain-history.
+
+    python benchmarks/replay_drain_history.py history.json
+    python benchmarks/replay_drain_history.py history.json --percentiles 75 95
+"""
+
+import argparse
+import json
+import os
+import sys
+
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "lambda"
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("history", help="a JSON drain time history")
+    parser.add_argument("--percentiles", type=float, nargs="+",
+                        default=[50, 90, 99])
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, LAMBDA_DIR)
+    from lifecycle_core.drain_model import backtest
+
+    with open(args.history) as f:
+        history = json.load(f)
+
+    row = "{:<40} {:>7} {:>11} {:>10} {:>6} {:>13}"
+    print(row.format(
+        "history", "samples", "percentile", "mean error", "late",
+        "mean oversleep"
+    ))
+    for key, samples in sorted(history.items()):
+        for percentile in args.percentiles:
+            result = backtest(samples, percentile)
+            if not result["predictions"]:
+                continue
+            print(row.format(
+                key,
+                len(samples),
+                "{:g}".format(percentile),
+                "{:.1f}".format(result["mean_error"]),
+                "{}/{}".format(result["late"], result["predictions"]),
+                "-" if result["mean_overslept"] is None
+                else "{:.1f}".format(result["mean_overslept"])
+            ))
+
+
+if __name__ == "__main__":
+    main()
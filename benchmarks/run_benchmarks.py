@@ -0,0 +1,655 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Runs the lifecycle hook functions against simulated clusters of
+increasing size and reports what each hook cost: how many invocations
+and AWS API calls it took, how long it took in (virtual) wall time, and
+how much real CPU time the function code burned.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10 100 --breakdown
+    python benchmarks/run_benchmarks.py --env STABILITY_SCOPE=drain
+    python benchmarks/run_benchmarks.py --hooks launch --launches 20 \\
+        --env LAUNCH_WATCH_MODE=cluster
+    python benchmarks/run_benchmarks.py --hooks terminate --terminations 10 \\
+        --env STABILITY_SHARED=true
+    python benchmarks/run_benchmarks.py --hooks batch --terminations 10 \\
+        --launches 10
+    python benchmarks/run_benchmarks.py --hooks spot --interruptions 5
+
+Function settings are read from the environment when the functions are
+imported, so pass them with --env rather than changing them afterwards.
+"""
+
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_aws import ClusterSimulator
+from fake_aws import FakeContext
+from fake_aws import VirtualClock
+
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "lambda"
+)
+
+HANDLERS = {
+    "terminate": "ecs-lifecycle-hook-terminate.py",
+    "launch": "ecs-lifecycle-hook-launch.py",
+    "batch": "ecs-lifecycle-hook-batch.py",
+    "policy": "ecs-termination-policy.py",
+    "spot": "ecs-spot-interruption.py",
+}
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+
+
+def load_handler(name):
+
+    """
+    Imports one of the function files.  Their names have hyphens in them,
+    so we load them by path the way Lambda loads function.py.
+    """
+
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    spec = importlib.util.spec_from_file_location(
+        "bench_" + name, os.path.join(LAMBDA_DIR, HANDLERS[name])
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return(module)
+
+
+def reset_function_state(simulator):
+
+    """
+    Points the functions at a fresh simulator and forgets what a warm
+    container would have remembered from earlier scenarios, so each
+    scenario runs as if on a newly started container.
+    """
+
+    from lifecycle_core import cluster_name
+    from lifecycle_core import clients
+    from lifecycle_core import polling
+    from lifecycle_core.state import MemoryStateStore
+    from lifecycle_core.state import set_state_store
+
+    clients.set_client("ecs", simulator.ecs)
+    clients.set_client("autoscaling", simulator.autoscaling)
+    clients.set_client("ec2", simulator.ec2)
+    clients.set_client("sqs", simulator.sqs)
+    clients.set_client("lambda", simulator.lambda_)
+    clients.set_client("scheduler", simulator.scheduler)
+    clients.set_client("elbv2", simulator.elbv2)
+    set_state_store(MemoryStateStore())
+    cluster_name._cluster_names.clear()
+    polling._convergence.clear()
+
+
+def _run_hook(handler, simulator, event, timeout, retry_delay,
+              max_invocations):
+    token = event["detail"]["LifecycleActionToken"]
+    invocations = 0
+    busy = 0
+    invocation_event = event
+
+    with simulator.clock.participant():
+        while token not in simulator.hook_results:
+            if invocations >= max_invocations:
+                break
+            invocations += 1
+            started = simulator.clock.now()
+            handler.lambda_handler(
+                copy.deepcopy(invocation_event),
+                FakeContext(simulator.clock, timeout)
+            )
+            busy += simulator.clock.now() - started
+            if token in simulator.hook_results:
+                break
+            with simulator.lock:
+                continuation = simulator.next_continuation(token)
+            if continuation is not None:
+                due, invocation_event = continuation
+                simulator.clock.sleep(max(0, due - simulator.clock.now()))
+            else:
+                simulator.clock.sleep(retry_delay)
+                invocation_event = simulator.heartbeat_event(event)
+
+    return(invocations, busy)
+
+
+def run_hooks(handler, simulator, events, timeout, retry_delay,
+              max_invocations, verbose=False):
+
+    """
+    Invokes a function for each lifecycle hook the way EventBridge would,
+    re-invoking it after each heartbeat until it completes the hook, or
+    when it asks to be invoked again to carry on.  When
+    there are several hooks their invocations run side by side, as they
+    would in Lambda.
+    """
+
+    simulator.reset_calls()
+    started = simulator.clock.now()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        with ThreadPoolExecutor(max_workers=len(events)) as pool:
+            runs = list(pool.map(
+                lambda event: _run_hook(
+                    handler, simulator, event, timeout, retry_delay,
+                    max_invocations
+                ),
+                events
+            ))
+    if verbose:
+        sys.stdout.write(output.getvalue())
+
+    outcomes = {}
+    for event in events:
+        outcome = simulator.hook_results.get(
+            event["detail"]["LifecycleActionToken"], "INCOMPLETE"
+        )
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    return({
+        "hooks": len(events),
+        "invocations": sum(run[0] for run in runs),
+        "busy_seconds": sum(run[1] for run in runs),
+        "api_calls": sum(simulator.calls.values()),
+        "calls": dict(sorted(simulator.calls.items())),
+        "virtual_seconds": simulator.clock.now() - started,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "wall_seconds": time.perf_counter() - wall_started,
+        "result": " ".join(
+            "{}x{}".format(count, outcome) if len(events) > 1 else outcome
+            for outcome, count in sorted(outcomes.items())
+        ),
+    })
+
+
+def _run_batch(handler, simulator, records, timeout):
+    started = simulator.clock.now()
+    response = handler.lambda_handler(
+        {"Records": copy.deepcopy(records)},
+        FakeContext(simulator.clock, timeout)
+    )
+    failed = set(
+        failure["itemIdentifier"]
+        for failure in response["batchItemFailures"]
+    )
+    return(
+        [record for record in records if record["messageId"] in failed],
+        simulator.clock.now() - started
+    )
+
+
+def run_batches(handler, simulator, events, batch_size, timeout, retry_delay,
+                max_invocations, verbose=False):
+
+    """
+    Delivers the lifecycle events to the SQS batch function the way an
+    event source mapping would: in batches of up to batch_size, with one
+    invocation per batch running side by side.  Messages reported as
+    batch item failures are delivered again retry_delay seconds after
+    the invocations finish.
+
+    Each hook the function works on becomes a clock participant, so the
+    hooks in a batch share a timeline just as separate invocations do.
+    """
+
+    run_hook = handler.run_hook
+
+    def participating(*args):
+        with simulator.clock.participant():
+            return(run_hook(*args))
+
+    simulator.reset_calls()
+    started = simulator.clock.now()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    pending = [simulator.sqs_record(event) for event in events]
+    invocations = 0
+    busy = 0
+    rounds = 0
+
+    output = io.StringIO()
+    handler.run_hook = participating
+    try:
+        with contextlib.redirect_stdout(output):
+            while pending and rounds < max_invocations:
+                rounds += 1
+                batches = [
+                    pending[start:start + batch_size]
+                    for start in range(0, len(pending), batch_size)
+                ]
+                invocations += len(batches)
+                with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+                    runs = list(pool.map(
+                        lambda batch: _run_batch(
+                            handler, simulator, batch, timeout
+                        ),
+                        batches
+                    ))
+                pending = [record for run in runs for record in run[0]]
+                busy += sum(run[1] for run in runs)
+                if pending:
+                    simulator.clock.sleep(retry_delay)
+    finally:
+        handler.run_hook = run_hook
+    if verbose:
+        sys.stdout.write(output.getvalue())
+
+    outcomes = {}
+    for event in events:
+        outcome = simulator.hook_results.get(
+            event["detail"]["LifecycleActionToken"], "INCOMPLETE"
+        )
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    return({
+        "hooks": len(events),
+        "invocations": invocations,
+        "busy_seconds": busy,
+        "api_calls": sum(simulator.calls.values()),
+        "calls": dict(sorted(simulator.calls.items())),
+        "virtual_seconds": simulator.clock.now() - started,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "wall_seconds": time.perf_counter() - wall_started,
+        "result": " ".join(
+            "{}x{}".format(count, outcome) if len(events) > 1 else outcome
+            for outcome, count in sorted(outcomes.items())
+        ),
+    })
+
+
+def _run_spot(handler, simulator, event, timeout):
+    instance_id = event["detail"]["instance-id"]
+
+    with simulator.clock.participant():
+        started = simulator.clock.now()
+        handler.lambda_handler(
+            copy.deepcopy(event),
+            FakeContext(simulator.clock, timeout)
+        )
+        busy = simulator.clock.now() - started
+        # However the drain went, the instance is only gone once EC2
+        # reclaims it.
+        while instance_id not in simulator.spot_results:
+            simulator.clock.sleep(1)
+
+    return(busy)
+
+
+def run_spot(handler, simulator, events, timeout, verbose=False):
+
+    """
+    Invokes the Spot interruption function once for each interruption
+    warning, as EventBridge would, and waits for EC2 to reclaim the
+    instances.  The result is whether each instance's REPLICA service tasks
+    had been replaced by then.
+    """
+
+    simulator.reset_calls()
+    started = simulator.clock.now()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        with ThreadPoolExecutor(max_workers=len(events)) as pool:
+            busy = list(pool.map(
+                lambda event: _run_spot(handler, simulator, event, timeout),
+                events
+            ))
+    if verbose:
+        sys.stdout.write(output.getvalue())
+
+    outcomes = {}
+    for event in events:
+        outcome = simulator.spot_results[event["detail"]["instance-id"]]
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    return({
+        "hooks": len(events),
+        "invocations": len(events),
+        "busy_seconds": sum(busy),
+        "api_calls": sum(simulator.calls.values()),
+        "calls": dict(sorted(simulator.calls.items())),
+        "virtual_seconds": simulator.clock.now() - started,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "wall_seconds": time.perf_counter() - wall_started,
+        "result": " ".join(
+            "{}x{}".format(count, outcome) if len(events) > 1 else outcome
+            for outcome, count in sorted(outcomes.items())
+        ),
+    })
+
+
+def run_policy(handler, simulator, verbose=False):
+
+    """
+    Asks the termination policy function to pick an instance to terminate
+    from every instance in the group.
+    """
+
+    simulator.reset_calls()
+    started = simulator.clock.now()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        response = handler.lambda_handler(
+            simulator.termination_policy_event(),
+            FakeContext(simulator.clock)
+        )
+    if verbose:
+        sys.stdout.write(output.getvalue())
+
+    return({
+        "hooks": 1,
+        "invocations": 1,
+        "busy_seconds": simulator.clock.now() - started,
+        "api_calls": sum(simulator.calls.values()),
+        "calls": dict(sorted(simulator.calls.items())),
+        "virtual_seconds": simulator.clock.now() - started,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "wall_seconds": time.perf_counter() - wall_started,
+        "result": " ".join(response["InstanceIDs"]),
+    })
+
+
+def build_cluster(clock, size, args):
+    services = max(1, size * args.tasks_per_instance // args.tasks_per_service)
+    return(ClusterSimulator.build(
+        size,
+        services,
+        args.tasks_per_service,
+        standalone_per_instance=args.standalone_per_instance,
+        daemon_services=args.daemon_services,
+        minimum_healthy_percent=args.minimum_healthy_percent,
+        maximum_percent=args.maximum_percent,
+        clock=clock,
+        api_latency=args.api_latency,
+        instance_cpu=args.instance_cpu,
+        instance_memory=args.instance_memory,
+        task_start_seconds=args.task_start_seconds,
+        task_stop_seconds=args.task_stop_seconds,
+        deregistration_delay=args.deregistration_delay,
+    ))
+
+
+def benchmark(handlers, clock, size, args):
+    results = []
+
+    if "terminate" in handlers:
+        simulator = build_cluster(clock, size, args)
+        reset_function_state(simulator)
+        for round_number in range(1, args.rounds + 1):
+            simulator.lowest_healthy.clear()
+            result = run_hooks(
+                handlers["terminate"],
+                simulator,
+                [
+                    simulator.begin_termination()
+                    for _ in range(args.terminations)
+                ],
+                args.timeout,
+                args.retry_delay,
+                args.max_invocations,
+                args.verbose
+            )
+            result.update(
+                scenario="terminate" if args.rounds == 1
+                else "terminate/{}".format(round_number),
+                instances=size,
+                tasks=len(simulator.tasks),
+                min_healthy=min(simulator.lowest_healthy.values(), default=100)
+            )
+            results.append(result)
+        if args.dump_drain_history:
+            from lifecycle_core.drain_model import load_drain_model
+            with open(args.dump_drain_history, "w") as f:
+                json.dump(
+                    load_drain_model(simulator.cluster_name).history,
+                    f,
+                    indent=2
+                )
+
+    if "launch" in handlers:
+        simulator = build_cluster(clock, size, args)
+        reset_function_state(simulator)
+        result = run_hooks(
+            handlers["launch"],
+            simulator,
+            [
+                simulator.begin_launch(
+                    register_after=args.register_after,
+                    warm_pool=args.warm_pool
+                )
+                for _ in range(args.launches)
+            ],
+            args.timeout,
+            args.retry_delay,
+            args.max_invocations,
+            args.verbose
+        )
+        result.update(scenario="launch", instances=size,
+                      tasks=len(simulator.tasks))
+        results.append(result)
+
+    if "batch" in handlers:
+        simulator = build_cluster(clock, size, args)
+        reset_function_state(simulator)
+        events = [
+            simulator.begin_termination()
+            for _ in range(args.terminations)
+        ] + [
+            simulator.begin_launch(register_after=args.register_after)
+            for _ in range(args.launches)
+        ]
+        result = run_batches(
+            handlers["batch"],
+            simulator,
+            events,
+            args.batch_size,
+            args.timeout,
+            args.retry_delay,
+            args.max_invocations,
+            args.verbose
+        )
+        result.update(scenario="batch", instances=size,
+                      tasks=len(simulator.tasks),
+                      min_healthy=min(simulator.lowest_healthy.values(),
+                                      default=100))
+        results.append(result)
+
+    if "spot" in handlers:
+        simulator = build_cluster(clock, size, args)
+        reset_function_state(simulator)
+        result = run_spot(
+            handlers["spot"],
+            simulator,
+            [
+                simulator.begin_spot_interruption()
+                for _ in range(args.interruptions)
+            ],
+            args.spot_timeout,
+            args.verbose
+        )
+        result.update(scenario="spot", instances=size,
+                      tasks=len(simulator.tasks))
+        results.append(result)
+
+    if "policy" in handlers:
+        simulator = build_cluster(clock, size, args)
+        reset_function_state(simulator)
+        result = run_policy(handlers["policy"], simulator, args.verbose)
+        result.update(scenario="policy", instances=size,
+                      tasks=len(simulator.tasks))
+        results.append(result)
+
+    return(results)
+
+
+def print_results(results, breakdown):
+    row = "{:<12} {:>9} {:>7} {:>5} {:>7} {:>9} {:>9} {:>6} {:>7} " \
+        "{:>7}  {}"
+    print(row.format(
+        "hook", "instances", "tasks", "hooks", "invokes", "api calls",
+        "virtual s", "busy s", "cpu s", "wall s", "result"
+    ))
+    for result in results:
+        outcome = result["result"]
+        if "min_healthy" in result:
+            # The lowest share of any service's tasks left running while
+            # the hooks worked.
+            outcome += " ({:.0f}% healthy)".format(result["min_healthy"])
+        print(row.format(
+            result["scenario"],
+            result["instances"],
+            result["tasks"],
+            result["hooks"],
+            result["invocations"],
+            result["api_calls"],
+            "{:.0f}".format(result["virtual_seconds"]),
+            "{:.0f}".format(result["busy_seconds"]),
+            "{:.3f}".format(result["cpu_seconds"]),
+            "{:.3f}".format(result["wall_seconds"]),
+            outcome
+        ))
+        if breakdown:
+            for operation, count in result["calls"].items():
+                print("    {:<40} {:>7}".format(operation, count))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="cluster sizes in instances to benchmark")
+    parser.add_argument("--hooks", nargs="+", choices=sorted(HANDLERS),
+                        default=["terminate", "launch"],
+                        help="which lifecycle hooks to benchmark")
+    parser.add_argument("--tasks-per-instance", type=int, default=4)
+    parser.add_argument("--tasks-per-service", type=int, default=20)
+    parser.add_argument("--standalone-per-instance", type=int, default=0)
+    parser.add_argument("--daemon-services", type=int, default=0)
+    parser.add_argument("--minimum-healthy-percent", type=int, default=100,
+                        help="the services' minimumHealthyPercent")
+    parser.add_argument("--maximum-percent", type=int, default=200,
+                        help="the services' maximumPercent")
+    parser.add_argument("--instance-cpu", type=int, default=2048,
+                        help="CPU units each instance offers")
+    parser.add_argument("--instance-memory", type=int, default=7936,
+                        help="MiB of memory each instance offers")
+    parser.add_argument("--terminations", type=int, default=1,
+                        help="instances terminated at once in the "
+                             "terminate scenario")
+    parser.add_argument("--launches", type=int, default=1,
+                        help="instances launched at once in the launch "
+                             "scenario")
+    parser.add_argument("--interruptions", type=int, default=1,
+                        help="Spot instances interrupted at once in the "
+                             "spot scenario")
+    parser.add_argument("--batch-size", type=int, default=10,
+                        help="most SQS messages handed to one batch "
+                             "function invocation")
+    parser.add_argument("--rounds", type=int, default=1,
+                        help="terminate scenarios to run one after another "
+                             "on the same cluster")
+    parser.add_argument("--dump-drain-history", metavar="PATH",
+                        help="write the terminate scenario's drain time "
+                             "history to a file for replay_drain_history.py")
+    parser.add_argument("--task-start-seconds", type=float, default=30,
+                        help="seconds a replacement task takes to start")
+    parser.add_argument("--task-stop-seconds", type=float, default=30,
+                        help="seconds a draining task takes to stop")
+    parser.add_argument("--deregistration-delay", type=float,
+                        help="put each service behind a target group with "
+                             "this deregistration delay in seconds")
+    parser.add_argument("--register-after", type=float, default=60,
+                        help="seconds before a launched instance registers")
+    parser.add_argument("--warm-pool", choices=["into", "from"],
+                        help="launch into, or out of, a warm pool in the "
+                             "launch scenario")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="virtual seconds each API call takes")
+    parser.add_argument("--timeout", type=float, default=300,
+                        help="the function timeout in seconds")
+    parser.add_argument("--spot-timeout", type=float, default=150,
+                        help="the Spot interruption function timeout in "
+                             "seconds")
+    parser.add_argument("--retry-delay", type=float, default=30,
+                        help="seconds between a heartbeat and the "
+                             "invocation it triggers")
+    parser.add_argument("--max-invocations", type=int, default=50)
+    parser.add_argument("--env", action="append", default=[],
+                        metavar="KEY=VALUE",
+                        help="a function setting, may be repeated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--breakdown", action="store_true",
+                        help="show the API calls made by operation")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the functions' own output")
+    return(parser.parse_args(argv))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        os.environ[key] = value
+    os.environ.setdefault("ECS_CLUSTER_NAME", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    random.seed(args.seed)
+
+    # The clock has to be in place before the functions are imported, as
+    # the rate limiter's token buckets are created at import time.
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    from lifecycle_core import clock as lifecycle_clock
+    clock = VirtualClock()
+    lifecycle_clock.set_clock(clock.now, clock.sleep)
+
+    handlers = dict((name, load_handler(name)) for name in args.hooks)
+
+    results = []
+    for size in args.sizes:
+        results.extend(benchmark(handlers, clock, size, args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results, args.breakdown)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from lifecycle_core import metrics
+from lifecycle_core.clients import begin_invocation
+from lifecycle_core.clients import client_setup_seconds
+from lifecycle_core.clients import get_client
+from lifecycle_core.clients import lazy_client
+from lifecycle_core.hooks import normalize_hook_message
+from lifecycle_core.launch_hook import process_launch_hook
+from lifecycle_core.ratelimit import report_api_usage
+from lifecycle_core.terminate_hook import process_terminate_hook
+
+# How many hooks from a batch we work on at once.  Each runs its
+# blocking boto3 calls on a thread of its own, so this should be at least
+# the event source mapping's batch size or hooks will queue for a thread.
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "10"))
+
+# A hook we've sent a heartbeat for goes back on the queue, and this is
+# how many seconds until it's delivered to us again.  Without it the
+# message only comes back once the queue's visibility timeout runs out,
+# which the template sets to six times our timeout.
+BATCH_RETRY_DELAY = int(os.environ.get("BATCH_RETRY_DELAY", "30"))
+
+# The workflow, and metrics name, for each lifecycle transition.
+HOOK_WORKFLOWS = {
+    "autoscaling:EC2_INSTANCE_LAUNCHING": ("launch", process_launch_hook),
+    "autoscaling:EC2_INSTANCE_TERMINATING": (
+        "terminate",
+        process_terminate_hook
+    )
+}
+
+
+def read_hook_message(record):
+
+    """
+    Turns an SQS record into a hook message.  The body is either the
+    EventBridge event our rules forward to the queue, or a notification
+    AutoScaling sent to the queue directly, which is the same as the
+    event's detail.
+
+    Returns None for AutoScaling's test notification and anything else
+    that isn't a lifecycle hook we handle.
+    """
+
+    body = json.loads(record["body"])
+    if "detail" not in body:
+        body = {"detail": body}
+    if "LifecycleHookName" not in body["detail"] and \
+            "requestParameters" not in body["detail"]:
+        return(None)
+
+    hook_message = normalize_hook_message(body)
+    if hook_message.get("LifecycleTransition") not in HOOK_WORKFLOWS:
+        return(None)
+
+    return(hook_message)
+
+
+def run_hook(hook_message, context):
+
+    """
+    Works one hook from the batch on a worker thread, recording its
+    metrics as its own invocation would.  Returns the action we took, or
+    "RETRY" if the workflow raised and the hook should be tried again.
+    """
+
+    hook, workflow = HOOK_WORKFLOWS[hook_message["LifecycleTransition"]]
+    metrics.start_recording(hook)
+    print("Working {} hook for instance {}".format(
+        hook,
+        hook_message["EC2InstanceId"]
+    ))
+
+    try:
+        return(workflow(
+            lazy_client('ec2'),
+            get_client('ecs'),
+            get_client('autoscaling'),
+            hook_message,
+            context
+        ))
+
+    except Exception as e:
+        print("Exception working hook for instance {}: {}".format(
+            hook_message["EC2InstanceId"],
+            e
+        ))
+        return("RETRY")
+
+    finally:
+        metrics.stop_recording()
+
+
+async def process_batch(hook_messages, context):
+
+    """
+    Works every hook in the batch at once.  The event loop hands each
+    hook to a thread pool, since boto3 blocks, and gathers their actions
+    in the same order as the messages.
+    """
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as pool:
+        return(await asyncio.gather(*[
+            loop.run_in_executor(pool, run_hook, hook_message, context)
+            for hook_message in hook_messages
+        ]))
+
+
+def _queue_url(event_source_arn):
+
+    """
+    Builds a queue's URL from its ARN, which saves asking SQS for it.
+    """
+
+    _, _, _, region, account, name = event_source_arn.split(":")
+    return("https://sqs.{}.amazonaws.com/{}/{}".format(region, account, name))
+
+
+def delay_retries(sqs_c, records):
+
+    """
+    Shortens the visibility timeout of the messages going back on the
+    queue to BATCH_RETRY_DELAY, so their hooks carry on as soon as our
+    heartbeat would have got us re-invoked.  This is best effort, if it
+    fails the messages come back after the queue's visibility timeout.
+    """
+
+    queues = {}
+    for record in records:
+        queues.setdefault(record["eventSourceARN"], []).append(record)
+
+    for event_source_arn, queue_records in queues.items():
+        for start in range(0, len(queue_records), 10):
+            try:
+                sqs_c.change_message_visibility_batch(
+                    QueueUrl=_queue_url(event_source_arn),
+                    Entries=[
+                        {
+                            "Id": record["messageId"],
+                            "ReceiptHandle": record["receiptHandle"],
+                            "VisibilityTimeout": BATCH_RETRY_DELAY
+                        }
+                        for record in queue_records[start:start + 10]
+                    ]
+                )
+            except Exception as e:
+                print(" ! Unable to shorten the retry delay: {}".format(e))
+
+
+def lambda_handler(event, context):
+
+    """
+    Consumes a batch of lifecycle hook notifications from SQS and works
+    them concurrently.  Hooks that need more time are returned as batch
+    item failures, which puts their messages back on the queue so we're
+    handed them again, in place of the heartbeat re-invocation the launch
+    and terminate functions rely on.
+    """
+
+    metrics.start_recording("batch")
+    invocation = begin_invocation()
+    if invocation["cold_start"]:
+        print("Cold start, importing the AWS SDK took {:.3f} seconds".format(
+            invocation["sdk_import_seconds"]
+        ))
+
+    print("Received {} messages".format(len(event["Records"])))
+
+    # A hook can be on the queue more than once, such as when a message
+    # comes back while AutoScaling has also sent it again.  We only work
+    # each hook once and give all its messages the same outcome.
+    hooks = {}
+    for record in event["Records"]:
+        hook_message = read_hook_message(record)
+        if hook_message is None:
+            print("- Ignoring message {}".format(record["messageId"]))
+            continue
+        token = hook_message["LifecycleActionToken"]
+        hooks.setdefault(token, (hook_message, []))[1].append(record)
+
+    print("Working {} lifecycle hooks . . .".format(len(hooks)))
+    failures = []
+
+    try:
+        actions = asyncio.run(process_batch(
+            [hook_message for hook_message, _ in hooks.values()],
+            context
+        ))
+
+        outcomes = {}
+        for (hook_message, records), action in zip(hooks.values(), actions):
+            outcomes[action] = outcomes.get(action, 0) + 1
+            if action in ("HEARTBEAT", "RETRY"):
+                failures.extend(records)
+        print(". . . {}".format(", ".join(
+            "{} {}".format(count, action)
+            for action, count in sorted(outcomes.items())
+        ) or "nothing to do"))
+
+        if failures:
+            delay_retries(lazy_client('sqs'), failures)
+
+    finally:
+        print("Creating AWS clients took {:.3f} seconds".format(
+            client_setup_seconds()
+        ))
+        report_api_usage()
+        metrics.stop_recording()
+
+    return({
+        "batchItemFailures": [
+            {"itemIdentifier": record["messageId"]} for record in failures
+        ]
+    })
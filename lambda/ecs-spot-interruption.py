@@ -0,0 +1,223 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import datetime
+import json
+import os
+
+from lifecycle_core import clock
+from lifecycle_core import metrics
+from lifecycle_core.clients import begin_invocation
+from lifecycle_core.clients import client_setup_seconds
+from lifecycle_core.clients import get_client
+from lifecycle_core.clients import lazy_client
+from lifecycle_core.cluster_name import find_cluster_name
+from lifecycle_core.polling import PollScheduler
+from lifecycle_core.ratelimit import report_api_usage
+from lifecycle_core.terminate_hook import check_instance_drained
+from lifecycle_core.terminate_hook import drain_instance
+from lifecycle_core.terminate_hook import find_container_instance_id
+
+# The EventBridge detail types we handle.  EC2 reclaims a Spot instance
+# two minutes after its interruption warning.  A rebalance recommendation
+# comes earlier, when EC2 sees the instance is at higher risk of being
+# interrupted, and has no deadline.
+INTERRUPTION_WARNING = "EC2 Spot Instance Interruption Warning"
+REBALANCE_RECOMMENDATION = "EC2 Instance Rebalance Recommendation"
+INTERRUPTION_WARNING_SECONDS = 120
+
+# Seconds before EC2 reclaims the instance by which we want to be done.
+SPOT_DEADLINE_MARGIN = float(os.environ.get("SPOT_DEADLINE_MARGIN", "5"))
+
+# Seconds between checks on a draining Spot instance.  Much closer
+# together than POLL_MIN_INTERVAL/POLL_MAX_INTERVAL, as the whole drain
+# has to fit in the two minute warning.
+SPOT_POLL_MIN_INTERVAL = float(os.environ.get("SPOT_POLL_MIN_INTERVAL", "1"))
+SPOT_POLL_MAX_INTERVAL = float(os.environ.get("SPOT_POLL_MAX_INTERVAL", "5"))
+
+# Whether a rebalance recommendation drains the instance too.  That gets
+# its tasks moved well before any interruption, at the cost of the
+# instance sitting idle if it turns out not to be interrupted.  Only turn
+# it on along with the group's Capacity Rebalancing, which replaces the
+# instance; without it the cluster is left an instance short.
+SPOT_DRAIN_ON_REBALANCE = os.environ.get(
+    "SPOT_DRAIN_ON_REBALANCE",
+    "false"
+) == "true"
+
+
+def find_deadline(event):
+
+    """
+    Works out when we need to have finished draining, as an epoch time:
+    SPOT_DEADLINE_MARGIN seconds before EC2 reclaims the instance, which is
+    two minutes after the time on the interruption warning.
+
+    Returns None for a rebalance recommendation, where we only have the
+    Lambda function's own timeout to keep to.
+    """
+
+    if event["detail-type"] != INTERRUPTION_WARNING:
+        return(None)
+
+    warned_at = clock.now()
+    if "time" in event:
+        warned_at = datetime.datetime.strptime(
+            event["time"],
+            "%Y-%m-%dT%H:%M:%SZ"
+        ).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    return(warned_at + INTERRUPTION_WARNING_SECONDS - SPOT_DEADLINE_MARGIN)
+
+
+def find_asg_name(asg_c, instance_id):
+
+    """
+    Looks up the AutoScaling group an instance belongs to, which Spot
+    events don't tell us the way lifecycle hooks do.
+
+    Returns None if the instance isn't in a group.
+    """
+
+    response = asg_c.describe_auto_scaling_instances(
+        InstanceIds=[
+            instance_id
+        ]
+    )
+
+    for instance in response["AutoScalingInstances"]:
+        return(instance["AutoScalingGroupName"])
+
+    return(None)
+
+
+def fast_drain(ec2_c, ecs_c, asg_c, instance_id, deadline, context):
+
+    """
+    Sets an instance to DRAINING as soon as we know which container
+    instance it is, then watches the drain with quick polls until it's
+    done or the deadline passes.
+
+    Unlike the terminate hook we don't check the cluster has room for the
+    tasks or wait for it to be stable afterwards.  The instance is going
+    either way, and there isn't time.  ECS carries on draining if we run
+    out of time, so the watching is only to report how the drain went.
+
+    Returns "DRAINED", or "OUT-OF-TIME" if the deadline came first.
+    """
+
+    print("Determining our ECS Cluster name . . .")
+    # The group is only needed for the cluster name tag, so we don't spend
+    # an AutoScaling call of the deadline on it when we're told the name.
+    asg_name = None
+    if not os.environ.get("ECS_CLUSTER_NAME"):
+        asg_name = find_asg_name(asg_c, instance_id)
+    cluster_name = find_cluster_name(
+        ec2_c,
+        asg_c,
+        asg_name,
+        instance_id
+    )
+    print(". . . found ECS Cluster name '{}'".format(
+        cluster_name
+    ))
+
+    print("Translating our EC2 Instance ID into an ECS Instance ID . . .")
+    container_instance_id = find_container_instance_id(
+        ecs_c,
+        cluster_name,
+        instance_id
+    )
+    print(". . . found ECS Instance ID '{}'".format(
+        container_instance_id
+    ))
+
+    print("Setting ECS Instance to drain . . .")
+    drain_instance(ecs_c, cluster_name, container_instance_id)
+    print(". . . ECS Instance ID '{}' in DRAINING mode".format(
+        container_instance_id
+    ))
+
+    if deadline is not None:
+        print("Confirming ECS Instance has drained all tasks in the {:.0f} "
+              "seconds left . . .".format(deadline - clock.now()))
+    else:
+        print("Confirming ECS Instance has drained all tasks . . .")
+
+    if check_instance_drained(
+            ecs_c,
+            cluster_name,
+            container_instance_id,
+            context,
+            poller=PollScheduler(
+                context,
+                "spot_instance_drained",
+                SPOT_POLL_MIN_INTERVAL,
+                SPOT_POLL_MAX_INTERVAL,
+                deadline=deadline
+            )
+            ):
+        print(". . . ECS Instance ID '{}' has drained all tasks".format(
+            container_instance_id
+        ))
+        return("DRAINED")
+
+    print(" ! ECS Instance ID '{}' still has tasks, ECS will carry on "
+          "draining it".format(container_instance_id))
+    return("OUT-OF-TIME")
+
+
+def lambda_handler(event, context):
+
+    metrics.start_recording("spot")
+    invocation = begin_invocation()
+    if invocation["cold_start"]:
+        print("Cold start, importing the AWS SDK took {:.3f} seconds".format(
+            invocation["sdk_import_seconds"]
+        ))
+
+    print("Received event {}".format(json.dumps(event)))
+
+    instance_id = event["detail"]["instance-id"]
+
+    try:
+        if event["detail-type"] == REBALANCE_RECOMMENDATION and \
+                not SPOT_DRAIN_ON_REBALANCE:
+            print("Ignoring rebalance recommendation for instance {}".format(
+                instance_id
+            ))
+            return
+
+        fast_drain(
+            lazy_client('ec2'),
+            get_client('ecs'),
+            get_client('autoscaling'),
+            instance_id,
+            find_deadline(event),
+            context
+        )
+
+    except ValueError as e:
+        # Raised when the instance isn't part of our ECS Cluster, such as
+        # another Spot instance in the same account, so there's nothing
+        # for us to drain.
+        print("Not draining instance {}: {}".format(instance_id, e))
+
+    finally:
+        print("Creating AWS clients took {:.3f} seconds".format(
+            client_setup_seconds()
+        ))
+        report_api_usage()
+        metrics.stop_recording()
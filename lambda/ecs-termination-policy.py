@@ -0,0 +1,183 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import json
+
+from lifecycle_core import metrics
+from lifecycle_core.clients import begin_invocation
+from lifecycle_core.clients import client_setup_seconds
+from lifecycle_core.clients import get_client
+from lifecycle_core.clients import lazy_client
+from lifecycle_core.cluster_name import find_cluster_name
+from lifecycle_core.container_instances import describe_cluster_instances
+from lifecycle_core.ratelimit import report_api_usage
+
+
+def _resource(resources, name):
+    for resource in resources:
+        if resource["name"] == name:
+            return(resource.get("integerValue", 0))
+    return(0)
+
+
+def drain_cost(container_instance):
+
+    """
+    Estimates how costly a container instance will be to drain, as a
+    tuple that sorts cheapest first.
+
+    Instances that are already draining come first, as the work of moving
+    their tasks is already under way.  After that we prefer the fewest
+    running and pending tasks, since every task has to be rescheduled
+    before the terminate hook can finish, and then the smallest share of
+    the instance's CPU or memory that is reserved.
+    """
+
+    reserved = 0.0
+    for name in ("CPU", "MEMORY"):
+        registered = _resource(
+            container_instance.get("registeredResources", []), name
+        )
+        remaining = _resource(
+            container_instance.get("remainingResources", []), name
+        )
+        if registered > 0:
+            reserved = max(reserved, 1 - float(remaining) / registered)
+
+    return((
+        container_instance["status"] != "DRAINING",
+        container_instance["runningTasksCount"] +
+        container_instance["pendingTasksCount"],
+        reserved
+    ))
+
+
+@metrics.phase
+def rank_candidates(ecs_c, cluster_name, instances):
+
+    """
+    Orders the instances AutoScaling offers us by how cheap they'll be to
+    drain, cheapest first.
+
+    The whole cluster is described in one batched pass, so this costs the
+    same number of API calls whether we're offered one instance or
+    thousands.  Instances that aren't in the cluster, because they never
+    joined or have already left, have nothing to drain and go first.
+    """
+
+    container_instances, api_calls = describe_cluster_instances(
+        ecs_c,
+        cluster_name
+    )
+    print("- Described {} container instances with {} ECS API "
+          "calls".format(len(container_instances), api_calls))
+
+    costs = dict(
+        (container_instance["ec2InstanceId"], drain_cost(container_instance))
+        for container_instance in container_instances
+    )
+
+    return(sorted(
+        instances,
+        key=lambda instance: costs.get(instance["InstanceId"], (False, 0, 0))
+    ))
+
+
+def choose_instances(ranked, capacity_to_terminate):
+
+    """
+    Picks the instances to terminate.  For each Availability Zone and
+    market option AutoScaling needs capacity from, we take the cheapest
+    instances to drain until we've found as many as it asked for.
+    """
+
+    chosen = []
+    for capacity in capacity_to_terminate:
+        wanted = capacity["Capacity"]
+        for instance in ranked:
+            if wanted <= 0:
+                break
+            if instance["InstanceId"] in chosen:
+                continue
+            if instance["AvailabilityZone"] != capacity["AvailabilityZone"]:
+                continue
+            if instance.get("InstanceMarketOption") != \
+                    capacity.get("InstanceMarketOption"):
+                continue
+            chosen.append(instance["InstanceId"])
+            wanted -= 1
+
+    return(chosen)
+
+
+def lambda_handler(event, context):
+
+    """
+    A custom termination policy for the cluster's AutoScaling group.
+    AutoScaling calls us with the instances it could terminate and how
+    many it needs from each Availability Zone, and we answer with the
+    ones that will drain fastest.
+
+    If we fail AutoScaling falls back to its default termination policy,
+    so we let errors propagate rather than guessing.
+    """
+
+    metrics.start_recording("termination-policy")
+    invocation = begin_invocation()
+    if invocation["cold_start"]:
+        print("Cold start, importing the AWS SDK took {:.3f} seconds".format(
+            invocation["sdk_import_seconds"]
+        ))
+
+    print("Received event {}".format(json.dumps(event)))
+
+    try:
+        ec2_c = lazy_client('ec2')
+        ecs_c = get_client('ecs')
+        asg_c = get_client('autoscaling')
+
+        print("Determining our ECS Cluster name . . .")
+        cluster_name = find_cluster_name(
+            ec2_c,
+            asg_c,
+            event["AutoScalingGroupName"],
+            event["Instances"][0]["InstanceId"]
+        )
+        print(". . . found ECS Cluster name '{}'".format(
+            cluster_name
+        ))
+
+        print("Ranking {} candidate instances by drain cost . . .".format(
+            len(event["Instances"])
+        ))
+        ranked = rank_candidates(ecs_c, cluster_name, event["Instances"])
+        chosen = choose_instances(ranked, event["CapacityToTerminate"])
+        print(". . . chose {} to terminate".format(", ".join(chosen)))
+
+        metrics.current().outcome = "RANKED"
+        return({
+            "InstanceIDs": chosen
+        })
+
+    except Exception as e:
+        print("Exception: {}".format(e))
+        raise
+
+    finally:
+        print("Creating AWS clients took {:.3f} seconds".format(
+            client_setup_seconds()
+        ))
+        report_api_usage()
+        metrics.stop_recording()
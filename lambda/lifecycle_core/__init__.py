@@ -0,0 +1,22 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Shared helpers for the ECS lifecycle hook Lambda functions.
+
+Each of the Lambda functions is packaged with this directory alongside
+its function.py so they can share one implementation of the ECS control
+plane lookups and of the hook workflows themselves.
+"""
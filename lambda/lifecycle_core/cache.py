@@ -0,0 +1,74 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+
+    """
+    A small least-recently-used cache whose entries also expire after a
+    fixed number of seconds.
+
+    Lambda keeps module level objects alive between invocations of a warm
+    container, so an instance of this held at module scope lets repeat
+    invocations skip lookups we've already done recently.  The batch
+    function's worker threads share these, so every access takes a lock.
+    """
+
+    def __init__(self, maxsize=256, ttl=900):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return(default)
+
+            value, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return(default)
+
+            self._entries.move_to_end(key)
+            return(value)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return(default)
+        return(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return(len(self._entries))
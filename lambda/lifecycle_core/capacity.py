@@ -0,0 +1,282 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Checks whether the rest of a cluster has room for the service tasks on
+an instance we're about to drain.  If it hasn't, draining the instance
+leaves their replacements PENDING and the terminate hook waiting until it
+gives up, so we'd rather know before we start.
+"""
+
+import os
+
+from lifecycle_core import metrics
+from lifecycle_core.cache import TTLCache
+from lifecycle_core.container_instances import describe_cluster_instances
+from lifecycle_core.drain_coordinator import DRAIN_COORDINATION
+from lifecycle_core.drain_coordinator import find_admitted_instances
+from lifecycle_core.stability import describe_instance_tasks
+from lifecycle_core.stability import describe_named_services
+
+# What the terminate function does when the rest of the cluster can't fit
+# the tasks an instance's drain would displace.  "defer" keeps checking,
+# sending heartbeats, until there's room or the hook runs out of time.
+# "ignore" drains regardless.  "abandon" completes the hook with ABANDON
+# straight away, but AutoScaling terminates the instance all the same, so
+# this means terminating it without draining, and its tasks stop without
+# replacements being started first.
+DRAIN_CAPACITY_ACTION = os.environ.get("DRAIN_CAPACITY_ACTION", "defer")
+
+# Task definition revisions never change, so we keep the ones we've
+# looked up for as long as the container stays warm.
+_task_definitions = TTLCache(maxsize=1000, ttl=24 * 3600)
+
+# Network modes in which a container's host ports are taken on the
+# container instance itself.  Tasks using awsvpc get their own ENI.
+HOST_PORT_NETWORK_MODES = frozenset(["bridge", "host"])
+
+
+def _remaining(container_instance):
+
+    """
+    Returns a container instance's remaining CPU, memory and ports in use.
+    Ports are "tcp:80" style strings so TCP and UDP ports don't clash.
+    """
+
+    cpu = memory = 0
+    ports = set()
+    for resource in container_instance.get("remainingResources", []):
+        if resource["name"] == "CPU":
+            cpu = resource["integerValue"]
+        elif resource["name"] == "MEMORY":
+            memory = resource["integerValue"]
+        elif resource["name"] == "PORTS":
+            ports.update("tcp:" + p for p in resource["stringSetValue"])
+        elif resource["name"] == "PORTS_UDP":
+            ports.update("udp:" + p for p in resource["stringSetValue"])
+
+    return({"cpu": cpu, "memory": memory, "ports": ports})
+
+
+def _task_definition(ecs_c, arn):
+    task_definition = _task_definitions.get(arn)
+    if task_definition is not None:
+        return(task_definition, 0)
+    task_definition = ecs_c.describe_task_definition(
+        taskDefinition=arn
+    )["taskDefinition"]
+    _task_definitions.put(arn, task_definition)
+    return(task_definition, 1)
+
+
+def task_requirements(ecs_c, task):
+
+    """
+    Works out the CPU, memory and static host ports a task needs wherever
+    it's placed.  CPU and memory come from the task itself, or failing
+    that its containers.  Ports come from its task definition's port
+    mappings, ignoring dynamic (zero) host ports.
+
+    Returns a tuple of the requirements and the number of ECS API calls
+    made, which is one the first time we see a task definition.
+    """
+
+    cpu = int(task.get("cpu") or sum(
+        int(c.get("cpu") or 0) for c in task.get("containers", [])
+    ))
+    memory = int(task.get("memory") or sum(
+        int(c.get("memoryReservation") or c.get("memory") or 0)
+        for c in task.get("containers", [])
+    ))
+
+    ports = set()
+    api_calls = 0
+    if "taskDefinitionArn" in task:
+        task_definition, api_calls = _task_definition(
+            ecs_c,
+            task["taskDefinitionArn"]
+        )
+        network_mode = task_definition.get("networkMode", "bridge")
+        if network_mode in HOST_PORT_NETWORK_MODES:
+            for container in task_definition["containerDefinitions"]:
+                for mapping in container.get("portMappings", []):
+                    host_port = mapping.get("hostPort")
+                    if network_mode == "host":
+                        host_port = host_port or mapping["containerPort"]
+                    if host_port:
+                        ports.add("{}:{}".format(
+                            mapping.get("protocol", "tcp"),
+                            host_port
+                        ))
+
+    return({"cpu": cpu, "memory": memory, "ports": ports}, api_calls)
+
+
+def pack(requirements, bins):
+
+    """
+    Places each task's requirements on the first bin (remaining instance
+    capacity) with room for it, biggest tasks first.  First fit decreasing
+    isn't optimal, but it's close, and quick even for thousands of
+    instances and tasks.  The bins are used up as tasks are placed.
+
+    Returns the requirements we couldn't place.
+    """
+
+    unplaced = []
+    ordered = sorted(
+        requirements,
+        key=lambda r: (r["memory"], r["cpu"], len(r["ports"])),
+        reverse=True
+    )
+
+    for requirement in ordered:
+        for room in bins:
+            if room["cpu"] >= requirement["cpu"] and \
+                    room["memory"] >= requirement["memory"] and \
+                    not room["ports"] & requirement["ports"]:
+                room["cpu"] -= requirement["cpu"]
+                room["memory"] -= requirement["memory"]
+                room["ports"] |= requirement["ports"]
+                break
+        else:
+            unplaced.append(requirement)
+
+    return(unplaced)
+
+
+def drain_requirements(ecs_c, cluster_name, container_instance_arn):
+
+    """
+    Works out what the service tasks on a container instance will need
+    from the rest of the cluster once it's drained (see
+    task_requirements).
+
+    Only REPLICA service tasks count, as ECS doesn't replace standalone
+    tasks or DAEMON service tasks elsewhere.
+
+    Returns a tuple of the requirements and the number of ECS API calls
+    made.
+    """
+
+    tasks, api_calls = describe_instance_tasks(
+        ecs_c,
+        cluster_name,
+        container_instance_arn
+    )
+    service_tasks = [
+        task for task in tasks
+        if task.get("group", "").startswith("service:") and
+        task.get("desiredStatus") == "RUNNING"
+    ]
+
+    services, calls = describe_named_services(
+        ecs_c,
+        cluster_name,
+        set(task["group"][len("service:"):] for task in service_tasks)
+    )
+    api_calls += calls
+
+    requirements = []
+    for task in service_tasks:
+        service = services.get(task["group"][len("service:"):], {})
+        if service.get("schedulingStrategy", "REPLICA") == "DAEMON":
+            continue
+        requirement, calls = task_requirements(ecs_c, task)
+        api_calls += calls
+        requirements.append(requirement)
+
+    return(requirements, api_calls)
+
+
+def find_leaving_instances(asg_c, asg_name, cluster_name):
+
+    """
+    Finds the EC2 instances leaving the cluster along with ours, whose
+    room our tasks can't count on: those our AutoScaling group is
+    terminating, and with DRAIN_COORDINATION on, those admitted to drain.
+    Otherwise the terminate hooks of a scale in would each count the
+    others' instances as room, and all drain at once.
+
+    Returns a tuple of their instance IDs and the number of AutoScaling
+    API calls made.
+    """
+
+    response = asg_c.describe_auto_scaling_groups(
+        AutoScalingGroupNames=[asg_name]
+    )
+    leaving = set(
+        instance["InstanceId"]
+        for group in response["AutoScalingGroups"]
+        for instance in group["Instances"]
+        if instance["LifecycleState"].startswith("Terminating")
+    )
+
+    if DRAIN_COORDINATION:
+        leaving |= find_admitted_instances(cluster_name)
+
+    return(leaving, 1)
+
+
+@metrics.phase
+def check_drain_capacity(ecs_c, cluster_name, container_instance_arn,
+                         requirements, leaving=()):
+
+    """
+    Checks whether the cluster's other ACTIVE, connected container
+    instances have room for the requirements drain_requirements found
+    for the given instance.  Instances that are leaving the cluster too
+    (see find_leaving_instances) don't count.
+
+    We don't model placement constraints or strategies, so a cluster that
+    relies on them to keep tasks apart can still get stuck, but running
+    out of CPU, memory or ports is what usually leaves a drain waiting on
+    PENDING tasks.
+
+    Returns a dictionary saying whether the tasks fit, how many there
+    were, how many couldn't be placed, how many instances we could place
+    them on, and the ECS API calls made.
+    """
+
+    result = {
+        "fits": True,
+        "tasks": len(requirements),
+        "unplaced": 0,
+        "instances": 0,
+        "api_calls": 0
+    }
+    if not requirements:
+        return(result)
+
+    container_instances, result["api_calls"] = describe_cluster_instances(
+        ecs_c,
+        cluster_name,
+        status="ACTIVE"
+    )
+    bins = [
+        _remaining(container_instance)
+        for container_instance in container_instances
+        if container_instance["containerInstanceArn"] !=
+        container_instance_arn and
+        container_instance.get("ec2InstanceId") not in leaving and
+        container_instance["status"] == "ACTIVE" and
+        container_instance.get("agentConnected", True)
+    ]
+    result["instances"] = len(bins)
+
+    result["unplaced"] = len(pack(requirements, bins))
+    result["fits"] = result["unplaced"] == 0
+
+    return(result)
@@ -0,0 +1,159 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import os
+import threading
+import time
+
+_import_started = time.time()
+import boto3  # noqa: E402
+from botocore.config import Config  # noqa: E402
+
+# How long importing the AWS SDK took when this container cold started.
+SDK_IMPORT_SECONDS = time.time() - _import_started
+
+from lifecycle_core import metrics  # noqa: E402
+from lifecycle_core import ratelimit  # noqa: E402
+
+# Connection pool and retry settings for every client we create.  The
+# pool needs to be at least as large as the number of threads we run
+# describe calls on, or they'll queue for a connection.
+CLIENT_MAX_POOL_CONNECTIONS = int(
+    os.environ.get("CLIENT_MAX_POOL_CONNECTIONS", "16")
+)
+CLIENT_RETRY_MODE = os.environ.get("CLIENT_RETRY_MODE", "adaptive")
+CLIENT_MAX_ATTEMPTS = int(os.environ.get("CLIENT_MAX_ATTEMPTS", "5"))
+CLIENT_CONNECT_TIMEOUT = float(os.environ.get("CLIENT_CONNECT_TIMEOUT", "5"))
+CLIENT_READ_TIMEOUT = float(os.environ.get("CLIENT_READ_TIMEOUT", "20"))
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS,
+    connect_timeout=CLIENT_CONNECT_TIMEOUT,
+    read_timeout=CLIENT_READ_TIMEOUT,
+    retries={
+        "mode": CLIENT_RETRY_MODE,
+        "total_max_attempts": CLIENT_MAX_ATTEMPTS
+    }
+)
+
+# Clients live at module scope so a warm container reuses them, and their
+# connections, across invocations.  Each is only created the first time
+# something asks for it.
+_clients = {}
+_clients_lock = threading.Lock()
+_cold_start = True
+_setup_seconds = 0.0
+
+
+def _instrument(client):
+
+    """
+    Hooks a client's calls into our rate limiting and metrics.
+    """
+
+    ratelimit.instrument_client(client)
+    metrics.instrument_client(client)
+
+
+def get_client(service_name):
+
+    """
+    Returns the shared client for an AWS service, creating it on first use.
+    """
+
+    global _setup_seconds
+
+    client = _clients.get(service_name)
+    if client is not None:
+        return(client)
+
+    with _clients_lock:
+        client = _clients.get(service_name)
+        if client is None:
+            started = time.time()
+            client = boto3.client(service_name, config=CLIENT_CONFIG)
+            _instrument(client)
+            _setup_seconds += time.time() - started
+            _clients[service_name] = client
+
+    return(client)
+
+
+class _LazyClient(object):
+
+    """
+    Stands in for a client we may not need, creating the real one the
+    first time any of its methods are used.
+    """
+
+    def __init__(self, service_name):
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        return(getattr(get_client(self._service_name), name))
+
+
+def lazy_client(service_name):
+
+    """
+    Returns a stand-in for the shared client for an AWS service which only
+    creates it if it's actually used.
+    """
+
+    return(_LazyClient(service_name))
+
+
+def set_client(service_name, client):
+
+    """
+    Replaces the shared client for an AWS service, for running the
+    functions against a fake.  Fakes which offer botocore's event hooks
+    are rate limited and counted like real clients.
+    """
+
+    if hasattr(getattr(client, "meta", None), "events"):
+        _instrument(client)
+    _clients[service_name] = client
+
+
+def begin_invocation():
+
+    """
+    Called at the start of every invocation.  Returns whether this is the
+    container's first (cold) invocation and how long importing the SDK
+    took if it is.
+    """
+
+    global _cold_start, _setup_seconds
+
+    report = {
+        "cold_start": _cold_start,
+        "sdk_import_seconds": SDK_IMPORT_SECONDS if _cold_start else 0.0
+    }
+    _cold_start = False
+    _setup_seconds = 0.0
+    ratelimit.api_budget.reset_stats()
+
+    return(report)
+
+
+def client_setup_seconds():
+
+    """
+    Returns how long we've spent creating clients since the current
+    invocation began.  Once a container is warm this should be zero.
+    """
+
+    return(_setup_seconds)
@@ -0,0 +1,40 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import time
+
+_now = time.time
+_sleep = time.sleep
+
+
+def now():
+    return(_now())
+
+
+def sleep(seconds):
+    _sleep(seconds)
+
+
+def set_clock(clock, sleeper):
+
+    """
+    Replaces the clock and sleep functions used by the polling and rate
+    limiting code, so a simulated cluster can run them against a virtual
+    clock.
+    """
+
+    global _now, _sleep
+    _now = clock
+    _sleep = sleeper
@@ -0,0 +1,126 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import base64
+import os
+import re
+
+from lifecycle_core import metrics
+from lifecycle_core.cache import TTLCache
+
+# Tag placed on the AutoScaling group by the CloudFormation template
+# holding the name of the ECS cluster its instances join.
+CLUSTER_NAME_TAG = os.environ.get(
+    "ECS_CLUSTER_NAME_TAG",
+    "ecs-cluster-manager:cluster-name"
+)
+
+# Cluster names we've already resolved, keyed by (ASG name, instance ID).
+# Entries keyed by (ASG name, None) hold what we found on the ASG's tags,
+# where an empty string means we looked and the tag wasn't there.
+_cluster_names = TTLCache(
+    maxsize=int(os.environ.get("CLUSTER_NAME_CACHE_SIZE", "256")),
+    ttl=int(os.environ.get("CLUSTER_NAME_CACHE_TTL", "900"))
+)
+
+
+def find_cluster_name_from_asg_tags(asg_c, asg_name):
+
+    """
+    Looks for the cluster name tag on the AutoScaling group.
+
+    Returns the tag value, or None if the group doesn't carry the tag.
+    """
+
+    response = asg_c.describe_auto_scaling_groups(
+        AutoScalingGroupNames=[
+            asg_name
+        ]
+    )
+
+    for group in response["AutoScalingGroups"]:
+        for tag in group.get("Tags", []):
+            if tag["Key"] == CLUSTER_NAME_TAG:
+                return(tag["Value"])
+
+    return(None)
+
+
+def find_cluster_name_from_user_data(ec2_c, instance_id):
+
+    """
+    Provided an instance that is currently, or should be part of an ECS cluster
+    determines the ECS cluster name.  This is derived from the user-data
+    which contains a command to inject the cluster name into ECS agent config
+    files.
+
+    On failure we raise an exception which means this instance isn't a ECS
+    cluster member so we can proceed with termination.
+    """
+
+    response = ec2_c.describe_instance_attribute(
+        InstanceId=instance_id,
+        Attribute='userData'
+    )
+
+    userdata = base64.b64decode(response['UserData']['Value'])
+
+    clustername = re.search(r"ECS_CLUSTER\s?=\s?(.*?)\s", str(userdata))
+    if clustername:
+        return(clustername.group(1))
+
+    raise(ValueError(
+        "Unable to determine the ECS cluster name from instance metadata"
+    ))
+
+
+@metrics.phase
+def find_cluster_name(ec2_c, asg_c, asg_name, instance_id):
+
+    """
+    Determines the name of the ECS cluster an instance belongs to, trying
+    the cheapest sources first:
+
+    1. The ECS_CLUSTER_NAME environment variable, set on the function by
+       the CloudFormation template.
+    2. Names we've already resolved for this ASG or instance in this warm
+       Lambda container.
+    3. The cluster name tag on the AutoScaling group.
+    4. The ECS_CLUSTER line in the instance's user-data.
+
+    On failure we raise an exception which means this instance isn't a ECS
+    cluster member so we can proceed with termination.
+    """
+
+    cluster_name = os.environ.get("ECS_CLUSTER_NAME")
+    if cluster_name:
+        return(cluster_name)
+
+    cluster_name = _cluster_names.get((asg_name, instance_id))
+    if cluster_name:
+        return(cluster_name)
+
+    if asg_name:
+        cluster_name = _cluster_names.get((asg_name, None))
+        if cluster_name is None:
+            cluster_name = find_cluster_name_from_asg_tags(asg_c, asg_name)
+            _cluster_names.put((asg_name, None), cluster_name or "")
+        if cluster_name:
+            return(cluster_name)
+
+    cluster_name = find_cluster_name_from_user_data(ec2_c, instance_id)
+    _cluster_names.put((asg_name, instance_id), cluster_name)
+
+    return(cluster_name)
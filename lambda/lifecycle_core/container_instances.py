@@ -0,0 +1,182 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from lifecycle_core import metrics
+
+# describe_container_instances accepts at most 100 ARNs per call, and
+# list_container_instances returns at most 100 ARNs per page.
+DESCRIBE_BATCH_SIZE = 100
+
+
+def list_container_instance_pages(ecs_c, cluster_name, filter_expression=None,
+                                  status=None):
+
+    """
+    Lists the container instance ARNs in a cluster, yielding one page of
+    up to 100 ARNs at a time.
+
+    When a filter_expression is given it is passed through as an ECS
+    cluster query language filter, which lets the ECS control plane do the
+    matching for us rather than us describing every instance.  A status
+    limits the listing to instances in that status.
+    """
+
+    kwargs = {
+        "cluster": cluster_name,
+        "PaginationConfig": {
+            "PageSize": DESCRIBE_BATCH_SIZE
+        }
+    }
+    if filter_expression is not None:
+        kwargs["filter"] = filter_expression
+    if status is not None:
+        kwargs["status"] = status
+
+    paginator = ecs_c.get_paginator('list_container_instances')
+    for page in paginator.paginate(**kwargs):
+        yield page["containerInstanceArns"]
+
+
+def describe_container_instances(ecs_c, cluster_name, container_instance_arns):
+
+    """
+    Describes any number of container instances, batching the ARNs into
+    the largest requests the ECS API allows.
+
+    Returns a tuple of the container instance descriptions and the number
+    of API calls made to fetch them.
+    """
+
+    container_instances = []
+    api_calls = 0
+
+    for i in range(0, len(container_instance_arns), DESCRIBE_BATCH_SIZE):
+        response = ecs_c.describe_container_instances(
+            cluster=cluster_name,
+            containerInstances=container_instance_arns[
+                i:i + DESCRIBE_BATCH_SIZE
+            ]
+        )
+        api_calls += 1
+        container_instances.extend(response["containerInstances"])
+
+    return(container_instances, api_calls)
+
+
+def describe_cluster_instances(ecs_c, cluster_name, max_workers=8,
+                               status=None):
+
+    """
+    Describes every container instance in a cluster in one pass.  Each
+    page of up to 100 ARNs is described on a thread pool while the listing
+    carries on, so even thousands of instances only cost one list and one
+    describe call per hundred.  A status limits it to instances in that
+    status, see list_container_instance_pages.
+
+    Returns a tuple of the container instance descriptions and the number
+    of API calls made to fetch them.
+    """
+
+    api_calls = 0
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for page in list_container_instance_pages(
+                ecs_c,
+                cluster_name,
+                status=status
+                ):
+            api_calls += 1
+            futures.append(pool.submit(
+                metrics.bind(describe_container_instances),
+                ecs_c,
+                cluster_name,
+                page
+            ))
+
+        container_instances = []
+        for future in futures:
+            described, calls = future.result()
+            api_calls += calls
+            container_instances.extend(described)
+
+    return(container_instances, api_calls)
+
+
+def find_container_instance(ecs_c, cluster_name, instance_id):
+
+    """
+    Given an ec2 instance ID finds the matching ECS container instance.
+    The ec2 instance ID and cluster instance ID aren't the same thing.
+
+    We first ask ECS to filter the cluster for us using the cluster query
+    language, which costs one list and one describe call no matter how big
+    the cluster is.  If the filter is rejected we fall back to listing the
+    cluster 100 instances at a time and describing each page until we find
+    a match.
+
+    Returns a tuple of the container instance description, or None if the
+    instance hasn't joined the cluster, and the number of ECS API calls
+    we made to find out.
+    """
+
+    api_calls = 0
+
+    try:
+        matched_arns = []
+        for page in list_container_instance_pages(
+                ecs_c,
+                cluster_name,
+                "ec2InstanceId == {}".format(instance_id)
+                ):
+            api_calls += 1
+            matched_arns.extend(page)
+
+        container_instances, calls = describe_container_instances(
+            ecs_c,
+            cluster_name,
+            matched_arns
+        )
+        api_calls += calls
+
+        for container_instance in container_instances:
+            if container_instance["ec2InstanceId"] == instance_id:
+                return(container_instance, api_calls)
+
+        return(None, api_calls)
+
+    except ClientError as e:
+        api_calls += 1
+        print(" ! Filtered container instance lookup failed, "
+              "scanning the cluster instead: {}".format(e))
+
+    for page in list_container_instance_pages(ecs_c, cluster_name):
+        api_calls += 1
+        container_instances, calls = describe_container_instances(
+            ecs_c,
+            cluster_name,
+            page
+        )
+        api_calls += calls
+
+        for container_instance in container_instances:
+            if container_instance["ec2InstanceId"] == instance_id:
+                return(container_instance, api_calls)
+
+    return(None, api_calls)
@@ -0,0 +1,225 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Carries a lifecycle hook on in a new invocation once the current one runs
+out of time.  By default a heartbeat does this: CloudTrail records it and
+an EventBridge rule invokes us again, but CloudTrail can take minutes to
+deliver.  The launch and terminate functions can instead invoke
+themselves, or have EventBridge Scheduler invoke them at a time of their
+choosing, and only send heartbeats to stop the hook timing out.
+"""
+
+import datetime
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from lifecycle_core import clock
+from lifecycle_core.clients import get_client
+from lifecycle_core.state import get_state_store
+
+# How the launch and terminate functions carry on with a hook.
+# "heartbeat" relies on the heartbeat's CloudTrail event re-invoking us.
+# "invoke" invokes the function again asynchronously, straight away.
+# "scheduler" creates a one-time EventBridge Scheduler schedule that
+# invokes it when we expect there to be something to do.  The batch
+# function always carries on through SQS and ignores this.
+CONTINUATION_MODE = os.environ.get("CONTINUATION_MODE", "heartbeat")
+
+# The lifecycle hook's heartbeat timeout.  Unless CONTINUATION_MODE is
+# "heartbeat", we only send a heartbeat once half of this has passed since
+# the last one (or since the hook started).
+HOOK_HEARTBEAT_TIMEOUT = int(os.environ.get("HOOK_HEARTBEAT_TIMEOUT", "3600"))
+
+# With "scheduler", how soon and how late after an invocation ends its
+# continuation may run.  Between the two we aim at when the phase we're
+# in is predicted to finish.
+CONTINUATION_MIN_DELAY = int(os.environ.get("CONTINUATION_MIN_DELAY", "60"))
+CONTINUATION_MAX_DELAY = int(os.environ.get("CONTINUATION_MAX_DELAY", "600"))
+
+# The role EventBridge Scheduler assumes to invoke the function.
+CONTINUATION_SCHEDULER_ROLE_ARN = os.environ.get(
+    "CONTINUATION_SCHEDULER_ROLE_ARN"
+)
+
+# The most EventBridge Scheduler takes as a target's input, in bytes.  A
+# hook record carried in a continuation event can be bigger than this,
+# so we invoke ourselves instead then.  Asynchronous invocations take up
+# to 256 KB.
+SCHEDULER_INPUT_LIMIT = 8192
+
+# How our continuation events are marked, in the same shape as the
+# EventBridge events AutoScaling sends.
+CONTINUATION_SOURCE = "ecs-cluster-manager"
+CONTINUATION_DETAIL_TYPE = "Lifecycle Hook Continuation"
+
+
+def is_heartbeat_event(event):
+
+    """
+    Whether an event is the CloudTrail record of a heartbeat, which only
+    continues a hook when CONTINUATION_MODE is "heartbeat".
+    """
+
+    return(event.get("detail", {}).get("eventName") ==
+           "RecordLifecycleActionHeartbeat")
+
+
+def read_continuation(event):
+
+    """
+    Returns the hook record a continuation event carried, or None if the
+    event isn't one of our continuations or didn't carry a record.
+    """
+
+    if event.get("source") != CONTINUATION_SOURCE:
+        return(None)
+
+    return(event.get("hook-record"))
+
+
+def continuation_event(hook_message, hook_record):
+
+    """
+    Builds the event a continuation is invoked with.  Its detail is the
+    normalized hook message, so normalize_hook_message reads it like
+    AutoScaling's own event.
+
+    A state store that outlives the container already has the hook's
+    record.  Otherwise the next invocation may run on another container,
+    so we carry the record along with the event.
+    """
+
+    event = {
+        "version": "0",
+        "source": CONTINUATION_SOURCE,
+        "detail-type": CONTINUATION_DETAIL_TYPE,
+        "detail": hook_message
+    }
+    if not get_state_store().durable:
+        event["hook-record"] = hook_record
+
+    return(event)
+
+
+def heartbeat_due(hook_record):
+
+    """
+    Whether the hook needs a heartbeat to keep it from timing out, see
+    HOOK_HEARTBEAT_TIMEOUT.
+    """
+
+    last_heartbeat = hook_record.get(
+        "heartbeat_at",
+        hook_record["started_at"]
+    )
+
+    return(clock.now() - last_heartbeat > HOOK_HEARTBEAT_TIMEOUT / 2.0)
+
+
+def _schedule_name(hook_message, hook_record):
+    return("hook-{}-{}".format(
+        hook_message["LifecycleActionToken"],
+        hook_record["attempts"]
+    ))
+
+
+def _invoke_continuation(context, payload):
+    get_client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=payload
+    )
+    print("- Invoked ourselves to carry on")
+
+
+def continue_hook(hook_message, hook_record, context, resume_at=None,
+                  latest=None):
+
+    """
+    Arranges for the hook to be picked up by a new invocation of this
+    function, as CONTINUATION_MODE says.  resume_at is when (as an epoch
+    time) the phase we're in is predicted to finish, if we know, and
+    latest is when (again as an epoch time) the continuation must run by,
+    such as before a drain admission lapses.
+
+    Returns how many seconds from now the continuation is due, or None
+    when CONTINUATION_MODE is "heartbeat" and the heartbeat we've sent
+    does the job.
+
+    In "scheduler" mode we fall back to invoking ourselves straight away
+    when the event is too big for a schedule (see SCHEDULER_INPUT_LIMIT)
+    or the schedule can't be created, rather than let the hook go.
+    """
+
+    if CONTINUATION_MODE == "heartbeat":
+        return(None)
+
+    payload = json.dumps(continuation_event(hook_message, hook_record))
+
+    if CONTINUATION_MODE == "invoke":
+        _invoke_continuation(context, payload)
+        return(0)
+
+    if len(payload.encode("utf-8")) > SCHEDULER_INPUT_LIMIT:
+        print(" ! The hook record is too big for a schedule's input")
+        _invoke_continuation(context, payload)
+        return(0)
+
+    now = clock.now()
+    delay = CONTINUATION_MIN_DELAY
+    if resume_at is not None:
+        delay = min(
+            CONTINUATION_MAX_DELAY,
+            max(CONTINUATION_MIN_DELAY, resume_at - now)
+        )
+    if latest is not None and latest - now < delay:
+        delay = latest - now
+        if delay < CONTINUATION_MIN_DELAY:
+            print("- Carrying on straight away to be back within "
+                  "{:.0f} seconds".format(max(0, delay)))
+            _invoke_continuation(context, payload)
+            return(0)
+    at = datetime.datetime.fromtimestamp(
+        now + delay,
+        datetime.timezone.utc
+    )
+
+    try:
+        get_client('scheduler').create_schedule(
+            Name=_schedule_name(hook_message, hook_record),
+            ScheduleExpression="at({})".format(
+                at.strftime("%Y-%m-%dT%H:%M:%S")
+            ),
+            ScheduleExpressionTimezone="UTC",
+            FlexibleTimeWindow={"Mode": "OFF"},
+            ActionAfterCompletion="DELETE",
+            Target={
+                "Arn": context.invoked_function_arn,
+                "RoleArn": CONTINUATION_SCHEDULER_ROLE_ARN,
+                "Input": payload
+            }
+        )
+    except ClientError as e:
+        print(" ! Unable to schedule our continuation: {}".format(e))
+        _invoke_continuation(context, payload)
+        return(0)
+    print("- Scheduled ourselves to carry on in {:.0f} seconds".format(
+        delay
+    ))
+
+    return(delay)
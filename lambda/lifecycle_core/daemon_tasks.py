@@ -0,0 +1,98 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+ECS doesn't move DAEMON service tasks off an instance that's draining,
+since the service wants one on every instance, so an instance running a
+log shipper or monitoring agent never gets down to zero tasks.  We work
+out which of an instance's tasks are daemons so the drain check can look
+past them, and stop them once everything else has gone if asked to.
+"""
+
+import os
+
+from lifecycle_core.stability import describe_instance_tasks
+from lifecycle_core.stability import describe_named_services
+
+# What the terminate function does with DAEMON service tasks once every
+# other task has left the instance.  "ignore" treats the instance as
+# drained and leaves them running until it terminates.  "stop" stops them
+# first, so they can shut down cleanly, and waits for them to exit.
+# "wait" waits for them to go by themselves, as we always used to.
+DAEMON_TASK_ACTION = os.environ.get("DAEMON_TASK_ACTION", "ignore")
+
+# The task states a container instance's runningTasksCount and
+# pendingTasksCount cover.
+COUNTED_TASK_STATES = frozenset(["RUNNING", "PENDING"])
+
+
+def find_daemon_tasks(ecs_c, cluster_name, container_instance_arn,
+                      strategies):
+
+    """
+    Lists the tasks on a container instance and picks out those counted as
+    running or pending that belong to DAEMON services.  Tasks already told
+    to stop aren't listed.
+
+    strategies maps service names to their scheduling strategy.  We only
+    describe the services it doesn't know yet, and add them to it, so a
+    caller checking an instance again doesn't describe them again.
+
+    Returns a tuple of the daemon task ARNs and the number of ECS API calls
+    made.
+    """
+
+    tasks, api_calls = describe_instance_tasks(
+        ecs_c,
+        cluster_name,
+        container_instance_arn
+    )
+
+    service_names = set(
+        task["group"][len("service:"):] for task in tasks
+        if task.get("group", "").startswith("service:")
+    )
+    services, calls = describe_named_services(
+        ecs_c,
+        cluster_name,
+        service_names - set(strategies)
+    )
+    api_calls += calls
+    for name, service in services.items():
+        strategies[name] = service.get("schedulingStrategy", "REPLICA")
+
+    daemon_tasks = [
+        task["taskArn"] for task in tasks
+        if task.get("group", "").startswith("service:") and
+        strategies.get(task["group"][len("service:"):]) == "DAEMON" and
+        task["lastStatus"] in COUNTED_TASK_STATES
+    ]
+
+    return(daemon_tasks, api_calls)
+
+
+def stop_daemon_tasks(ecs_c, cluster_name, task_arns):
+
+    """
+    Stops the given DAEMON tasks.  ECS won't start them again on an
+    instance that's draining.
+    """
+
+    for task_arn in task_arns:
+        ecs_c.stop_task(
+            cluster=cluster_name,
+            task=task_arn,
+            reason="Container instance drained for termination"
+        )
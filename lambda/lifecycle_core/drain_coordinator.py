@@ -0,0 +1,254 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Coordinates the drains of several instances leaving a cluster at once.
+Each service's deployment configuration says how many of its tasks can
+be on their way between instances at a time, and we only let an instance
+start draining while that leaves every service with tasks on it within
+its budget.  The instances we've let in are kept in the state store, so
+every terminate hook sees the same set.
+"""
+
+import math
+import os
+import uuid
+
+from lifecycle_core import clock
+from lifecycle_core.stability import describe_instance_tasks
+from lifecycle_core.stability import describe_named_services
+from lifecycle_core.state import get_state_store
+
+# When "true", terminate hooks queue for admission before draining their
+# instance rather than all draining at once.  Hooks only see each other's
+# drains through a state store they share, such as DynamoDB, or when the
+# batch function works them in the same invocation.
+DRAIN_COORDINATION = os.environ.get("DRAIN_COORDINATION", "false") == "true"
+
+# How long an admission lasts unless its hook renews it, which it does
+# every invocation.  This only matters if a hook stops being worked
+# without releasing its admission, so it needs to outlast the gap between
+# a hook's invocations.  Continuations we schedule ourselves are due
+# within half of it, and a hook that finds its admission has lapsed
+# anyway queues for it again.
+DRAIN_ADMISSION_TTL = int(os.environ.get("DRAIN_ADMISSION_TTL", "1200"))
+
+# How long one invocation may hold the admission record to update it,
+# and how many times, how far apart, we try for it when someone else has
+# it.  Updates are quick, so the lease is rarely held for long.
+ADMISSION_LEASE_SECONDS = 30
+ADMISSION_LEASE_ATTEMPTS = 5
+ADMISSION_LEASE_RETRY_SECONDS = 0.5
+
+
+def _admission_key(cluster_name):
+    return("drain-admission:{}".format(cluster_name))
+
+
+def _lease_key(cluster_name):
+    return("drain-admission-lease:{}".format(cluster_name))
+
+
+def service_drain_budget(service):
+
+    """
+    Works out how many of a service's tasks can be replaced at once
+    without its running tasks falling below minimumHealthyPercent of its
+    desired count or its tasks overall going above maximumPercent.
+    """
+
+    deployment = service.get("deploymentConfiguration", {})
+    desired = service["desiredCount"]
+    minimum = int(math.ceil(
+        desired * deployment.get("minimumHealthyPercent", 100) / 100.0
+    ))
+    maximum = int(math.floor(
+        desired * deployment.get("maximumPercent", 200) / 100.0
+    ))
+
+    return(max(0, maximum - minimum))
+
+
+def find_drain_budgets(ecs_c, cluster_name, container_instance_arn):
+
+    """
+    Counts the tasks each REPLICA service has on a container instance,
+    alongside the service's drain budget (see service_drain_budget).
+
+    Returns a tuple of [tasks, budget] keyed by service name and the
+    number of ECS API calls made.
+    """
+
+    tasks, api_calls = describe_instance_tasks(
+        ecs_c,
+        cluster_name,
+        container_instance_arn
+    )
+
+    counts = {}
+    for task in tasks:
+        if task.get("group", "").startswith("service:") and \
+                task.get("desiredStatus") == "RUNNING":
+            name = task["group"][len("service:"):]
+            counts[name] = counts.get(name, 0) + 1
+
+    services, calls = describe_named_services(
+        ecs_c,
+        cluster_name,
+        counts.keys()
+    )
+    api_calls += calls
+
+    budgets = {}
+    for name, service in services.items():
+        if service.get("schedulingStrategy", "REPLICA") == "DAEMON":
+            continue
+        budgets[name] = [counts[name], service_drain_budget(service)]
+
+    return(budgets, api_calls)
+
+
+def _update_admissions(cluster_name, update):
+
+    """
+    Holds the cluster's admission lease while update works on the
+    admitted instances, with any that have expired taken out.  Whatever
+    update leaves in the dictionary is saved.
+
+    Returns what update returned, or None if other invocations kept the
+    admissions busy for all ADMISSION_LEASE_ATTEMPTS of our tries.
+    """
+
+    store = get_state_store()
+    owner = uuid.uuid4().hex
+    for attempt in range(ADMISSION_LEASE_ATTEMPTS):
+        if store.acquire_lease(
+                _lease_key(cluster_name), owner, ADMISSION_LEASE_SECONDS
+                ):
+            break
+        clock.sleep(ADMISSION_LEASE_RETRY_SECONDS)
+    else:
+        return(None)
+
+    try:
+        now = clock.now()
+        record = store.get(_admission_key(cluster_name)) or {}
+        admitted = dict(
+            (instance_id, admission)
+            for instance_id, admission in record.get("admitted", {}).items()
+            if admission["expires_at"] > now
+        )
+        result = update(admitted, now)
+        store.put(
+            _admission_key(cluster_name),
+            {"admitted": admitted},
+            DRAIN_ADMISSION_TTL
+        )
+        return(result)
+    finally:
+        store.release_lease(_lease_key(cluster_name), owner)
+
+
+def admit_drain(cluster_name, instance_id, budgets):
+
+    """
+    Asks to start draining an instance, given the budgets
+    find_drain_budgets found for it.
+
+    We admit it if, for every service with tasks on it, those tasks plus
+    the service's tasks on the instances already admitted are within the
+    service's budget.  So the cluster always makes progress, an instance
+    is also admitted when no others are, whatever its budgets.
+
+    Returns a tuple of whether the instance is admitted and the services
+    whose budgets it's waiting on, sorted by name.
+    """
+
+    def update(admitted, now):
+        if instance_id not in admitted:
+            in_flight = {}
+            for admission in admitted.values():
+                for name, count in admission["services"].items():
+                    in_flight[name] = in_flight.get(name, 0) + count
+
+            waiting_on = sorted(
+                name for name, (count, budget) in budgets.items()
+                if in_flight.get(name, 0) + count > budget
+            )
+            if waiting_on and admitted:
+                return(False, waiting_on)
+
+        admitted[instance_id] = {
+            "services": dict(
+                (name, count) for name, (count, _) in budgets.items()
+            ),
+            "expires_at": now + DRAIN_ADMISSION_TTL
+        }
+        return(True, [])
+
+    result = _update_admissions(cluster_name, update)
+    if result is None:
+        return(False, [])
+
+    return(result)
+
+
+def renew_drain_admission(cluster_name, instance_id):
+
+    """
+    Extends an instance's admission for another DRAIN_ADMISSION_TTL
+    seconds.  Returns True if we did, False if the instance isn't
+    admitted (its admission may have lapsed), or None if we couldn't
+    update the admissions just now.
+    """
+
+    def update(admitted, now):
+        if instance_id not in admitted:
+            return(False)
+        admitted[instance_id]["expires_at"] = now + DRAIN_ADMISSION_TTL
+        return(True)
+
+    return(_update_admissions(cluster_name, update))
+
+
+def find_admitted_instances(cluster_name):
+
+    """
+    Returns the IDs of the instances admitted to drain just now.  This
+    only reads the admissions, so we don't take their lease for it.
+    """
+
+    now = clock.now()
+    record = get_state_store().get(_admission_key(cluster_name)) or {}
+
+    return(set(
+        instance_id
+        for instance_id, admission in record.get("admitted", {}).items()
+        if admission["expires_at"] > now
+    ))
+
+
+def release_drain_admission(cluster_name, instance_id):
+
+    """
+    Gives up an instance's admission once its hook is done, letting queued
+    instances in.  If we can't update the admissions just now it lapses
+    after DRAIN_ADMISSION_TTL seconds instead.
+    """
+
+    def update(admitted, now):
+        admitted.pop(instance_id, None)
+
+    _update_admissions(cluster_name, update)
@@ -0,0 +1,197 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import math
+import os
+
+from lifecycle_core.state import get_state_store
+
+# When "true" the terminate function remembers how long drains and
+# stabilizations take in each cluster, and for each service that was on
+# the instances drained, and uses that to predict when the next one will
+# finish.
+DRAIN_TIME_MODEL = os.environ.get("DRAIN_TIME_MODEL", "true") == "true"
+
+# How many durations we keep for the cluster and for each service, and
+# which percentile of them we predict with.  A high percentile means we
+# rarely wake before the work is done.
+DRAIN_HISTORY_SIZE = int(os.environ.get("DRAIN_HISTORY_SIZE", "50"))
+DRAIN_ESTIMATE_PERCENTILE = float(
+    os.environ.get("DRAIN_ESTIMATE_PERCENTILE", "90")
+)
+
+# Seconds the history is kept after the last duration we added to it.
+# Clusters can go weeks between scale-ins, so this is much longer than
+# the state store's default, which only has to outlive a hook.
+DRAIN_HISTORY_TTL = int(
+    os.environ.get("DRAIN_HISTORY_TTL", str(90 * 24 * 3600))
+)
+
+# We don't predict anything until we've seen at least this many.
+MIN_SAMPLES = 3
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    rank = int(math.ceil(percentile / 100.0 * len(ordered)))
+    return(ordered[min(len(ordered), max(1, rank)) - 1])
+
+
+def _model_key(cluster_name):
+    return("drain-model:{}".format(cluster_name))
+
+
+class DrainTimeModel(object):
+
+    """
+    A rolling history of how long each kind of wait took ("drain" or
+    "stable"), kept for the whole cluster and for each service involved.
+
+    The history is a plain dictionary of lists of whole seconds, small
+    enough to keep in a single state store item and easy to dump and
+    replay offline with backtest().
+    """
+
+    def __init__(self, history=None, size=None):
+        self.history = history or {}
+        self.size = DRAIN_HISTORY_SIZE if size is None else size
+
+    def _add(self, key, seconds):
+        samples = self.history.setdefault(key, [])
+        samples.append(int(round(seconds)))
+        del samples[:-self.size]
+
+    def record(self, kind, seconds, services=()):
+
+        """
+        Adds how long a wait of this kind took, for the cluster and for
+        each of the given services.
+        """
+
+        self._add(kind, seconds)
+        for service in services:
+            self._add("{}:{}".format(kind, service), seconds)
+
+    def estimate(self, kind, services=(), percentile=None):
+
+        """
+        Predicts how many seconds a wait of this kind will take.
+
+        Each service we have enough history for gives its own estimate,
+        and as the slowest service holds up the rest we take the largest
+        of those.  With no service history we fall back on the cluster's.
+        Returns None if we haven't seen enough waits to say.
+        """
+
+        if percentile is None:
+            percentile = DRAIN_ESTIMATE_PERCENTILE
+
+        estimates = [
+            _percentile(self.history[key], percentile)
+            for key in ("{}:{}".format(kind, s) for s in services)
+            if len(self.history.get(key, ())) >= MIN_SAMPLES
+        ]
+        if not estimates and len(self.history.get(kind, ())) >= MIN_SAMPLES:
+            estimates.append(_percentile(self.history[kind], percentile))
+
+        if not estimates:
+            return(None)
+
+        return(max(estimates))
+
+
+def backtest(samples, percentile=None):
+
+    """
+    Replays a recorded history in order, predicting each duration from
+    the ones before it, to see how well a percentile would have done.
+
+    Returns a dictionary with how many predictions were made, the mean
+    absolute error in seconds, how many finished later than predicted
+    (where we'd have woken early and gone back to polling) and the mean
+    seconds of waiting we'd have overslept when finishing earlier.
+    """
+
+    if percentile is None:
+        percentile = DRAIN_ESTIMATE_PERCENTILE
+
+    errors = []
+    late = 0
+    overslept = []
+    for i in range(MIN_SAMPLES, len(samples)):
+        predicted = _percentile(samples[:i], percentile)
+        errors.append(abs(samples[i] - predicted))
+        if samples[i] > predicted:
+            late += 1
+        else:
+            overslept.append(predicted - samples[i])
+
+    return({
+        "predictions": len(errors),
+        "mean_error": sum(errors) / len(errors) if errors else None,
+        "late": late,
+        "mean_overslept": sum(overslept) / len(overslept)
+        if overslept else None
+    })
+
+
+def load_drain_model(cluster_name):
+
+    """
+    Returns the drain time model for a cluster from the state store.
+    """
+
+    return(DrainTimeModel(get_state_store().get(_model_key(cluster_name))))
+
+
+def record_duration(cluster_name, kind, seconds, services=()):
+
+    """
+    Adds a duration to a cluster's model in the state store.
+
+    Concurrent hooks can overwrite each other's samples here.  Losing the
+    odd sample only makes the model a little less informed, so it isn't
+    worth a lease.
+    """
+
+    model = load_drain_model(cluster_name)
+    model.record(kind, seconds, services)
+    get_state_store().put(
+        _model_key(cluster_name),
+        model.history,
+        ttl=DRAIN_HISTORY_TTL
+    )
+
+    return(model)
+
+
+def predict_completion(cluster_name, kind, started_at, services=()):
+
+    """
+    Predicts the epoch time a wait of this kind, begun at started_at, will
+    finish.  Returns None if the model is turned off or doesn't know yet.
+    """
+
+    if not DRAIN_TIME_MODEL:
+        return(None)
+
+    estimate = load_drain_model(cluster_name).estimate(kind, services)
+    if estimate is None:
+        return(None)
+
+    print("- Expecting the {} wait to take about {} seconds".format(
+        kind, estimate
+    ))
+    return(started_at + estimate)
@@ -0,0 +1,249 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import re
+
+from lifecycle_core import clock
+from lifecycle_core import metrics
+from lifecycle_core.continuation import CONTINUATION_MODE
+from lifecycle_core.continuation import heartbeat_due
+from lifecycle_core.state import get_state_store
+
+# We give up on a hook, and tell AutoScaling to ABANDON it, once we've
+# been working on it for this long.
+HOOK_GIVE_UP_SECONDS = 3600
+
+
+def normalize_hook_message(event):
+
+    """
+    Our hook message can look different depending on how we're called.
+    The initial call from AutoScaling has one format, and the call when
+    we send a HeartBeat message has another.  We need to massage them into
+    a consistent format.  We'll follow the format used by AutoScaling
+    versus the HeartBeat message.
+    """
+
+    hook_message = {}
+    # Identify if this is the AutoScaling call
+    if "LifecycleHookName" in event["detail"]:
+        hook_message = event["detail"]
+    # Otherwise this is a HeartBeat call
+    else:
+        hook_message = event["detail"]["requestParameters"]
+        # Heartbeat comes with instanceId instead of EC2InstanceId
+        hook_message["EC2InstanceId"] = hook_message["instanceId"]
+        # Our other three elements need to be capitlized
+        hook_message["LifecycleHookName"] = hook_message["lifecycleHookName"]
+        hook_message["AutoScalingGroupName"] = \
+            hook_message["autoScalingGroupName"]
+        hook_message["LifecycleActionToken"] = \
+            hook_message["lifecycleActionToken"]
+
+    return(hook_message)
+
+
+def _hook_key(hook_message):
+    return("hook:{}".format(hook_message["LifecycleActionToken"]))
+
+
+def find_activity_start_time(asg_c, asg_name, instance_id, activity):
+
+    """
+    Finds when AutoScaling started working on our instance by looking
+    through the group's scaling activities for the most recent one whose
+    description starts with the given activity ('Launching' or
+    'Terminating') and mentions our instance ID.
+
+    Activities are listed newest first, so we stop at the first match.
+    Returns the start time as seconds since the epoch, or None if there's
+    no matching activity.
+    """
+
+    paginator = asg_c.get_paginator('describe_scaling_activities')
+
+    response_iterator = paginator.paginate(
+        AutoScalingGroupName=asg_name,
+        PaginationConfig={
+            'PageSize': 100,
+        }
+    )
+
+    pattern = re.compile("{}.*{}".format(activity, re.escape(instance_id)))
+    for response in response_iterator:
+        for scaling_activity in response["Activities"]:
+            if pattern.match(scaling_activity["Description"]):
+                return(scaling_activity["StartTime"].timestamp())
+
+    return(None)
+
+
+def begin_hook_attempt(asg_c, hook_message, activity, phase,
+                       carried_record=None):
+
+    """
+    Records that we're making another attempt at a lifecycle hook, keyed by
+    its LifecycleActionToken, and returns the hook's record.
+
+    The record holds when the hook started, the phase it's in and how many
+    attempts we've made.  The first time we see a hook we take its start
+    time from the scaling activity history, so a hook picked up after a
+    cold start still knows how long it has been running.
+
+    It also keeps where the instance is moving from and to (Origin and
+    Destination, which tell us about warm pools), as only AutoScaling's
+    own message carries them and not the heartbeat that continues it.
+
+    A continuation we scheduled ourselves may carry the record with it
+    (see lifecycle_core.continuation), which we pick up from if the state
+    store has lost it.
+    """
+
+    store = get_state_store()
+    record = store.get(_hook_key(hook_message))
+
+    if record is None and carried_record is not None:
+        print("Picking up the hook from the record its continuation "
+              "carried")
+        record = carried_record
+
+    if record is None:
+        started_at = find_activity_start_time(
+            asg_c,
+            hook_message["AutoScalingGroupName"],
+            hook_message["EC2InstanceId"],
+            activity
+        )
+        record = {
+            "instance_id": hook_message["EC2InstanceId"],
+            "started_at": started_at or clock.now(),
+            "phase": phase,
+            "attempts": 0,
+            "origin": hook_message.get("Origin"),
+            "destination": hook_message.get("Destination")
+        }
+
+    record["attempts"] += 1
+    store.put(_hook_key(hook_message), record)
+    metrics.current().reinvocations = record["attempts"] - 1
+
+    return(record)
+
+
+def update_hook_phase(hook_message, record, phase):
+
+    """
+    Moves a hook's record on to a new phase.
+    """
+
+    if record["phase"] != phase:
+        record["phase"] = phase
+        get_state_store().put(_hook_key(hook_message), record)
+
+
+def save_hook_record(hook_message, record):
+
+    """
+    Saves what a phase has learnt in the hook's record without moving it
+    on to another phase.
+    """
+
+    get_state_store().put(_hook_key(hook_message), record)
+
+
+def end_hook(hook_message):
+
+    """
+    Forgets a hook once we've sent AutoScaling its result.
+    """
+
+    get_state_store().delete(_hook_key(hook_message))
+
+
+def find_hook_duration(record):
+
+    """
+    Our Lambda function operates in five-minute time samples, however
+    we eventually give up our actions if they take more than 60 minutes.
+
+    Returns how many seconds we've been working on the hook this record
+    belongs to.
+    """
+
+    return(int(clock.now() - record["started_at"]))
+
+
+def complete_hook(asg_c, hook_message, result):
+
+    """
+    Sends AutoScaling our result for the hook, CONTINUE or ABANDON, and
+    forgets the hook.
+    """
+
+    asg_c.complete_lifecycle_action(
+        LifecycleHookName=hook_message["LifecycleHookName"],
+        AutoScalingGroupName=hook_message["AutoScalingGroupName"],
+        LifecycleActionToken=hook_message["LifecycleActionToken"],
+        LifecycleActionResult=result,
+        InstanceId=hook_message["EC2InstanceId"]
+    )
+    end_hook(hook_message)
+    metrics.current().outcome = result
+
+
+def heartbeat_or_abandon(asg_c, hook_message, record, waiting_for):
+
+    """
+    Called when we've run out of time in this invocation.  If we've been
+    at the hook for longer than HOOK_GIVE_UP_SECONDS we ABANDON it,
+    otherwise we send a heartbeat which gets us re-invoked to carry on.
+
+    Unless CONTINUATION_MODE is "heartbeat", the caller arranges its own
+    continuation, so we only send a heartbeat when the hook would
+    otherwise be at risk of timing out.
+
+    Returns the action taken, either "ABANDON" or "HEARTBEAT".
+    """
+
+    hook_duration = find_hook_duration(record)
+    print("We've been waiting {} seconds for {}.".format(
+        hook_duration,
+        waiting_for
+    ))
+
+    if hook_duration > HOOK_GIVE_UP_SECONDS:
+        print("Exceeded {} seconds waiting to stabilize.  Aborting".format(
+            HOOK_GIVE_UP_SECONDS
+        ))
+        complete_hook(asg_c, hook_message, "ABANDON")
+        return("ABANDON")
+
+    metrics.current().outcome = "HEARTBEAT"
+    if CONTINUATION_MODE != "heartbeat" and not heartbeat_due(record):
+        print("Continuing without a Heartbeat, the hook isn't close to "
+              "timing out")
+        return("HEARTBEAT")
+
+    print("Sending a Heartbeat to continue waiting")
+    asg_c.record_lifecycle_action_heartbeat(
+        LifecycleHookName=hook_message["LifecycleHookName"],
+        AutoScalingGroupName=hook_message["AutoScalingGroupName"],
+        LifecycleActionToken=hook_message["LifecycleActionToken"],
+        InstanceId=hook_message["EC2InstanceId"]
+    )
+    if CONTINUATION_MODE != "heartbeat":
+        record["heartbeat_at"] = clock.now()
+        save_hook_record(hook_message, record)
+    return("HEARTBEAT")
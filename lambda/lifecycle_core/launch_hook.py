@@ -0,0 +1,233 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+The launch lifecycle hook workflow, shared by the launch function and the
+SQS batch function.
+"""
+
+import os
+
+from lifecycle_core import metrics
+from lifecycle_core.cluster_name import find_cluster_name
+from lifecycle_core.container_instances import find_container_instance
+from lifecycle_core.continuation import continue_hook
+from lifecycle_core.hooks import begin_hook_attempt
+from lifecycle_core.hooks import complete_hook
+from lifecycle_core.hooks import heartbeat_or_abandon
+from lifecycle_core.launch_watch import LAUNCH_WATCH_MODE
+from lifecycle_core.launch_watch import shared_instance_ready
+from lifecycle_core.polling import PollScheduler
+
+# An instance coming out of a warm pool has already booted, and usually
+# already registered with the cluster, so it only has to start up and
+# reconnect its agent.  We check on it more often than on an instance
+# booting from scratch.
+WARM_POOL_POLL_MIN_INTERVAL = float(
+    os.environ.get("WARM_POOL_POLL_MIN_INTERVAL", "1")
+)
+WARM_POOL_POLL_MAX_INTERVAL = float(
+    os.environ.get("WARM_POOL_POLL_MAX_INTERVAL", "5")
+)
+
+
+def find_warm_pool_move(asg_c, hook_message, hook_record):
+
+    """
+    Works out whether a launch hook is for an instance moving into or out
+    of the group's warm pool.
+
+    AutoScaling tells us with the hook's Origin and Destination, which the
+    hook's record keeps.  When we don't have them, such as a continuation
+    picked up after the record was lost, we ask AutoScaling for the
+    instance's lifecycle state.  A Warmed:* state means it's launching
+    into the warm pool.
+
+    Returns "into-warm-pool", "from-warm-pool" or None.
+    """
+
+    origin = hook_record.get("origin")
+    destination = hook_record.get("destination")
+
+    if origin is None and destination is None:
+        response = asg_c.describe_auto_scaling_instances(
+            InstanceIds=[hook_message["EC2InstanceId"]]
+        )
+        for instance in response["AutoScalingInstances"]:
+            if instance["LifecycleState"].startswith("Warmed:"):
+                destination = "WarmPool"
+
+    if destination == "WarmPool":
+        return("into-warm-pool")
+    if origin == "WarmPool":
+        return("from-warm-pool")
+    return(None)
+
+
+@metrics.phase
+def container_instance_healthy(ecs_c, cluster_name, instance_id, context,
+                               from_warm_pool=False):
+
+    """
+    Looks up the cluster to see if we have an instance joined that matches
+    the instance ID of the one we've just started.
+
+    If we find a cluster member that matches our recently launched instance
+    ID, checks whether it's in a status of ACTIVE and shows it's ECS
+    agent is connected to the cluster.
+
+    There could be additional checks put in as desired to verify the
+    instance is healthy!
+
+    When LAUNCH_WATCH_MODE is "cluster" we instead check the instance
+    against a cluster scan shared by every launch hook waiting on the
+    cluster, so many launches at once don't each scan the cluster.
+
+    Checks are scheduled by a PollScheduler, backing off from a few
+    seconds apart up to POLL_MAX_INTERVAL.  If we're getting short of time
+    waiting for stability return false so we can get a continuation.
+
+    An instance coming out of a warm pool is checked on its own, every
+    WARM_POOL_POLL_MIN_INTERVAL to WARM_POOL_POLL_MAX_INTERVAL seconds,
+    rather than waiting on the next shared scan.
+    """
+
+    if from_warm_pool:
+        poller = PollScheduler(
+            context,
+            "warm_instance_healthy",
+            WARM_POOL_POLL_MIN_INTERVAL,
+            WARM_POOL_POLL_MAX_INTERVAL
+        )
+    else:
+        poller = PollScheduler(context, "container_instance_healthy")
+
+    while True:
+
+        if LAUNCH_WATCH_MODE == "cluster" and not from_warm_pool:
+            ready, api_calls = shared_instance_ready(
+                ecs_c,
+                cluster_name,
+                instance_id
+            )
+            print("- Shared readiness check made {} ECS API calls".format(
+                api_calls
+            ))
+
+        else:
+            container_instance, api_calls = find_container_instance(
+                ecs_c,
+                cluster_name,
+                instance_id
+            )
+            print("- Container instance lookup made {} ECS API calls".format(
+                api_calls
+            ))
+            ready = container_instance is not None and \
+                container_instance["status"] == "ACTIVE" and \
+                container_instance["agentConnected"] is True
+
+        if ready:
+            print("- Instance became healthy after {:.1f} "
+                  "seconds".format(poller.converged()))
+            return(True)
+
+        if not poller.wait():
+            return(False)
+
+
+def process_launch_hook(ec2_c, ecs_c, asg_c, hook_message, context,
+                        carried_record=None):
+
+    """
+    Works a launch hook for as long as the context allows: waits for the
+    new instance to join its ECS cluster and completes the hook with
+    CONTINUE, or sends a heartbeat (or ABANDONs) if it hasn't joined yet.
+
+    An instance launching into a warm pool won't join the cluster until
+    it leaves the pool, so we let it carry on straight away.
+
+    Unless CONTINUATION_MODE is "heartbeat" we arrange our own
+    continuation when we need more time (see
+    lifecycle_core.continuation).  carried_record is the hook record a
+    continuation brought with it, if any.
+
+    Returns the action we took, "CONTINUE", "HEARTBEAT" or "ABANDON".
+    Exceptions are left for the caller so the hook can be retried.
+    """
+
+    hook_record = begin_hook_attempt(
+        asg_c,
+        hook_message,
+        "Launching",
+        "launch",
+        carried_record
+    )
+    print("Attempt {} at this hook, currently in phase '{}'".format(
+        hook_record["attempts"],
+        hook_record["phase"]
+    ))
+
+    warm_pool_move = find_warm_pool_move(asg_c, hook_message, hook_record)
+    if warm_pool_move == "into-warm-pool":
+        print("Instance {} is launching into the warm pool, it will join "
+              "the ECS Cluster when it leaves the pool".format(
+                  hook_message["EC2InstanceId"]
+              ))
+        complete_hook(asg_c, hook_message, "CONTINUE")
+        return("CONTINUE")
+    if warm_pool_move == "from-warm-pool":
+        print("Instance {} is coming out of the warm pool".format(
+            hook_message["EC2InstanceId"]
+        ))
+
+    print("Determining our ECS Cluster name . . .")
+    cluster_name = find_cluster_name(
+        ec2_c,
+        asg_c,
+        hook_message["AutoScalingGroupName"],
+        hook_message["EC2InstanceId"]
+    )
+    print(". . . found ECS Cluster name '{}'".format(
+        cluster_name
+    ))
+
+    print("Checking status of new instance in the ECS Cluster . . .")
+    if container_instance_healthy(
+            ecs_c,
+            cluster_name,
+            hook_message["EC2InstanceId"],
+            context,
+            warm_pool_move == "from-warm-pool"
+            ):
+        print(". . . Instance {} connected and active".format(
+            hook_message["EC2InstanceId"]
+        ))
+        print("Proceeding with instance {} Launch".format(
+            hook_message["EC2InstanceId"]
+        ))
+        complete_hook(asg_c, hook_message, "CONTINUE")
+        return("CONTINUE")
+
+    print("Determined we cannot proceed with launch.")
+    action = heartbeat_or_abandon(
+        asg_c,
+        hook_message,
+        hook_record,
+        "instance join"
+    )
+    if action == "HEARTBEAT":
+        continue_hook(hook_message, hook_record, context)
+    return(action)
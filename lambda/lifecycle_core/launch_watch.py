@@ -0,0 +1,237 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import os
+import uuid
+
+from botocore.exceptions import ClientError
+
+from lifecycle_core import clock
+from lifecycle_core.cache import TTLCache
+from lifecycle_core.container_instances import describe_container_instances
+from lifecycle_core.container_instances import list_container_instance_pages
+from lifecycle_core.hooks import HOOK_GIVE_UP_SECONDS
+from lifecycle_core.state import get_state_store
+
+# How launch hooks find out their instance has joined the cluster.  With
+# "instance" each hook looks its own instance up.  With "cluster" the
+# hooks waiting on a cluster share one filtered lookup of all their
+# instances every LAUNCH_SCAN_INTERVAL seconds through the state store,
+# so a scale out of many instances costs one lookup per interval rather
+# than one per hook.  Sharing needs a state store every invocation can
+# see, such as DynamoDB.
+LAUNCH_WATCH_MODE = os.environ.get("LAUNCH_WATCH_MODE", "instance")
+LAUNCH_SCAN_INTERVAL = float(os.environ.get("LAUNCH_SCAN_INTERVAL", "15"))
+
+# How long a scan may take before another invocation can take it over.
+LAUNCH_SCAN_LEASE_SECONDS = 60
+
+# How long instances stay on the watch list and in the ready list, so a
+# hook which gave up or has been told its instance is ready drops off.
+LAUNCH_WATCH_RETENTION = HOOK_GIVE_UP_SECONDS
+LAUNCH_READY_RETENTION = 600
+
+# How many instance IDs we put in one cluster query language filter.
+SCAN_BATCH_SIZE = 50
+
+# EC2 instance IDs keyed by container instance ARN.  The mapping never
+# changes, so a warm container only describes instances it hasn't seen.
+_instance_ids = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+
+def _scan_key(cluster_name):
+    return("launch-scan:{}".format(cluster_name))
+
+
+def _lease_key(cluster_name):
+    return("launch-scan-lease:{}".format(cluster_name))
+
+
+def find_ready_instances(ecs_c, cluster_name, instance_ids):
+
+    """
+    Finds which of the given instances are ACTIVE in the cluster with
+    their ECS agent connected.
+
+    We have ECS filter the listing down to just those instances for us,
+    up to SCAN_BATCH_SIZE at a time, and only describe the ones we don't
+    already know the EC2 instance IDs of.  If the filter is rejected we
+    list the whole cluster and describe all of it.
+
+    Returns a tuple of the set of ready EC2 instance IDs and the number of
+    ECS API calls made.
+    """
+
+    api_calls = 0
+    ready = set()
+    instance_ids = sorted(instance_ids)
+
+    try:
+        unknown_arns = []
+        for i in range(0, len(instance_ids), SCAN_BATCH_SIZE):
+            filter_expression = \
+                "agentConnected == true and ec2InstanceId in [{}]".format(
+                    ", ".join(instance_ids[i:i + SCAN_BATCH_SIZE])
+                )
+            for page in list_container_instance_pages(
+                    ecs_c,
+                    cluster_name,
+                    filter_expression,
+                    status="ACTIVE"
+                    ):
+                api_calls += 1
+                for arn in page:
+                    instance_id = _instance_ids.get(arn)
+                    if instance_id is None:
+                        unknown_arns.append(arn)
+                    else:
+                        ready.add(instance_id)
+
+        container_instances, calls = describe_container_instances(
+            ecs_c,
+            cluster_name,
+            unknown_arns
+        )
+        api_calls += calls
+
+        for container_instance in container_instances:
+            _instance_ids.put(
+                container_instance["containerInstanceArn"],
+                container_instance["ec2InstanceId"]
+            )
+            ready.add(container_instance["ec2InstanceId"])
+
+        return(ready, api_calls)
+
+    except ClientError as e:
+        api_calls += 1
+        print(" ! Filtered cluster scan failed, scanning the whole "
+              "cluster instead: {}".format(e))
+
+    wanted = set(instance_ids)
+    for page in list_container_instance_pages(ecs_c, cluster_name):
+        api_calls += 1
+        container_instances, calls = describe_container_instances(
+            ecs_c,
+            cluster_name,
+            page
+        )
+        api_calls += calls
+
+        for container_instance in container_instances:
+            if container_instance["ec2InstanceId"] in wanted and \
+                    container_instance["status"] == "ACTIVE" and \
+                    container_instance["agentConnected"] is True:
+                ready.add(container_instance["ec2InstanceId"])
+
+    return(ready, api_calls)
+
+
+def _update_scan(store, ecs_c, cluster_name, instance_id, now):
+
+    """
+    Adds an instance to the cluster's watch list and, if the last scan is
+    due for a refresh, looks up every watched instance.  Only called while
+    holding the scan lease.
+    """
+
+    api_calls = 0
+
+    # Re-read now we hold the lease, someone may have just published a
+    # scan.
+    scan = store.get(_scan_key(cluster_name)) or {
+        "scanned_at": 0,
+        "watching": {},
+        "ready": {}
+    }
+    if instance_id in scan["ready"]:
+        return(scan, api_calls)
+
+    watching = dict(
+        (watched, since) for watched, since in scan["watching"].items()
+        if now - since < LAUNCH_WATCH_RETENTION
+    )
+    watching.setdefault(instance_id, now)
+    scan["watching"] = watching
+
+    if now - scan["scanned_at"] >= LAUNCH_SCAN_INTERVAL:
+        ready, api_calls = find_ready_instances(
+            ecs_c, cluster_name, watching
+        )
+        print("- Looked up {} watched instances, {} ready".format(
+            len(watching), len(ready)
+        ))
+        scan = {
+            "scanned_at": clock.now(),
+            "watching": dict(
+                (watched, since) for watched, since in watching.items()
+                if watched not in ready
+            ),
+            "ready": dict(
+                (seen, at) for seen, at in scan["ready"].items()
+                if now - at < LAUNCH_READY_RETENTION
+            )
+        }
+        scan["ready"].update((seen, now) for seen in ready)
+
+    store.put(_scan_key(cluster_name), scan)
+
+    return(scan, api_calls)
+
+
+def shared_instance_ready(ecs_c, cluster_name, instance_id):
+
+    """
+    Checks whether an instance is ready using the cluster's shared scan.
+
+    The shared scan record holds the instances launch hooks are waiting
+    on and those found ready.  If our instance isn't on the watch list
+    yet, or the last scan is older than LAUNCH_SCAN_INTERVAL, we try to
+    take the cluster's scan lease.  Whoever gets it adds their instance to
+    the watch list and, if a scan is due, looks up every watched instance
+    in one go and publishes the result for everyone else.  The rest of us
+    read the last published scan and check again on our next poll.
+
+    Returns a tuple of whether the instance was ready in the latest scan
+    and the number of ECS API calls we made.
+    """
+
+    store = get_state_store()
+    api_calls = 0
+    now = clock.now()
+
+    scan = store.get(_scan_key(cluster_name))
+    if scan is not None and instance_id in scan["ready"]:
+        return(True, api_calls)
+
+    due = scan is None or now - scan["scanned_at"] >= LAUNCH_SCAN_INTERVAL
+    if due or instance_id not in scan["watching"]:
+        owner = uuid.uuid4().hex
+        if store.acquire_lease(
+                _lease_key(cluster_name), owner, LAUNCH_SCAN_LEASE_SECONDS
+                ):
+            try:
+                scan, api_calls = _update_scan(
+                    store, ecs_c, cluster_name, instance_id, now
+                )
+            finally:
+                store.release_lease(_lease_key(cluster_name), owner)
+        else:
+            print("- Another invocation is scanning the cluster")
+
+    if scan is None:
+        return(False, api_calls)
+
+    return(instance_id in scan["ready"], api_calls)
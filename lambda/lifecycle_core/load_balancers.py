@@ -0,0 +1,226 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Deregisters the load balancer targets of the service tasks on an instance
+we're draining, and follows them until they've finished deregistering.
+
+ECS only deregisters a task from its target groups once its replacement
+is running, and only stops it once the target group's deregistration
+delay has run out.  Starting the delay when the drain starts overlaps it
+with starting the replacements, and following the targets tells us
+whether a slow drain is waiting on the delay or on the tasks.
+"""
+
+import os
+
+from botocore.exceptions import ClientError
+
+from lifecycle_core import clock
+from lifecycle_core.clients import get_client
+from lifecycle_core.stability import describe_instance_tasks
+from lifecycle_core.stability import describe_named_services
+
+# When "true", the terminate function deregisters the instance's service
+# tasks from their ELBv2 target groups as it sets the instance to
+# DRAINING, rather than leaving ECS to do it task by task.  The tasks stop
+# taking new connections before their replacements are running, so the
+# rest of each service needs the headroom to take their share.
+DRAIN_DEREGISTER_TARGETS = os.environ.get(
+    "DRAIN_DEREGISTER_TARGETS", "false"
+) == "true"
+
+# Target states that mean a target has finished deregistering.
+DEREGISTERED_STATES = frozenset(["unused"])
+
+
+def _task_ip(task):
+
+    """
+    Returns the private IP of an awsvpc task's network interface, or None
+    for tasks sharing their instance's network.
+    """
+
+    for attachment in task.get("attachments", []):
+        if attachment.get("type") != "ElasticNetworkInterface":
+            continue
+        for detail in attachment.get("details", []):
+            if detail["name"] == "privateIPv4Address":
+                return(detail["value"])
+
+    return(None)
+
+
+def task_targets(task, service, instance_id):
+
+    """
+    Works out the ELBv2 targets a service task is registered as: its IP
+    and container port for awsvpc tasks, otherwise our instance and the
+    host port its container port is bound to.
+
+    Returns a list of (target group ARN, target) pairs.
+    """
+
+    targets = []
+    ip = _task_ip(task)
+    for load_balancer in service.get("loadBalancers", []):
+        # Classic load balancers don't have target groups.
+        target_group_arn = load_balancer.get("targetGroupArn")
+        if not target_group_arn:
+            continue
+
+        if ip is not None:
+            targets.append((target_group_arn, {
+                "Id": ip,
+                "Port": load_balancer["containerPort"]
+            }))
+            continue
+
+        for container in task.get("containers", []):
+            if container.get("name") != load_balancer["containerName"]:
+                continue
+            for binding in container.get("networkBindings", []):
+                if binding["containerPort"] == \
+                        load_balancer["containerPort"]:
+                    targets.append((target_group_arn, {
+                        "Id": instance_id,
+                        "Port": binding["hostPort"]
+                    }))
+
+    return(targets)
+
+
+def find_instance_targets(ecs_c, cluster_name, container_instance_arn,
+                          instance_id):
+
+    """
+    Finds the ELBv2 targets of the service tasks running on a container
+    instance (see task_targets).
+
+    Returns a tuple of the targets, as lists keyed by target group ARN,
+    and the number of ECS API calls made.
+    """
+
+    tasks, api_calls = describe_instance_tasks(
+        ecs_c,
+        cluster_name,
+        container_instance_arn
+    )
+    service_tasks = [
+        task for task in tasks
+        if task.get("group", "").startswith("service:") and
+        task.get("desiredStatus") == "RUNNING"
+    ]
+
+    services, calls = describe_named_services(
+        ecs_c,
+        cluster_name,
+        set(task["group"][len("service:"):] for task in service_tasks)
+    )
+    api_calls += calls
+
+    targets = {}
+    for task in service_tasks:
+        service = services.get(task["group"][len("service:"):], {})
+        for target_group_arn, target in task_targets(
+                task, service, instance_id
+                ):
+            targets.setdefault(target_group_arn, []).append(target)
+
+    return(targets, api_calls)
+
+
+def begin_deregistration(targets):
+
+    """
+    Deregisters every target from its target group.  This is best effort,
+    as ECS deregisters each task itself before stopping it anyway, so we
+    carry on past any target group we can't deregister from.
+
+    Returns the record check_deregistration follows the targets with.
+    """
+
+    elbv2_c = get_client('elbv2')
+    for target_group_arn, group_targets in targets.items():
+        try:
+            elbv2_c.deregister_targets(
+                TargetGroupArn=target_group_arn,
+                Targets=group_targets
+            )
+        except ClientError as e:
+            print(" ! Unable to deregister targets from {}: {}".format(
+                target_group_arn,
+                e
+            ))
+
+    return({
+        "targets": targets,
+        "started_at": clock.now(),
+        "finished_at": None
+    })
+
+
+def check_deregistration(deregistration):
+
+    """
+    Checks on the targets begin_deregistration deregistered, dropping
+    those that have finished from the record, and noting when the last of
+    them finishes.  A target group that's gone has nothing left to drain.
+
+    Returns the number of ELBv2 API calls made.
+    """
+
+    elbv2_c = get_client('elbv2')
+    api_calls = 0
+    for target_group_arn in list(deregistration["targets"]):
+        api_calls += 1
+        try:
+            response = elbv2_c.describe_target_health(
+                TargetGroupArn=target_group_arn,
+                Targets=deregistration["targets"][target_group_arn]
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TargetGroupNotFound":
+                raise
+            del deregistration["targets"][target_group_arn]
+            continue
+
+        remaining = [
+            description["Target"]
+            for description in response["TargetHealthDescriptions"]
+            if description["TargetHealth"]["State"] not in
+            DEREGISTERED_STATES
+        ]
+        if remaining:
+            deregistration["targets"][target_group_arn] = remaining
+        else:
+            del deregistration["targets"][target_group_arn]
+
+    if not deregistration["targets"] and \
+            deregistration["finished_at"] is None:
+        deregistration["finished_at"] = clock.now()
+
+    return(api_calls)
+
+
+def count_targets(deregistration):
+
+    """
+    Returns how many targets in a deregistration record haven't finished.
+    """
+
+    return(sum(
+        len(targets) for targets in deregistration["targets"].values()
+    ))
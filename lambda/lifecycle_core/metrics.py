@@ -0,0 +1,254 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import functools
+import json
+import os
+import threading
+
+from lifecycle_core import clock
+
+# The CloudWatch namespace our Embedded Metric Format logs publish to.
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ECSClusterManager")
+
+_local = threading.local()
+
+
+class MetricsRecorder(object):
+
+    """
+    Collects the measurements for one hook invocation: how long each
+    phase took, the API calls and poll iterations each phase needed, the
+    API calls made per operation, how many times the hook has been
+    re-invoked and the result we sent AutoScaling.
+
+    flush() prints them as structured JSON logs, using CloudWatch's
+    Embedded Metric Format so CloudWatch Logs turns them into metrics
+    without any extra API calls.
+    """
+
+    def __init__(self, hook):
+        self.hook = hook
+        self.phases = {}
+        self.api_calls = {}
+        self.reinvocations = None
+        self.outcome = None
+        self._open_phases = []
+        self._lock = threading.Lock()
+
+    def begin_phase(self, name):
+        self._open_phases.append(name)
+        self.phases.setdefault(name, {
+            "Duration": 0.0,
+            "ApiCalls": 0,
+            "PollIterations": 0
+        })
+        return(clock.now())
+
+    def end_phase(self, name, started):
+        self._open_phases.remove(name)
+        phase = self.phases[name]
+        phase["Duration"] += (clock.now() - started) * 1000.0
+        print(json.dumps({
+            "log": "phase",
+            "hook": self.hook,
+            "phase": name,
+            "duration_ms": round(phase["Duration"], 1),
+            "api_calls": phase["ApiCalls"],
+            "poll_iterations": phase["PollIterations"]
+        }))
+
+    def count_api_call(self, operation):
+        # Describe calls are made from worker threads, so guard our counts.
+        with self._lock:
+            self.api_calls[operation] = self.api_calls.get(operation, 0) + 1
+            for name in self._open_phases:
+                self.phases[name]["ApiCalls"] += 1
+
+    def add_poll_iterations(self, count):
+        for name in self._open_phases:
+            self.phases[name]["PollIterations"] += count
+
+    def _document(self, dimensions, metrics, units):
+        document = {
+            "_aws": {
+                "Timestamp": int(clock.now() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": [
+                        {"Name": name, "Unit": units[name]}
+                        for name in sorted(metrics)
+                    ]
+                }]
+            }
+        }
+        document.update(dimensions)
+        document.update(metrics)
+        return(json.dumps(document, sort_keys=True))
+
+    def flush(self):
+
+        """
+        Prints one EMF document per phase and per API operation, and one
+        for the invocation as a whole.
+        """
+
+        for name, phase in sorted(self.phases.items()):
+            print(self._document(
+                {"Hook": self.hook, "Phase": name},
+                phase,
+                {
+                    "Duration": "Milliseconds",
+                    "ApiCalls": "Count",
+                    "PollIterations": "Count"
+                }
+            ))
+
+        for operation, calls in sorted(self.api_calls.items()):
+            print(self._document(
+                {"Hook": self.hook, "Operation": operation},
+                {"ApiCalls": calls},
+                {"ApiCalls": "Count"}
+            ))
+
+        invocation = {
+            "ApiCalls": sum(self.api_calls.values())
+        }
+        if self.reinvocations is not None:
+            invocation["Reinvocations"] = self.reinvocations
+        if self.outcome is not None:
+            invocation[self.outcome] = 1
+        print(self._document(
+            {"Hook": self.hook},
+            invocation,
+            dict((name, "Count") for name in invocation)
+        ))
+
+
+class _NullRecorder(MetricsRecorder):
+
+    """
+    Used when nothing is recording, so instrumented code doesn't have to
+    check.
+    """
+
+    def __init__(self):
+        super(_NullRecorder, self).__init__(None)
+
+    def begin_phase(self, name):
+        return(clock.now())
+
+    def end_phase(self, name, started):
+        pass
+
+    def count_api_call(self, operation):
+        pass
+
+    def add_poll_iterations(self, count):
+        pass
+
+    def flush(self):
+        pass
+
+
+def start_recording(hook):
+
+    """
+    Starts recording metrics for a hook invocation on this thread.
+    """
+
+    _local.recorder = MetricsRecorder(hook)
+    return(_local.recorder)
+
+
+def current():
+
+    """
+    Returns the recorder for the invocation running on this thread.
+    """
+
+    recorder = getattr(_local, "recorder", None)
+    if recorder is None:
+        recorder = _NullRecorder()
+        _local.recorder = recorder
+    return(recorder)
+
+
+def stop_recording():
+
+    """
+    Flushes and stops the recorder for this thread.
+    """
+
+    recorder = current()
+    recorder.flush()
+    _local.recorder = None
+
+
+def bind(function):
+
+    """
+    Wraps a function about to be handed to a worker thread so the calls
+    it makes are recorded against this thread's invocation.
+    """
+
+    recorder = current()
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        _local.recorder = recorder
+        try:
+            return(function(*args, **kwargs))
+        finally:
+            _local.recorder = None
+
+    return(bound)
+
+
+def phase(function):
+
+    """
+    Decorates a function so each call to it is recorded as a phase of the
+    same name.
+    """
+
+    @functools.wraps(function)
+    def recorded(*args, **kwargs):
+        recorder = current()
+        started = recorder.begin_phase(function.__name__)
+        try:
+            return(function(*args, **kwargs))
+        finally:
+            recorder.end_phase(function.__name__, started)
+
+    return(recorded)
+
+
+def _before_call(model, **kwargs):
+    current().count_api_call("{}.{}".format(
+        model.service_model.service_name,
+        model.name
+    ))
+
+
+def instrument_client(client):
+
+    """
+    Counts every call a client makes against the recorder of the thread
+    making it.
+    """
+
+    client.meta.events.register('before-call', _before_call)
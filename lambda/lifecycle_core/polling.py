@@ -0,0 +1,211 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import os
+import random
+from collections import deque
+
+from lifecycle_core import clock
+from lifecycle_core import metrics
+from lifecycle_core.continuation import CONTINUATION_MODE
+from lifecycle_core.ratelimit import api_budget
+
+# Polls start POLL_MIN_INTERVAL seconds apart and back off by POLL_BACKOFF
+# each time up to POLL_MAX_INTERVAL, with some jitter so concurrent hooks
+# don't poll in lock step.  POLL_DEADLINE_MARGIN seconds of the Lambda
+# execution time are held back for sending a heartbeat or result.
+POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", "30"))
+POLL_BACKOFF = float(os.environ.get("POLL_BACKOFF", "2"))
+POLL_DEADLINE_MARGIN = float(os.environ.get("POLL_DEADLINE_MARGIN", "10"))
+
+# A poll only looks at its deadline after its first check, and the first
+# check of a phase can be a full stability pass over the cluster.  So we
+# only start a phase with at least PHASE_START_MARGIN seconds of the
+# Lambda execution time left, as we did before polls had a deadline.
+PHASE_START_MARGIN = float(os.environ.get("PHASE_START_MARGIN", "40"))
+
+# How many observed convergence times we remember for each kind of poll.
+CONVERGENCE_HISTORY = 20
+
+# Seconds each kind of poll took to see its condition met, kept across
+# invocations of a warm Lambda container.
+_convergence = {}
+
+
+def expected_convergence(name):
+
+    """
+    Returns the median number of seconds a poll of this name has taken to
+    converge in this container, or None if we haven't seen one yet.
+    """
+
+    observed = sorted(_convergence.get(name, ()))
+    if not observed:
+        return(None)
+
+    return(observed[len(observed) // 2])
+
+
+def time_for_phase(context):
+
+    """
+    Whether there's time left in this invocation to start another phase,
+    see PHASE_START_MARGIN.
+    """
+
+    return(context.get_remaining_time_in_millis() / 1000.0 >
+           PHASE_START_MARGIN)
+
+
+class PollScheduler(object):
+
+    """
+    Decides when a polling loop should check again, and when it has run
+    out of Lambda execution time and should hand over to a re-invocation.
+
+    Used as:
+
+        poller = PollScheduler(context, "instance_drained")
+        while True:
+            if condition_met():
+                poller.converged()
+                return(True)
+            if not poller.wait():
+                return(False)
+
+    Intervals back off exponentially with jitter, and stretch further while
+    we're being throttled by AWS.  If earlier polls of the
+    same name converged after a typical time we aim a check at that point
+    rather than sleeping past it.  Near the deadline we fit in one last
+    check, allowing for how long checks have been taking, rather than
+    giving up with time to spare.
+
+    If the caller can predict when the condition will be met (as an epoch
+    time) we sleep straight to that point rather than polling on the way,
+    and if it's beyond this invocation's deadline we hand over to a
+    re-invocation straight away rather than polling until the deadline.
+    With CONTINUATION_MODE "invoke" the re-invocation would start straight
+    away too, so we wait out this invocation with one last check instead.
+
+    A caller with a harder deadline than the end of the invocation, such
+    as a Spot instance's termination time, can pass it (again as an epoch
+    time) and we'll stop at whichever comes first.
+    """
+
+    def __init__(self, context, name, min_interval=None, max_interval=None,
+                 backoff=None, margin=None, predicted=None, deadline=None):
+
+        self.name = name
+        self.min_interval = POLL_MIN_INTERVAL \
+            if min_interval is None else min_interval
+        self.max_interval = POLL_MAX_INTERVAL \
+            if max_interval is None else max_interval
+        self.backoff = POLL_BACKOFF if backoff is None else backoff
+        margin = POLL_DEADLINE_MARGIN if margin is None else margin
+
+        self.started = clock.now()
+        self.deadline = self.started + \
+            context.get_remaining_time_in_millis() / 1000.0 - margin
+        if deadline is not None:
+            self.deadline = min(self.deadline, deadline)
+        self.interval = self.min_interval
+        self.predicted = predicted
+        self.polls = 1
+        self.check_duration = 0
+        self._check_started = self.started
+        self._final = False
+
+    def remaining(self):
+        return(self.deadline - clock.now())
+
+    def wait(self):
+
+        """
+        Sleeps until the next check is due.
+
+        Returns True if the caller should check again, or False if there
+        isn't time left for another check before the deadline.
+        """
+
+        now = clock.now()
+        self.check_duration = max(
+            self.check_duration,
+            now - self._check_started
+        )
+
+        if self._final:
+            metrics.current().add_poll_iterations(self.polls)
+            return(False)
+
+        if self.predicted is not None and now < self.predicted:
+            if self.predicted > self.deadline and \
+                    CONTINUATION_MODE != "invoke":
+                print("- Expecting to finish in {:.0f} seconds, after this "
+                      "invocation ends".format(self.predicted - now))
+                metrics.current().add_poll_iterations(self.polls)
+                return(False)
+            delay = self.predicted - now
+            # Once we've slept to the prediction we're back to polling.
+            self.predicted = None
+
+        else:
+            delay = random.uniform(self.interval / 2.0, self.interval)
+            self.interval = min(
+                self.max_interval,
+                self.interval * self.backoff
+            )
+
+            # If AWS has been throttling us, ease off rather than add to it.
+            congestion = api_budget.congestion()
+            if congestion > 1:
+                delay = min(self.max_interval, delay * congestion)
+
+            expected = expected_convergence(self.name)
+            if expected is not None:
+                until_expected = self.started + expected - now
+                if self.min_interval <= until_expected < delay:
+                    delay = until_expected
+
+        latest_start = self.deadline - self.check_duration
+        if now + delay > latest_start:
+            if latest_start - now < 1:
+                metrics.current().add_poll_iterations(self.polls)
+                return(False)
+            delay = latest_start - now
+            self._final = True
+
+        clock.sleep(delay)
+        self.polls += 1
+        self._check_started = clock.now()
+
+        return(True)
+
+    def converged(self):
+
+        """
+        Records that the condition we were polling for has been met, and
+        returns how many seconds it took.
+        """
+
+        elapsed = clock.now() - self.started
+        metrics.current().add_poll_iterations(self.polls)
+        history = _convergence.setdefault(
+            self.name,
+            deque(maxlen=CONVERGENCE_HISTORY)
+        )
+        history.append(elapsed)
+
+        return(elapsed)
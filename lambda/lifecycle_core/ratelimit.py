@@ -0,0 +1,223 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import json
+import os
+import threading
+
+from lifecycle_core import clock
+
+# Calls per second we allow ourselves against each AWS service, and
+# optionally against individual operations, as a JSON object such as
+# {"ecs": 10, "ecs.ListTasks": 2}.  A call has to fit within both its
+# service budget and, if one is set, its operation budget.  Each budget
+# allows bursts of up to one second's worth of calls.
+DEFAULT_API_RATE_BUDGETS = {
+    "ecs": 10,
+    "autoscaling": 5,
+    "ec2": 20
+}
+API_RATE_BUDGETS = dict(
+    DEFAULT_API_RATE_BUDGETS,
+    **json.loads(os.environ.get("API_RATE_BUDGETS", "{}"))
+)
+
+# How long a throttle we've seen keeps slowing down our polling loops.
+THROTTLE_WINDOW_SECONDS = 60
+
+THROTTLE_ERROR_CODES = frozenset([
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "Rate exceeded"
+])
+
+
+class TokenBucket(object):
+
+    """
+    A token bucket refilled at rate tokens per second, holding at most
+    burst tokens.  acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated = clock.now()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+
+        """
+        Takes a token, sleeping until one is available.  Returns how many
+        seconds we waited.
+        """
+
+        with self._lock:
+            now = clock.now()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            clock.sleep(wait)
+
+        return(wait)
+
+
+class ApiBudget(object):
+
+    """
+    Rate limits the calls the lifecycle functions make to AWS, and keeps
+    count of the calls, throttles and retries we see for each operation.
+    """
+
+    def __init__(self, budgets):
+        self._buckets = dict(
+            (key, TokenBucket(rate)) for key, rate in budgets.items()
+        )
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._recent_throttles = []
+
+    def _operation_stats(self, service_name, operation_name):
+        key = "{}.{}".format(service_name, operation_name)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = {
+                "calls": 0,
+                "throttles": 0,
+                "retries": 0,
+                "waited": 0.0
+            }
+            self._stats[key] = stats
+        return(stats)
+
+    def acquire(self, service_name, operation_name):
+
+        """
+        Waits until a call to this operation fits within our budgets.
+        """
+
+        waited = 0.0
+        for key in (
+                service_name,
+                "{}.{}".format(service_name, operation_name)
+                ):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                waited += bucket.acquire()
+
+        with self._lock:
+            stats = self._operation_stats(service_name, operation_name)
+            stats["calls"] += 1
+            stats["waited"] += waited
+
+    def record_attempt(self, service_name, operation_name, attempts,
+                       error_code):
+
+        """
+        Records the outcome of one attempt at a call, whether it was
+        throttled and whether it was itself a retry.
+        """
+
+        with self._lock:
+            stats = self._operation_stats(service_name, operation_name)
+            if attempts > 1:
+                stats["retries"] += 1
+            if error_code in THROTTLE_ERROR_CODES:
+                stats["throttles"] += 1
+                self._recent_throttles.append(clock.now())
+
+    def congestion(self):
+
+        """
+        Returns a factor of 1 or more by which polling loops should
+        stretch their intervals, growing with the number of throttles
+        we've seen in the last THROTTLE_WINDOW_SECONDS.
+        """
+
+        cutoff = clock.now() - THROTTLE_WINDOW_SECONDS
+        with self._lock:
+            self._recent_throttles = [
+                seen for seen in self._recent_throttles if seen > cutoff
+            ]
+            return(1 + min(len(self._recent_throttles), 3))
+
+    def stats(self):
+        with self._lock:
+            return(dict(
+                (key, dict(value)) for key, value in self._stats.items()
+            ))
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+
+api_budget = ApiBudget(API_RATE_BUDGETS)
+
+
+def report_api_usage():
+
+    """
+    Prints the calls, throttles, retries and rate limit waits for each
+    operation we've called during this invocation.
+    """
+
+    for operation, stats in sorted(api_budget.stats().items()):
+        print("- {} made {} calls, {} throttled, {} retries, waited "
+              "{:.2f} seconds for our rate budget".format(
+                  operation,
+                  stats["calls"],
+                  stats["throttles"],
+                  stats["retries"],
+                  stats["waited"]
+              ))
+
+
+def _before_call(model, **kwargs):
+    api_budget.acquire(model.service_model.service_name, model.name)
+
+
+def _needs_retry(response, operation, attempts, **kwargs):
+    error_code = None
+    if response is not None:
+        error_code = response[1].get("Error", {}).get("Code")
+    api_budget.record_attempt(
+        operation.service_model.service_name,
+        operation.name,
+        attempts,
+        error_code
+    )
+
+
+def instrument_client(client):
+
+    """
+    Routes every call a client makes, including those made by its
+    paginators, through the shared API budget.
+    """
+
+    client.meta.events.register('before-call', _before_call)
+    client.meta.events.register_first('needs-retry', _needs_retry)
@@ -0,0 +1,134 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import os
+import uuid
+
+from lifecycle_core import clock
+from lifecycle_core.stability import evaluate_services
+from lifecycle_core.stability import snapshot_cluster
+from lifecycle_core.stability import task_is_stable
+from lifecycle_core.state import get_state_store
+
+# When "true", terminate hooks waiting on the same cluster share full
+# stability passes through the state store.  One invocation at a time
+# holds the cluster's stability lease, takes the snapshot and publishes
+# what it found; the others use the published result rather than each
+# describing the whole cluster.  Sharing needs a state store every
+# invocation can see, such as DynamoDB.
+STABILITY_SHARED = os.environ.get("STABILITY_SHARED", "false") == "true"
+
+# How long a pass may take before another invocation can take it over.
+STABILITY_LEASE_SECONDS = 120
+
+# The most unstable task ARNs we publish, keeping the shared record well
+# inside DynamoDB's item size limit.  A cluster with more unstable tasks
+# than this isn't stable, so the rest aren't needed to decide that.
+MAX_SHARED_UNSTABLE_TASKS = 1000
+
+# Published results are only useful for the length of a pass or two.
+SHARED_RESULT_TTL = 3600
+
+
+def _result_key(cluster_name):
+    return("stability:{}".format(cluster_name))
+
+
+def _lease_key(cluster_name):
+    return("stability-lease:{}".format(cluster_name))
+
+
+def find_unstable(snapshot):
+
+    """
+    Picks the services and tasks out of a snapshot that aren't stable.
+
+    Returns a tuple of the unstable services, as a dictionary of
+    [service name, reasons it isn't steady] keyed by ARN, and the unstable
+    tasks, as a dictionary of [desired status, last status] keyed by ARN.
+    """
+
+    unstable_services = dict(
+        (arn, [snapshot["services"][arn]["serviceName"], reasons])
+        for arn, reasons in evaluate_services(snapshot["services"]).items()
+    )
+    unstable_tasks = dict(
+        (arn, [task["desiredStatus"], task["lastStatus"]])
+        for arn, task in snapshot["tasks"].items()
+        if not task_is_stable(task)
+    )
+
+    return(unstable_services, unstable_tasks)
+
+
+def shared_cluster_stability(ecs_c, cluster_name, after):
+
+    """
+    Finds a full stability pass over the cluster taken after the given
+    time, from the state store if another invocation has published one
+    and otherwise by taking and publishing it ourselves.
+
+    Returns None if someone else holds the cluster's stability lease and
+    is taking the pass right now, in which case we should wait and ask
+    again.  Otherwise returns a dictionary holding when the pass was
+    taken (checked_at), how many services and tasks it covered, the
+    unstable services and tasks as find_unstable returns them, whether
+    the unstable task list was truncated, whether we took the pass from
+    the store (shared) and the ECS API calls and seconds we spent.
+    """
+
+    store = get_state_store()
+
+    result = store.get(_result_key(cluster_name))
+    if result is None or result["checked_at"] <= after:
+        owner = uuid.uuid4().hex
+        if not store.acquire_lease(
+                _lease_key(cluster_name), owner, STABILITY_LEASE_SECONDS
+                ):
+            return(None)
+
+        try:
+            # Re-read now we hold the lease, someone may have just
+            # published a pass.
+            result = store.get(_result_key(cluster_name))
+            if result is None or result["checked_at"] <= after:
+                checked_at = clock.now()
+                snapshot = snapshot_cluster(ecs_c, cluster_name)
+                unstable_services, unstable_tasks = find_unstable(snapshot)
+                result = {
+                    "checked_at": checked_at,
+                    "services": len(snapshot["services"]),
+                    "tasks": len(snapshot["tasks"]),
+                    "unstable_services": unstable_services,
+                    "unstable_tasks": dict(
+                        sorted(unstable_tasks.items())[
+                            :MAX_SHARED_UNSTABLE_TASKS
+                        ]
+                    ),
+                    "truncated":
+                        len(unstable_tasks) > MAX_SHARED_UNSTABLE_TASKS
+                }
+                store.put(_result_key(cluster_name), result, SHARED_RESULT_TTL)
+                result.update(
+                    shared=False,
+                    api_calls=snapshot["api_calls"],
+                    duration=snapshot["duration"]
+                )
+                return(result)
+        finally:
+            store.release_lease(_lease_key(cluster_name), owner)
+
+    result.update(shared=True, api_calls=0, duration=0)
+    return(result)
@@ -0,0 +1,398 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lifecycle_core import metrics
+
+# The most ARNs each describe call accepts, and the largest page the
+# matching list calls will return.
+SERVICE_DESCRIBE_BATCH_SIZE = 10
+TASK_DESCRIBE_BATCH_SIZE = 100
+LIST_PAGE_SIZE = 100
+
+# How many describe calls we allow in flight at once while taking a
+# snapshot.  Setting this to 1 fetches pages one after another.
+STABILITY_MAX_WORKERS = int(os.environ.get("STABILITY_MAX_WORKERS", "8"))
+
+# Between full snapshots, stability passes only re-describe what was
+# unstable last time.  Every this many passes we re-list the whole cluster
+# to pick up services and tasks created since.  1 re-lists every pass.
+STABILITY_FULL_REFRESH_PASSES = int(
+    os.environ.get("STABILITY_FULL_REFRESH_PASSES", "5")
+)
+
+# What the terminate function waits on once an instance has drained.
+# "cluster" waits for every service and task in the cluster to be stable,
+# "drain" only waits on the services and standalone tasks that had tasks
+# on the instance being drained.
+STABILITY_SCOPE = os.environ.get("STABILITY_SCOPE", "cluster")
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _describe_services(ecs_c, cluster_name, service_arns):
+    response = ecs_c.describe_services(
+        cluster=cluster_name,
+        services=service_arns
+    )
+    return(response["services"])
+
+
+def _describe_tasks(ecs_c, cluster_name, task_arns):
+    response = ecs_c.describe_tasks(
+        cluster=cluster_name,
+        tasks=task_arns
+    )
+    return(response["tasks"])
+
+
+# For each kind of snapshot entry, the call that describes it, the key
+# holding its ARN and how many ARNs each call accepts.
+_DESCRIBERS = {
+    "services": (
+        _describe_services, "serviceArn", SERVICE_DESCRIBE_BATCH_SIZE
+    ),
+    "tasks": (
+        _describe_tasks, "taskArn", TASK_DESCRIBE_BATCH_SIZE
+    )
+}
+
+
+def _submit_describes(pool, ecs_c, cluster_name, kind, arns):
+    describe, _, batch_size = _DESCRIBERS[kind]
+
+    return([
+        pool.submit(metrics.bind(describe), ecs_c, cluster_name, batch)
+        for batch in _batches(arns, batch_size)
+    ])
+
+
+def _list_and_describe(pool, ecs_c, cluster_name, kind):
+
+    """
+    Walks list_services or list_tasks, handing each page to the pool to be
+    described as soon as it arrives.  Returns the number of list calls made
+    and the futures for the describe calls.
+    """
+
+    if kind == "services":
+        list_operation, arn_key = 'list_services', "serviceArns"
+    else:
+        list_operation, arn_key = 'list_tasks', "taskArns"
+
+    paginator = ecs_c.get_paginator(list_operation)
+    pages = paginator.paginate(
+        cluster=cluster_name,
+        PaginationConfig={
+            "PageSize": LIST_PAGE_SIZE
+        }
+    )
+
+    list_calls = 0
+    futures = []
+    for page in pages:
+        list_calls += 1
+        futures.extend(_submit_describes(
+            pool, ecs_c, cluster_name, kind, page[arn_key]
+        ))
+
+    return(list_calls, futures)
+
+
+def _collect(snapshot, kind, futures):
+    arn_key = _DESCRIBERS[kind][1]
+    snapshot["api_calls"] += len(futures)
+    for future in futures:
+        for item in future.result():
+            snapshot[kind][item[arn_key]] = item
+
+
+def snapshot_cluster(ecs_c, cluster_name, max_workers=None):
+
+    """
+    Takes a point in time snapshot of every service and task in a cluster.
+
+    Listing services and listing tasks run side by side, and every page of
+    ARNs is described on a bounded thread pool while the listing carries on,
+    so a pass costs roughly the latency of the longest list walk rather
+    than the sum of every describe call.
+
+    Returns a dictionary holding the service and task descriptions keyed by
+    ARN, the number of ECS API calls made and the wall time in seconds the
+    snapshot took.
+    """
+
+    if max_workers is None:
+        max_workers = STABILITY_MAX_WORKERS
+
+    started = time.time()
+    snapshot = {
+        "services": {},
+        "tasks": {},
+        "api_calls": 0,
+        "duration": 0
+    }
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        listings = {
+            kind: pool.submit(
+                metrics.bind(_list_and_describe),
+                pool,
+                ecs_c,
+                cluster_name,
+                kind
+            )
+            for kind in ("services", "tasks")
+        }
+
+        for kind, listing in listings.items():
+            list_calls, futures = listing.result()
+            snapshot["api_calls"] += list_calls
+            _collect(snapshot, kind, futures)
+
+    snapshot["duration"] = time.time() - started
+
+    return(snapshot)
+
+
+def refresh_snapshot(ecs_c, cluster_name, snapshot, service_arns, task_arns,
+                     max_workers=None):
+
+    """
+    Re-describes only the given services and tasks, without listing the
+    cluster again, and returns a new snapshot with their descriptions
+    replaced.
+
+    Anything ECS no longer knows about is dropped from the new snapshot.
+    The api_calls and duration of the returned snapshot cover just this
+    refresh.
+    """
+
+    if max_workers is None:
+        max_workers = STABILITY_MAX_WORKERS
+
+    started = time.time()
+    refreshed = {
+        "services": dict(snapshot["services"]),
+        "tasks": dict(snapshot["tasks"]),
+        "api_calls": 0,
+        "duration": 0
+    }
+
+    for kind, arns in (("services", service_arns), ("tasks", task_arns)):
+        for arn in arns:
+            refreshed[kind].pop(arn, None)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            kind: _submit_describes(pool, ecs_c, cluster_name, kind, arns)
+            for kind, arns in (
+                ("services", list(service_arns)),
+                ("tasks", list(task_arns))
+            )
+        }
+
+        for kind, kind_futures in futures.items():
+            _collect(refreshed, kind, kind_futures)
+
+    refreshed["duration"] = time.time() - started
+
+    return(refreshed)
+
+
+def service_stability(service):
+
+    """
+    Works out from a service's description whether it's in a steady state,
+    rather than trusting its latest event, which can be hours old or
+    missing altogether on a new service.
+
+    A service is steady once only its PRIMARY deployment is left, that
+    deployment's rollout (if ECS reports one) has COMPLETED, and the
+    service is running as many tasks as it wants with none pending.  With
+    only the primary deployment left the service's counts are the
+    deployment's.
+
+    Returns the reasons the service isn't steady, which is an empty list
+    when it is.
+    """
+
+    reasons = []
+
+    deployments = service.get("deployments", [])
+    primary = [d for d in deployments if d["status"] == "PRIMARY"]
+    if len(deployments) > len(primary):
+        reasons.append("{} deployments besides the primary".format(
+            len(deployments) - len(primary)
+        ))
+
+    for deployment in primary:
+        rollout_state = deployment.get("rolloutState", "COMPLETED")
+        if rollout_state != "COMPLETED":
+            reasons.append("primary deployment rollout {}".format(
+                rollout_state
+            ))
+
+    if service["runningCount"] != service["desiredCount"]:
+        reasons.append("running {} of {} tasks".format(
+            service["runningCount"],
+            service["desiredCount"]
+        ))
+    if service["pendingCount"]:
+        reasons.append("{} tasks pending".format(service["pendingCount"]))
+
+    return(reasons)
+
+
+def evaluate_services(services):
+
+    """
+    Evaluates a page, or a whole snapshot, of service descriptions in one
+    pass.  Takes the descriptions keyed by ARN and returns the reasons
+    for each service that isn't steady, also keyed by ARN.
+    """
+
+    evaluated = {}
+    for arn, service in services.items():
+        reasons = service_stability(service)
+        if reasons:
+            evaluated[arn] = reasons
+
+    return(evaluated)
+
+
+def task_is_stable(task):
+
+    """
+    For Tasks we look at the difference between the desired and actual
+    states.  If there is a difference the task is not stable.
+    """
+
+    return(task["lastStatus"] == task["desiredStatus"])
+
+
+def describe_instance_tasks(ecs_c, cluster_name, container_instance_arn):
+
+    """
+    Lists and describes every task on a container instance.
+
+    Returns a tuple of the task descriptions and the number of ECS API
+    calls made.
+    """
+
+    api_calls = 0
+    task_arns = []
+    paginator = ecs_c.get_paginator('list_tasks')
+    pages = paginator.paginate(
+        cluster=cluster_name,
+        containerInstance=container_instance_arn,
+        PaginationConfig={
+            "PageSize": LIST_PAGE_SIZE
+        }
+    )
+    for page in pages:
+        api_calls += 1
+        task_arns.extend(page["taskArns"])
+
+    tasks = []
+    for batch in _batches(task_arns, TASK_DESCRIBE_BATCH_SIZE):
+        api_calls += 1
+        tasks.extend(_describe_tasks(ecs_c, cluster_name, batch))
+
+    return(tasks, api_calls)
+
+
+def describe_named_services(ecs_c, cluster_name, service_names):
+
+    """
+    Describes the named services, ten at a time.
+
+    Returns a tuple of the service descriptions keyed by name and the
+    number of ECS API calls made.
+    """
+
+    api_calls = 0
+    services = {}
+    for batch in _batches(list(service_names), SERVICE_DESCRIBE_BATCH_SIZE):
+        api_calls += 1
+        for service in _describe_services(ecs_c, cluster_name, batch):
+            services[service["serviceName"]] = service
+
+    return(services, api_calls)
+
+
+def find_drain_scope(ecs_c, cluster_name, container_instance_arn):
+
+    """
+    Records what is running on a container instance before we drain it,
+    so we can later wait on just the work it displaced rather than on the
+    whole cluster.
+
+    Returns a dictionary holding the names of the services with tasks on
+    the instance, the ARNs of any standalone tasks (those not started by a
+    service) and the number of ECS API calls made.
+    """
+
+    tasks, api_calls = describe_instance_tasks(
+        ecs_c,
+        cluster_name,
+        container_instance_arn
+    )
+
+    scope = {
+        "services": [],
+        "tasks": [],
+        "api_calls": api_calls
+    }
+
+    services = set()
+    for task in tasks:
+        group = task.get("group", "")
+        if group.startswith("service:"):
+            services.add(group[len("service:"):])
+        else:
+            scope["tasks"].append(task["taskArn"])
+
+    scope["services"] = sorted(services)
+
+    return(scope)
+
+
+def snapshot_scope(ecs_c, cluster_name, scope, max_workers=None):
+
+    """
+    Takes a snapshot of just the services and standalone tasks recorded by
+    find_drain_scope, in the same shape snapshot_cluster returns.
+    """
+
+    empty = {
+        "services": {},
+        "tasks": {}
+    }
+
+    return(refresh_snapshot(
+        ecs_c,
+        cluster_name,
+        empty,
+        scope["services"],
+        scope["tasks"],
+        max_workers
+    ))
@@ -0,0 +1,292 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from lifecycle_core.clients import get_client
+
+# Where state that has to outlive a single invocation is kept.  When
+# LIFECYCLE_STATE_TABLE names a DynamoDB table we use that, otherwise
+# LIFECYCLE_STATE_DB can name a SQLite file, and failing both state lives
+# in memory for the life of the warm Lambda container.
+LIFECYCLE_STATE_TABLE = os.environ.get("LIFECYCLE_STATE_TABLE")
+LIFECYCLE_STATE_DB = os.environ.get("LIFECYCLE_STATE_DB")
+
+# Lifecycle hooks give up after at most 48 hours, so hook records and
+# leases needn't live longer than that.  Anything that should outlive the
+# hooks, such as the drain time model, passes a ttl of its own.
+DEFAULT_TTL = 48 * 3600
+
+# Leases are held as items of their own.  Taking one succeeds if nobody
+# holds it, the last holder's lease has expired or we already hold it,
+# so concurrent invocations can agree which of them does a shared piece
+# of work.
+
+_store = None
+
+
+class MemoryStateStore(object):
+
+    """
+    Keeps state in a dictionary.  State survives between invocations of a
+    warm Lambda container, but is lost on a cold start and isn't shared
+    between concurrent invocations.
+    """
+
+    durable = False
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return(None)
+            item, expires_at = entry
+            if expires_at <= time.time():
+                del self._items[key]
+                return(None)
+            return(json.loads(item))
+
+    def put(self, key, item, ttl=DEFAULT_TTL):
+        with self._lock:
+            self._items[key] = (json.dumps(item), time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def acquire_lease(self, key, owner, ttl):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[1] > time.time():
+                if json.loads(entry[0]).get("owner") != owner:
+                    return(False)
+            self._items[key] = (
+                json.dumps({"owner": owner}),
+                time.time() + ttl
+            )
+            return(True)
+
+    def release_lease(self, key, owner):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and \
+                    json.loads(entry[0]).get("owner") == owner:
+                del self._items[key]
+
+
+class SQLiteStateStore(object):
+
+    """
+    Keeps state in a SQLite database, by default an in-memory one.  This
+    is a stand-in for DynamoDB when running the functions locally.
+    """
+
+    durable = True
+
+    def __init__(self, path=":memory:"):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lifecycle_state ("
+                "pk TEXT PRIMARY KEY, data TEXT, expires_at REAL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM lifecycle_state "
+                "WHERE pk = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return(None)
+        return(json.loads(row[0]))
+
+    def put(self, key, item, ttl=DEFAULT_TTL):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO lifecycle_state VALUES (?, ?, ?)",
+                (key, json.dumps(item), time.time() + ttl)
+            )
+
+    def delete(self, key):
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM lifecycle_state WHERE pk = ?",
+                (key,)
+            )
+
+    def acquire_lease(self, key, owner, ttl):
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO lifecycle_state VALUES (?, ?, ?) "
+                "ON CONFLICT(pk) DO UPDATE SET "
+                "data = excluded.data, expires_at = excluded.expires_at "
+                "WHERE lifecycle_state.expires_at <= ? "
+                "OR lifecycle_state.data = excluded.data",
+                (key, json.dumps({"owner": owner}), now + ttl, now)
+            )
+        return(cursor.rowcount == 1)
+
+    def release_lease(self, key, owner):
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM lifecycle_state WHERE pk = ? AND data = ?",
+                (key, json.dumps({"owner": owner}))
+            )
+
+
+class DynamoDBStateStore(object):
+
+    """
+    Keeps state in a DynamoDB table with a string partition key named pk.
+    Items carry an expires_at attribute which the table should use as its
+    TTL attribute so finished hooks are cleaned up.
+    """
+
+    durable = True
+
+    def __init__(self, table_name, dynamodb_c=None):
+        self.table_name = table_name
+        self._dynamodb_c = dynamodb_c
+
+    @property
+    def dynamodb_c(self):
+        if self._dynamodb_c is None:
+            self._dynamodb_c = get_client('dynamodb')
+        return(self._dynamodb_c)
+
+    def get(self, key):
+        response = self.dynamodb_c.get_item(
+            TableName=self.table_name,
+            Key={
+                "pk": {"S": key}
+            },
+            ConsistentRead=True
+        )
+        item = response.get("Item")
+        if item is None or float(item["expires_at"]["N"]) <= time.time():
+            return(None)
+        return(json.loads(item["data"]["S"]))
+
+    def put(self, key, item, ttl=DEFAULT_TTL):
+        self.dynamodb_c.put_item(
+            TableName=self.table_name,
+            Item={
+                "pk": {"S": key},
+                "data": {"S": json.dumps(item)},
+                "expires_at": {"N": str(int(time.time() + ttl))}
+            }
+        )
+
+    def delete(self, key):
+        self.dynamodb_c.delete_item(
+            TableName=self.table_name,
+            Key={
+                "pk": {"S": key}
+            }
+        )
+
+    def acquire_lease(self, key, owner, ttl):
+        now = time.time()
+        try:
+            self.dynamodb_c.put_item(
+                TableName=self.table_name,
+                Item={
+                    "pk": {"S": key},
+                    "data": {"S": json.dumps({"owner": owner})},
+                    "expires_at": {"N": str(int(now + ttl))}
+                },
+                ConditionExpression=(
+                    "attribute_not_exists(pk) OR expires_at <= :now "
+                    "OR #data = :data"
+                ),
+                ExpressionAttributeNames={
+                    "#data": "data"
+                },
+                ExpressionAttributeValues={
+                    ":now": {"N": str(int(now))},
+                    ":data": {"S": json.dumps({"owner": owner})}
+                }
+            )
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "ConditionalCheckFailedException":
+                return(False)
+            raise
+        return(True)
+
+    def release_lease(self, key, owner):
+        try:
+            self.dynamodb_c.delete_item(
+                TableName=self.table_name,
+                Key={
+                    "pk": {"S": key}
+                },
+                ConditionExpression="#data = :data",
+                ExpressionAttributeNames={
+                    "#data": "data"
+                },
+                ExpressionAttributeValues={
+                    ":data": {"S": json.dumps({"owner": owner})}
+                }
+            )
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code != "ConditionalCheckFailedException":
+                raise
+
+
+def get_state_store():
+
+    """
+    Returns the state store configured for this function, creating it on
+    first use and reusing it for the life of the container.
+    """
+
+    global _store
+
+    if _store is None:
+        if LIFECYCLE_STATE_TABLE:
+            _store = DynamoDBStateStore(LIFECYCLE_STATE_TABLE)
+        elif LIFECYCLE_STATE_DB:
+            _store = SQLiteStateStore(LIFECYCLE_STATE_DB)
+        else:
+            _store = MemoryStateStore()
+
+    return(_store)
+
+
+def set_state_store(store):
+
+    """
+    Replaces the state store, for running the functions against a local
+    stand-in.
+    """
+
+    global _store
+    _store = store
@@ -0,0 +1,913 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+The terminate lifecycle hook workflow, shared by the terminate function
+and the SQS batch function.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lifecycle_core import clock
+from lifecycle_core import metrics
+from lifecycle_core.capacity import DRAIN_CAPACITY_ACTION
+from lifecycle_core.capacity import check_drain_capacity
+from lifecycle_core.capacity import drain_requirements
+from lifecycle_core.capacity import find_leaving_instances
+from lifecycle_core.cluster_name import find_cluster_name
+from lifecycle_core.container_instances import find_container_instance
+from lifecycle_core.continuation import continue_hook
+from lifecycle_core.daemon_tasks import DAEMON_TASK_ACTION
+from lifecycle_core.daemon_tasks import find_daemon_tasks
+from lifecycle_core.daemon_tasks import stop_daemon_tasks
+from lifecycle_core.drain_coordinator import DRAIN_ADMISSION_TTL
+from lifecycle_core.drain_coordinator import DRAIN_COORDINATION
+from lifecycle_core.drain_coordinator import admit_drain
+from lifecycle_core.drain_coordinator import find_drain_budgets
+from lifecycle_core.drain_coordinator import release_drain_admission
+from lifecycle_core.drain_coordinator import renew_drain_admission
+from lifecycle_core.drain_model import DRAIN_TIME_MODEL
+from lifecycle_core.drain_model import predict_completion
+from lifecycle_core.drain_model import record_duration
+from lifecycle_core.hooks import begin_hook_attempt
+from lifecycle_core.hooks import complete_hook
+from lifecycle_core.hooks import heartbeat_or_abandon
+from lifecycle_core.hooks import save_hook_record
+from lifecycle_core.hooks import update_hook_phase
+from lifecycle_core.load_balancers import DRAIN_DEREGISTER_TARGETS
+from lifecycle_core.load_balancers import begin_deregistration
+from lifecycle_core.load_balancers import check_deregistration
+from lifecycle_core.load_balancers import count_targets
+from lifecycle_core.load_balancers import find_instance_targets
+from lifecycle_core.polling import PollScheduler
+from lifecycle_core.polling import time_for_phase
+from lifecycle_core.shared_stability import STABILITY_SHARED
+from lifecycle_core.shared_stability import find_unstable
+from lifecycle_core.shared_stability import shared_cluster_stability
+from lifecycle_core.stability import STABILITY_FULL_REFRESH_PASSES
+from lifecycle_core.stability import STABILITY_SCOPE
+from lifecycle_core.stability import find_drain_scope
+from lifecycle_core.stability import refresh_snapshot
+from lifecycle_core.stability import snapshot_cluster
+from lifecycle_core.stability import snapshot_scope
+
+
+@metrics.phase
+def find_container_instance_id(ecs_c, cluster_name, instance_id):
+
+    """
+    Given an ec2 instance ID determines the cluster instance ID.
+    The ec2 instance ID and cluster instance ID aren't the same thing.
+    Calls to the ECS control plane require the cluster instance ID.
+
+    The lookup itself is shared with the launch function, see
+    lifecycle_core.container_instances.find_container_instance.
+
+    On failure we raise an exception which means this instance isn't a ECS
+    cluster member so we can proceed with termination.
+    """
+
+    container_instance, api_calls = find_container_instance(
+        ecs_c,
+        cluster_name,
+        instance_id
+    )
+    print("- Container instance lookup made {} ECS API calls".format(
+        api_calls
+    ))
+
+    if container_instance is not None:
+        return(container_instance["containerInstanceArn"])
+
+    raise(ValueError(
+        "Unable to determine the ECS Container Instance ID"
+    ))
+
+
+@metrics.phase
+def check_stable_cluster(ecs_c, cluster_name, context, scope=None,
+                         predicted=None):
+
+    """
+    Goes through all services, and tasks defined against a cluster
+    and decides whether they are considered in a stable state.
+
+    If we're given a drain scope (see find_drain_scope) we only look at
+    the services and standalone tasks it names, rather than the whole
+    cluster.
+
+    The first pass takes a snapshot of the whole cluster, describing pages
+    of services and tasks concurrently (see lifecycle_core.stability).
+    Later passes only re-describe the services and tasks that weren't yet
+    stable, with a full snapshot every STABILITY_FULL_REFRESH_PASSES passes
+    to catch anything newly created.  We only call the cluster stable off
+    the back of a full snapshot.
+
+    With STABILITY_SHARED set, and no drain scope, every pass is a full
+    pass shared with the other terminate hooks waiting on the cluster
+    (see lifecycle_core.shared_stability).  We only accept passes taken
+    after we started checking, and each pass newer than the last.
+
+    For Services we look at each service's deployments and task counts
+    (see lifecycle_core.stability.service_stability), and print why any
+    service isn't steady.
+
+    For Tasks we look at the difference between the desired and actual
+    states.  If there is a difference the task is not stable.
+
+    When the cluster is finally stable, we will respond true.  Passes are
+    scheduled by a PollScheduler, aimed at the predicted completion time
+    if we have one, and once there's no time left in our Lambda function
+    execution for another pass we will return false so we can send a
+    heartbeat and be re-invoked.
+    """
+
+    poller = PollScheduler(context, "stable_cluster", predicted=predicted)
+    snapshot = None
+    unstable_services = {}
+    unstable_tasks = {}
+    passes = 0
+    shared_after = clock.now()
+
+    while True:
+
+        full_pass = passes % STABILITY_FULL_REFRESH_PASSES == 0
+        if STABILITY_SHARED and scope is None:
+            result = shared_cluster_stability(
+                ecs_c,
+                cluster_name,
+                shared_after
+            )
+            if result is None:
+                print("- Another invocation is checking cluster stability")
+                if not poller.wait():
+                    return(False)
+                continue
+            shared_after = result["checked_at"]
+            unstable_services = result["unstable_services"]
+            unstable_tasks = result["unstable_tasks"]
+            if result["truncated"]:
+                print(" ! More than {} tasks are not stable".format(
+                    len(unstable_tasks)
+                ))
+            full_pass = True
+            pass_type = "Shared" if result["shared"] else "Full"
+            counts = (result["services"], result["tasks"])
+            cost = (result["duration"], result["api_calls"])
+
+        else:
+            if full_pass and scope is not None:
+                snapshot = snapshot_scope(ecs_c, cluster_name, scope)
+                pass_type = "Scoped"
+            elif full_pass:
+                snapshot = snapshot_cluster(ecs_c, cluster_name)
+                pass_type = "Full"
+            else:
+                snapshot = refresh_snapshot(
+                    ecs_c,
+                    cluster_name,
+                    snapshot,
+                    list(unstable_services),
+                    list(unstable_tasks)
+                )
+                pass_type = "Incremental"
+            unstable_services, unstable_tasks = find_unstable(snapshot)
+            counts = (len(snapshot["services"]), len(snapshot["tasks"]))
+            cost = (snapshot["duration"], snapshot["api_calls"])
+        passes += 1
+
+        print("- {} stability pass over {} services and {} tasks took "
+              "{:.2f} seconds and {} ECS API calls".format(
+                  pass_type,
+                  counts[0],
+                  counts[1],
+                  cost[0],
+                  cost[1]
+              ))
+
+        for service_name, reasons in unstable_services.values():
+            print(" ! Service {} does not appear to be stable: {}".format(
+                service_name,
+                ", ".join(reasons)
+            ))
+
+        for task_arn, (desired_status, last_status) in \
+                unstable_tasks.items():
+            print(" ! Task {} has desired status {} with last "
+                  "status {}".format(
+                      task_arn,
+                      desired_status,
+                      last_status
+                  ))
+
+        if not unstable_services and not unstable_tasks:
+            if full_pass:
+                print("- Cluster became stable after {:.1f} seconds".format(
+                    poller.converged()
+                ))
+                return(True)
+            # Everything we were waiting on has settled, confirm nothing
+            # new has appeared with a full pass straight away.
+            passes = 0
+            continue
+
+        if not poller.wait():
+            return(False)
+
+
+@metrics.phase
+def drain_instance(ecs_c, cluster_name, instance_id):
+
+    """
+    Marks the ECS container ID that we're set to terminate to DRAIN.
+
+    Returns True if we moved the instance from ACTIVE to DRAINING, or
+    False if it was already draining.
+    """
+
+    response = ecs_c.describe_container_instances(
+        cluster=cluster_name,
+        containerInstances=[
+            instance_id
+        ]
+    )
+
+    if response["containerInstances"][0]["status"] == "ACTIVE":
+        ecs_c.update_container_instances_state(
+            cluster=cluster_name,
+            containerInstances=[
+                instance_id
+            ],
+            status="DRAINING"
+        )
+        return(True)
+
+    return(False)
+
+
+@metrics.phase
+def check_instance_drained(ecs_c, cluster_name, instance_id, context,
+                           predicted=None, poller=None, deregistration=None):
+
+    """
+    Checks and waits until an ECS instance has drained all its running tasks.
+
+    Returns True if the instance drains.
+
+    Returns False if there isn't time left in the Lambda functions
+    execution for another check and we need to re-invoke to wait longer.
+    That includes when the drain is predicted to finish after our time is
+    up, in which case we hand over early rather than polling until then.
+
+    DAEMON service tasks are never drained, so unless DAEMON_TASK_ACTION is
+    "wait" we count the instance drained once they're all that's left, and
+    with "stop" we then stop them and wait for them to exit.  The task
+    counts tell us when that might be.  A draining instance never gains
+    daemons, so we only list its tasks to pick them out once there are no
+    more tasks than daemons we last found.
+
+    A caller that needs to poll on its own schedule can pass its own
+    PollScheduler.
+
+    If we deregistered the instance's load balancer targets we're given
+    the record of it (see lifecycle_core.load_balancers), and follow the
+    targets along with the tasks.  The instance only counts as drained
+    once both have finished.
+    """
+
+    if poller is None:
+        poller = PollScheduler(
+            context,
+            "instance_drained",
+            predicted=predicted
+        )
+    strategies = {}
+    known_daemons = None
+    stopped_daemons = set()
+
+    while True:
+
+        response = ecs_c.describe_container_instances(
+            cluster=cluster_name,
+            containerInstances=[
+                instance_id
+            ]
+        )
+        remaining = response["containerInstances"][0]["runningTasksCount"] + \
+            response["containerInstances"][0]["pendingTasksCount"]
+
+        print("- Instance has {} running tasks and {} pending tasks".format(
+            response["containerInstances"][0]["runningTasksCount"],
+            response["containerInstances"][0]["pendingTasksCount"]
+        ))
+
+        if deregistration is not None and deregistration["targets"]:
+            api_calls = check_deregistration(deregistration)
+            print("- {} load balancer targets still deregistering, "
+                  "checked with {} ELBv2 API calls".format(
+                      count_targets(deregistration),
+                      api_calls
+                  ))
+        deregistered = deregistration is None or \
+            not deregistration["targets"]
+
+        daemon_tasks = []
+        if remaining > 0 and DAEMON_TASK_ACTION != "wait" and \
+                (known_daemons is None or remaining <= known_daemons):
+            daemon_tasks, api_calls = find_daemon_tasks(
+                ecs_c,
+                cluster_name,
+                instance_id,
+                strategies
+            )
+            known_daemons = len(daemon_tasks)
+            print("- {} of them are DAEMON tasks, found with {} ECS API "
+                  "calls".format(known_daemons, api_calls))
+
+        if deregistered and (
+                remaining == 0 or (remaining == len(daemon_tasks) and
+                                   DAEMON_TASK_ACTION == "ignore")
+                ):
+            print("- Instance drained after {:.1f} seconds".format(
+                poller.converged()
+            ))
+            return(True)
+
+        # We may still be waiting on load balancer targets once only
+        # daemons are left, so we take care to stop each of them once.
+        stopping = [
+            task_arn for task_arn in daemon_tasks
+            if task_arn not in stopped_daemons
+        ]
+        if DAEMON_TASK_ACTION == "stop" and stopping and \
+                remaining == len(daemon_tasks):
+            print("- Stopping {} DAEMON tasks now the rest have "
+                  "drained".format(len(stopping)))
+            stop_daemon_tasks(ecs_c, cluster_name, stopping)
+            stopped_daemons.update(stopping)
+
+        if not poller.wait():
+            return(False)
+
+
+def phase_resolve(ec2_c, ecs_c, asg_c, hook_message, checkpoint, context):
+
+    """
+    Works out the ECS cluster and container instance our EC2 instance
+    belongs to, and checkpoints them so later invocations don't need to
+    look them up again.
+    """
+
+    print("Determining our ECS Cluster name . . .")
+    checkpoint["cluster_name"] = find_cluster_name(
+        ec2_c,
+        asg_c,
+        hook_message["AutoScalingGroupName"],
+        hook_message["EC2InstanceId"]
+    )
+    print(". . . found ECS Cluster name '{}'".format(
+        checkpoint["cluster_name"]
+    ))
+
+    print("Translating our EC2 Instance ID into an ECS Instance ID . . .")
+    checkpoint["container_instance_id"] = find_container_instance_id(
+        ecs_c,
+        checkpoint["cluster_name"],
+        hook_message["EC2InstanceId"]
+    )
+    print(". . . found ECS Instance ID '{}'".format(
+        checkpoint["container_instance_id"]
+    ))
+
+    return("check-capacity")
+
+
+def phase_check_capacity(ec2_c, ecs_c, asg_c, hook_message, checkpoint,
+                         context):
+
+    """
+    Checks the rest of the cluster has room for the service tasks the
+    drain will displace (see lifecycle_core.capacity) before we drain.
+
+    Instances leaving the cluster alongside ours don't count as room (see
+    lifecycle_core.capacity.find_leaving_instances).
+
+    When it hasn't, DRAIN_CAPACITY_ACTION decides what we do: "defer"
+    checks again as capacity frees up, handing over to a re-invocation
+    when we run out of time.  "abandon" completes the hook with ABANDON,
+    which AutoScaling takes as leave to terminate the instance without
+    draining it, so its tasks stop before any replacements start.
+    "ignore" skips the check.
+    """
+
+    if DRAIN_CAPACITY_ACTION == "ignore":
+        return("queued")
+
+    print("Checking the cluster has room for the ECS Instance's tasks . . .")
+    poller = PollScheduler(context, "drain_capacity")
+
+    while True:
+
+        # The instance is still ACTIVE while we wait, so tasks can be
+        # placed on it in the meantime, and we look at it again each time.
+        requirements, api_calls = drain_requirements(
+            ecs_c,
+            checkpoint["cluster_name"],
+            checkpoint["container_instance_id"]
+        )
+        print("- Finding the ECS Instance's service tasks made {} ECS API "
+              "calls".format(api_calls))
+
+        leaving, api_calls = find_leaving_instances(
+            asg_c,
+            hook_message["AutoScalingGroupName"],
+            checkpoint["cluster_name"]
+        )
+        print("- {} other instances are leaving the cluster, found with "
+              "{} AutoScaling API calls".format(
+                  len(leaving - set([hook_message["EC2InstanceId"]])),
+                  api_calls
+              ))
+
+        result = check_drain_capacity(
+            ecs_c,
+            checkpoint["cluster_name"],
+            checkpoint["container_instance_id"],
+            requirements,
+            leaving
+        )
+        print("- Placed {} of {} service tasks on {} other instances "
+              "with {} ECS API calls".format(
+                  result["tasks"] - result["unplaced"],
+                  result["tasks"],
+                  result["instances"],
+                  result["api_calls"]
+              ))
+
+        if result["fits"]:
+            print(". . . the cluster has room for the drain")
+            return("queued")
+
+        print(" ! The cluster has no room for {} of the tasks".format(
+            result["unplaced"]
+        ))
+        if DRAIN_CAPACITY_ACTION == "abandon":
+            return("abandon")
+
+        if not poller.wait():
+            return(None)
+
+
+def phase_queued(ec2_c, ecs_c, asg_c, hook_message, checkpoint, context):
+
+    """
+    Waits for the drain coordinator (see lifecycle_core.drain_coordinator)
+    to admit our instance, so instances leaving the cluster together only
+    drain as many of each service's tasks at once as its deployment
+    configuration allows.  We skip this unless DRAIN_COORDINATION is on.
+
+    While we wait, the other drains' replacement tasks can be placed on our
+    instance, so we count its tasks again each time we ask.
+
+    A hook whose admission lapsed is sent back here from a later phase
+    (see renew_admission), and once admitted again carries on with that
+    phase rather than draining.
+    """
+
+    if not DRAIN_COORDINATION:
+        return(checkpoint.pop("requeued_from", "drain"))
+
+    print("Waiting for our turn to drain . . .")
+    poller = PollScheduler(context, "drain_admission")
+
+    while True:
+
+        checkpoint["drain_budgets"], api_calls = find_drain_budgets(
+            ecs_c,
+            checkpoint["cluster_name"],
+            checkpoint["container_instance_id"]
+        )
+        print("- Found the drain budgets of {} services with {} ECS API "
+              "calls".format(len(checkpoint["drain_budgets"]), api_calls))
+
+        admitted, waiting_on = admit_drain(
+            checkpoint["cluster_name"],
+            hook_message["EC2InstanceId"],
+            checkpoint["drain_budgets"]
+        )
+
+        if admitted:
+            checkpoint["drain_admitted"] = True
+            checkpoint["admission_renewed_at"] = clock.now()
+            print(". . . admitted to drain after {:.1f} seconds".format(
+                poller.converged()
+            ))
+            return(checkpoint.pop("requeued_from", "drain"))
+
+        print("- Queued, waiting on the drain budgets of {}".format(
+            ", ".join(waiting_on) or "no services, the queue was busy"
+        ))
+
+        if not poller.wait():
+            return(None)
+
+
+def phase_drain(ec2_c, ecs_c, asg_c, hook_message, checkpoint, context):
+
+    """
+    Sets the container instance to DRAINING, first recording what's
+    running on it if we're waiting on a drain scope or learning how long
+    each service takes to drain.
+
+    With DRAIN_DEREGISTER_TARGETS on we also find the instance's load
+    balancer targets, and deregister them while we set it to DRAINING.
+    """
+
+    cluster_name = checkpoint["cluster_name"]
+    container_instance_id = checkpoint["container_instance_id"]
+
+    targets = None
+    if DRAIN_DEREGISTER_TARGETS:
+        print("Finding the ECS Instance's load balancer targets . . .")
+        targets, api_calls = find_instance_targets(
+            ecs_c,
+            cluster_name,
+            container_instance_id,
+            hook_message["EC2InstanceId"]
+        )
+        print(". . . found {} targets in {} target groups with {} ECS API "
+              "calls".format(
+                  sum(len(t) for t in targets.values()),
+                  len(targets),
+                  api_calls
+              ))
+
+    recorded_scope = None
+    if STABILITY_SCOPE == "drain" or DRAIN_TIME_MODEL:
+        print("Recording services and tasks on the ECS Instance . . .")
+        recorded_scope = find_drain_scope(
+            ecs_c,
+            cluster_name,
+            container_instance_id
+        )
+        print(". . . found {} services and {} standalone tasks".format(
+            len(recorded_scope["services"]),
+            len(recorded_scope["tasks"])
+        ))
+
+    print("Setting ECS Instance to drain . . .")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # The targets' deregistration delay starts alongside the drain,
+        # rather than as ECS gets round to each task.
+        if targets:
+            deregistering = pool.submit(
+                metrics.bind(begin_deregistration),
+                targets
+            )
+        moved = drain_instance(ecs_c, cluster_name, container_instance_id)
+        if targets:
+            checkpoint["deregistration"] = deregistering.result()
+            print("- Deregistering the ECS Instance's load balancer "
+                  "targets")
+    # What's left on an instance that was already draining no longer
+    # tells us what it displaced, so we only keep a scope recorded
+    # while the instance was still ACTIVE.
+    if moved and STABILITY_SCOPE == "drain":
+        checkpoint["drain_scope"] = recorded_scope
+    if recorded_scope is not None:
+        checkpoint["drained_services"] = recorded_scope["services"]
+    checkpoint["drain_started_at"] = clock.now()
+    print(". . . ECS Instance ID '{}' in DRAINING mode".format(
+        container_instance_id
+    ))
+
+    return("wait-drained")
+
+
+def phase_wait_drained(ec2_c, ecs_c, asg_c, hook_message, checkpoint,
+                       context):
+
+    """
+    Waits for the container instance to drain all its tasks, then adds
+    how long that took to the cluster's drain time model.
+
+    If we run out of time we leave when the drain is predicted to finish
+    in resume_at, for the continuation to aim at.
+
+    When we deregistered the instance's load balancer targets we report
+    how much of the drain was spent waiting on them, and how much on the
+    tasks after them, so a slow drain can be put down to one or the
+    other.
+    """
+
+    cluster_name = checkpoint["cluster_name"]
+    services = checkpoint.get("drained_services", [])
+    drain_started_at = checkpoint.setdefault("drain_started_at", clock.now())
+    predicted = predict_completion(
+        cluster_name,
+        "drain",
+        drain_started_at,
+        services
+    )
+
+    print("Confirming ECS Instance has drained all tasks . . .")
+    if not check_instance_drained(
+            ecs_c,
+            cluster_name,
+            checkpoint["container_instance_id"],
+            context,
+            predicted,
+            deregistration=checkpoint.get("deregistration")
+            ):
+        # The targets that have finished deregistering were dropped from
+        # the checkpoint, which we only save on moving to another phase.
+        if "deregistration" in checkpoint:
+            save_hook_record(hook_message, checkpoint)
+        checkpoint["resume_at"] = predicted
+        return(None)
+
+    print(". . . ECS Instance ID '{}' has drained all tasks".format(
+        checkpoint["container_instance_id"]
+    ))
+
+    deregistration = checkpoint.get("deregistration")
+    if deregistration is not None:
+        report_drain_bottleneck(
+            deregistration,
+            drain_started_at,
+            clock.now()
+        )
+
+    checkpoint["stable_started_at"] = clock.now()
+    if DRAIN_TIME_MODEL:
+        record_duration(
+            cluster_name,
+            "drain",
+            checkpoint["stable_started_at"] - drain_started_at,
+            services
+        )
+
+    return("wait-stable")
+
+
+def report_drain_bottleneck(deregistration, drain_started_at, drained_at):
+
+    """
+    Splits a drain into the time spent waiting on the instance's load
+    balancer targets to deregister, which no task can stop before, and the
+    time spent on the tasks after that, and says which was longer.
+    """
+
+    finished_at = deregistration["finished_at"] or drained_at
+    targets_seconds = max(0, finished_at - drain_started_at)
+    tasks_seconds = max(0, drained_at - max(finished_at, drain_started_at))
+
+    print("- The drain spent {:.0f} seconds waiting on load balancer "
+          "targets to deregister and {:.0f} seconds on tasks after "
+          "that".format(targets_seconds, tasks_seconds))
+    if targets_seconds >= tasks_seconds:
+        print("- The drain was held up by the target groups' "
+              "deregistration delay")
+    else:
+        print("- The drain was held up by the tasks, their replacements "
+              "or stopping")
+
+
+def phase_wait_stable(ec2_c, ecs_c, asg_c, hook_message, checkpoint, context):
+
+    """
+    Waits for the cluster, or just what we drained, to become stable, then
+    adds how long that took to the cluster's drain time model.  Like
+    phase_wait_drained, we leave our prediction in resume_at if we run
+    out of time.
+    """
+
+    cluster_name = checkpoint["cluster_name"]
+    services = checkpoint.get("drained_services", [])
+    drain_scope = checkpoint.get("drain_scope")
+    stable_started_at = checkpoint.setdefault(
+        "stable_started_at",
+        clock.now()
+    )
+    predicted = predict_completion(
+        cluster_name,
+        "stable",
+        stable_started_at,
+        services
+    )
+    if drain_scope is None:
+        print("Confirming Cluster Services and Tasks are Stable . . .")
+    else:
+        print("Confirming drained Services and Tasks are Stable . . .")
+
+    if not check_stable_cluster(
+            ecs_c,
+            cluster_name,
+            context,
+            drain_scope,
+            predicted
+            ):
+        checkpoint["resume_at"] = predicted
+        return(None)
+
+    print(". . . Cluster '{}' appears to be stable".format(
+        cluster_name
+    ))
+
+    if DRAIN_TIME_MODEL:
+        record_duration(
+            cluster_name,
+            "stable",
+            clock.now() - stable_started_at,
+            services
+        )
+
+    return("complete")
+
+
+def renew_admission(hook_message, hook_record):
+
+    """
+    Renews our instance's drain admission at the start of an invocation.
+
+    If it has lapsed, say because we were re-invoked more than
+    DRAIN_ADMISSION_TTL seconds after the last renewal, other instances
+    may have been admitted into the budgets we held.  So we send the hook
+    back to the queued phase to be admitted again before it carries on
+    with the phase it was in.  If we couldn't update the admissions just
+    now we carry on, and try again next invocation.
+    """
+
+    renewed = renew_drain_admission(
+        hook_record["cluster_name"],
+        hook_message["EC2InstanceId"]
+    )
+    if renewed:
+        hook_record["admission_renewed_at"] = clock.now()
+        return
+
+    if renewed is None:
+        print(" ! Unable to renew our drain admission just now")
+        return
+
+    print(" ! Our drain admission lapsed, queueing for it again")
+    del hook_record["drain_admitted"]
+    hook_record.pop("admission_renewed_at", None)
+    hook_record["requeued_from"] = hook_record["phase"]
+    update_hook_phase(hook_message, hook_record, "queued")
+
+
+def release_admission(hook_message, hook_record):
+
+    """
+    Releases our instance's drain admission, if it has one, once the hook
+    is finished.  This is best effort, as the admission lapses by itself
+    after DRAIN_ADMISSION_TTL seconds.
+    """
+
+    if not hook_record.get("drain_admitted"):
+        return
+
+    try:
+        release_drain_admission(
+            hook_record["cluster_name"],
+            hook_message["EC2InstanceId"]
+        )
+    except Exception as e:
+        print(" ! Unable to release our drain admission: {}".format(e))
+
+
+# Each phase of a termination, run in order.  A phase returns the name of
+# the phase to move on to, or None if it ran out of time and we need to be
+# re-invoked to carry on with it.  Moving on to "complete" finishes the
+# hook with CONTINUE and to "abandon" finishes it with ABANDON.
+TERMINATE_PHASES = {
+    "resolve": phase_resolve,
+    "check-capacity": phase_check_capacity,
+    "queued": phase_queued,
+    "drain": phase_drain,
+    "wait-drained": phase_wait_drained,
+    "wait-stable": phase_wait_stable
+}
+
+
+def process_terminate_hook(ec2_c, ecs_c, asg_c, hook_message, context,
+                           carried_record=None):
+
+    """
+    Works a terminate hook for as long as the context allows, running its
+    phases in order from wherever the last attempt got to.  Once the
+    cluster is stable we complete the hook with CONTINUE, otherwise we
+    send a heartbeat (or ABANDON) so we're re-invoked to carry on.  We
+    only start a phase with PHASE_START_MARGIN seconds left (see
+    lifecycle_core.polling.time_for_phase), so a phase's first check
+    can't run us past the Lambda timeout.
+
+    Returns the action we took, "CONTINUE", "HEARTBEAT" or "ABANDON".
+
+    Once the drain coordinator has admitted our instance we renew its
+    admission each invocation (see renew_admission), and release it when
+    the hook finishes.  Our continuation is due within half of
+    DRAIN_ADMISSION_TTL of the last renewal, so the admission doesn't
+    lapse in between.
+
+    Unless CONTINUATION_MODE is "heartbeat" we arrange our own
+    continuation (see lifecycle_core.continuation), aimed at when the
+    phase we're in is predicted to finish.  carried_record is the hook
+    record a continuation brought with it, if any.
+    """
+
+    hook_record = {}
+    try:
+        hook_record = begin_hook_attempt(
+            asg_c,
+            hook_message,
+            "Terminating",
+            "resolve",
+            carried_record
+        )
+        print("Attempt {} at this hook, currently in phase '{}'".format(
+            hook_record["attempts"],
+            hook_record["phase"]
+        ))
+
+        if hook_record.get("drain_admitted"):
+            renew_admission(hook_message, hook_record)
+
+        # Our checkpoint is the hook's record, so moving on to a phase
+        # saves everything the earlier phases found along with it.
+        phase = hook_record["phase"]
+        while phase in TERMINATE_PHASES:
+            if not time_for_phase(context):
+                print("- Not enough time left to start phase '{}'".format(
+                    phase
+                ))
+                break
+            next_phase = TERMINATE_PHASES[phase](
+                ec2_c,
+                ecs_c,
+                asg_c,
+                hook_message,
+                hook_record,
+                context
+            )
+            if next_phase is None:
+                break
+            phase = next_phase
+            update_hook_phase(hook_message, hook_record, phase)
+
+        if phase == "complete":
+            print("Proceeding with instance id '{}' Termination".format(
+                hook_message["EC2InstanceId"]
+            ))
+            complete_hook(asg_c, hook_message, "CONTINUE")
+            release_admission(hook_message, hook_record)
+            return("CONTINUE")
+
+        if phase == "abandon":
+            print("Abandoning instance id '{}' Termination".format(
+                hook_message["EC2InstanceId"]
+            ))
+            complete_hook(asg_c, hook_message, "ABANDON")
+            release_admission(hook_message, hook_record)
+            return("ABANDON")
+
+        resume_at = hook_record.pop("resume_at", None)
+        print("Determined we cannot proceed with termination.")
+        action = heartbeat_or_abandon(
+            asg_c,
+            hook_message,
+            hook_record,
+            "drain/stabilize"
+        )
+        if action == "ABANDON":
+            release_admission(hook_message, hook_record)
+            return(action)
+
+        latest = None
+        if "admission_renewed_at" in hook_record:
+            latest = hook_record["admission_renewed_at"] + \
+                DRAIN_ADMISSION_TTL / 2.0
+        continue_hook(hook_message, hook_record, context, resume_at, latest)
+        return(action)
+
+    except Exception as e:
+        # Our exception path is to allow the instance to terminate.
+        # Exceptions are raised when the instance isn't part of an ECS Cluster
+        # already.
+        print("Exception: {}".format(e))
+        complete_hook(asg_c, hook_message, "CONTINUE")
+        release_admission(hook_message, hook_record)
+        return("CONTINUE")
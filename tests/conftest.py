@@ -0,0 +1,52 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+"""
+Shared set up for the tests.  The functions import lifecycle_core from
+the lambda directory, as they do once packaged, and some tests run them
+against the simulated cluster in benchmarks/fake_aws.py.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "lambda"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+class FakeTime(object):
+
+    """
+    Stands in for the time module in the state stores, so tests can move
+    time on to expire items and leases.
+    """
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return(self.now)
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    from lifecycle_core import state
+
+    fake = FakeTime()
+    monkeypatch.setattr(state, "time", fake)
+    return(fake)
@@ -0,0 +1,239 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import pytest
+
+from fake_aws import ClusterSimulator
+from lifecycle_core import capacity
+from lifecycle_core import clock
+from lifecycle_core import drain_coordinator
+from lifecycle_core import state
+from lifecycle_core.cache import TTLCache
+from lifecycle_core.capacity import check_drain_capacity
+from lifecycle_core.capacity import drain_requirements
+from lifecycle_core.capacity import find_leaving_instances
+from lifecycle_core.capacity import pack
+from lifecycle_core.capacity import task_requirements
+from lifecycle_core.state import MemoryStateStore
+
+# Each fills most of an empty instance, so no two share one.
+BIG_TASK = {"cpu": 0, "memory": 7000, "ports": set()}
+
+
+class TaskDefinitions(object):
+
+    """
+    An ECS client that only describes the task definitions it's given.
+    """
+
+    def __init__(self, task_definitions):
+        self.task_definitions = task_definitions
+        self.calls = 0
+
+    def describe_task_definition(self, taskDefinition):
+        self.calls += 1
+        return({"taskDefinition": self.task_definitions[taskDefinition]})
+
+
+def _resources(cpu, memory, *ports):
+    return({"cpu": cpu, "memory": memory, "ports": set(ports)})
+
+
+@pytest.fixture(autouse=True)
+def forget_task_definitions(monkeypatch):
+    monkeypatch.setattr(
+        capacity,
+        "_task_definitions",
+        TTLCache(maxsize=10, ttl=3600)
+    )
+
+
+@pytest.fixture
+def simulator(monkeypatch):
+
+    """
+    Three empty instances, of which we drain the first.
+    """
+
+    simulator = ClusterSimulator.build(3, 0, 0)
+    monkeypatch.setattr(clock, "_now", simulator.clock.now)
+    monkeypatch.setattr(state, "_store", MemoryStateStore())
+    return(simulator)
+
+
+def _instance_id(simulator, n):
+    return(sorted(simulator.ec2_instances)[n])
+
+
+def _check(simulator, requirements):
+    leaving, _ = find_leaving_instances(
+        simulator.autoscaling,
+        simulator.asg_name,
+        simulator.cluster_name
+    )
+    return(check_drain_capacity(
+        simulator.ecs,
+        simulator.cluster_name,
+        simulator.ec2_instances[_instance_id(simulator, 0)],
+        requirements,
+        leaving
+    ))
+
+
+def test_other_instances_take_the_tasks(simulator):
+    result = _check(simulator, [BIG_TASK, BIG_TASK])
+
+    assert result["fits"]
+    assert result["instances"] == 2
+    assert simulator.calls["ecs.ListContainerInstances"] == 1
+
+
+def test_terminating_instances_are_not_resources(simulator):
+    simulator.begin_termination(_instance_id(simulator, 0))
+    simulator.begin_termination(_instance_id(simulator, 1))
+
+    result = _check(simulator, [BIG_TASK, BIG_TASK])
+
+    assert not result["fits"]
+    assert result["instances"] == 1
+    assert result["unplaced"] == 1
+
+
+def test_draining_instances_are_not_resources(simulator):
+    simulator.set_instance_status(
+        simulator.ec2_instances[_instance_id(simulator, 1)],
+        "DRAINING"
+    )
+
+    assert _check(simulator, [BIG_TASK, BIG_TASK])["unplaced"] == 1
+
+
+def test_admitted_instances_are_not_resources(simulator, monkeypatch):
+    drain_coordinator.admit_drain(
+        simulator.cluster_name,
+        _instance_id(simulator, 2),
+        {}
+    )
+
+    assert _check(simulator, [BIG_TASK, BIG_TASK])["fits"]
+
+    monkeypatch.setattr(capacity, "DRAIN_COORDINATION", True)
+    assert _check(simulator, [BIG_TASK, BIG_TASK])["unplaced"] == 1
+
+
+def test_pack_places_the_biggest_tasks_first():
+    bins = [_resources(1024, 1024), _resources(1024, 3072)]
+
+    # Taken in the order given, the small task would fill the first
+    # instance's memory and leave the big one nowhere to go.
+    assert pack([
+        _resources(256, 1024),
+        _resources(256, 3072)
+    ], bins) == []
+    assert bins == [_resources(768, 0), _resources(768, 0)]
+
+
+def test_pack_keeps_host_ports_apart():
+    bins = [_resources(1024, 1024, "tcp:80"), _resources(1024, 1024)]
+
+    unplaced = pack([
+        _resources(128, 128, "tcp:80"),
+        _resources(128, 128, "tcp:80"),
+        _resources(128, 128, "udp:80")
+    ], bins)
+
+    assert unplaced == [_resources(128, 128, "tcp:80")]
+    assert bins[0]["ports"] == set(["tcp:80", "udp:80"])
+
+
+def test_pack_reports_what_does_not_fit():
+    assert pack([_resources(4096, 128)], [_resources(2048, 8192)]) == \
+        [_resources(4096, 128)]
+    assert pack([_resources(128, 128)], []) == [_resources(128, 128)]
+
+
+def test_task_requirements_from_the_containers_and_ports():
+    ecs_c = TaskDefinitions({
+        "bridge": {
+            "networkMode": "bridge",
+            "containerDefinitions": [{"portMappings": [
+                {"containerPort": 80, "hostPort": 8080},
+                {"containerPort": 53, "hostPort": 53, "protocol": "udp"},
+                {"containerPort": 443, "hostPort": 0}
+            ]}]
+        },
+        "host": {
+            "networkMode": "host",
+            "containerDefinitions": [{"portMappings": [
+                {"containerPort": 9090}
+            ]}]
+        },
+        "awsvpc": {
+            "networkMode": "awsvpc",
+            "containerDefinitions": [{"portMappings": [
+                {"containerPort": 80, "hostPort": 80}
+            ]}]
+        }
+    })
+
+    requirement, api_calls = task_requirements(ecs_c, {
+        "taskDefinitionArn": "bridge",
+        "containers": [
+            {"cpu": "128", "memoryReservation": "256", "memory": "512"},
+            {"cpu": "64", "memory": "128"}
+        ]
+    })
+    assert requirement == _resources(192, 384, "tcp:8080", "udp:53")
+    assert api_calls == 1
+
+    requirement, api_calls = task_requirements(ecs_c, {
+        "taskDefinitionArn": "host",
+        "cpu": "512",
+        "memory": "1024"
+    })
+    assert requirement == _resources(512, 1024, "tcp:9090")
+
+    requirement, api_calls = task_requirements(ecs_c, {
+        "taskDefinitionArn": "awsvpc",
+        "cpu": "256",
+        "memory": "512"
+    })
+    assert requirement == _resources(256, 512)
+
+    # Task definitions are only described the first time we see them.
+    task_requirements(ecs_c, {"taskDefinitionArn": "bridge"})
+    assert ecs_c.calls == 3
+
+
+def test_drain_requirements_only_count_replica_service_tasks(simulator):
+    simulator.add_service("daemon", 0, scheduling_strategy="DAEMON")
+    simulator.add_service("web", 3, cpu=256, memory=512, host_ports=[80])
+    arn = simulator.match_tasks(service_name="web")[0]["containerInstanceArn"]
+    simulator.add_standalone_task(arn)
+    web_tasks = len([
+        task for task in simulator.match_tasks(service_name="web")
+        if task["containerInstanceArn"] == arn
+    ])
+
+    requirements, api_calls = drain_requirements(
+        simulator.ecs,
+        simulator.cluster_name,
+        arn
+    )
+
+    assert requirements == [_resources(256, 512, "tcp:80")] * web_tasks
+    # Listing and describing the tasks, the services, and the web
+    # service's task definition.
+    assert api_calls == 4
@@ -0,0 +1,103 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import pytest
+from botocore.exceptions import ClientError
+
+from fake_aws import ClusterSimulator
+from fake_aws import FakeECS
+from lifecycle_core.container_instances import find_container_instance
+
+
+class NoFilterECS(FakeECS):
+
+    """
+    An ECS client that rejects cluster query language filters, as ECS
+    would one it can't parse.
+    """
+
+    def list_container_instances(self, cluster, filter=None, **kwargs):
+        if filter is not None:
+            self._call("list_container_instances")
+            raise(ClientError(
+                {"Error": {"Code": "InvalidParameterException"}},
+                "ListContainerInstances"
+            ))
+        return(FakeECS.list_container_instances(self, cluster, **kwargs))
+
+
+@pytest.fixture
+def simulator():
+
+    """
+    250 instances, so scanning the cluster takes three pages.
+    """
+
+    return(ClusterSimulator.build(250, 0, 0))
+
+
+def test_filter_finds_the_instance(simulator):
+    instance_id = sorted(simulator.ec2_instances)[-1]
+
+    container_instance, api_calls = find_container_instance(
+        simulator.ecs,
+        simulator.cluster_name,
+        instance_id
+    )
+
+    assert container_instance["containerInstanceArn"] == \
+        simulator.ec2_instances[instance_id]
+    # One filtered list and one describe, however big the cluster.
+    assert api_calls == 2
+    assert simulator.calls["ecs.ListContainerInstances"] == 1
+    assert simulator.calls["ecs.DescribeContainerInstances"] == 1
+
+
+def test_filter_finds_nothing_for_a_stranger(simulator):
+    container_instance, api_calls = find_container_instance(
+        simulator.ecs,
+        simulator.cluster_name,
+        "i-0123456789abcdef0"
+    )
+
+    assert container_instance is None
+    assert api_calls == 1
+
+
+def test_scan_when_the_filter_is_rejected(simulator):
+    ecs_c = NoFilterECS(simulator)
+    instance_id = sorted(simulator.ec2_instances)[-1]
+
+    container_instance, api_calls = find_container_instance(
+        ecs_c,
+        simulator.cluster_name,
+        instance_id
+    )
+
+    assert container_instance["ec2InstanceId"] == instance_id
+    # The rejected filter, then three pages listed and described.
+    assert api_calls == 7
+    assert simulator.calls["ecs.ListContainerInstances"] == 4
+
+
+def test_scan_finds_nothing_for_a_stranger(simulator):
+    container_instance, api_calls = find_container_instance(
+        NoFilterECS(simulator),
+        simulator.cluster_name,
+        "i-0123456789abcdef0"
+    )
+
+    assert container_instance is None
+    assert api_calls == 7
@@ -0,0 +1,192 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from lifecycle_core import clients
+from lifecycle_core import clock
+from lifecycle_core import continuation
+from lifecycle_core import state
+from lifecycle_core.continuation import continue_hook
+from lifecycle_core.state import MemoryStateStore
+
+NOW = 1000000.0
+
+HOOK_MESSAGE = {
+    "LifecycleActionToken": "token",
+    "EC2InstanceId": "i-1"
+}
+
+HOOK_RECORD = {"attempts": 1, "phase": "wait-drained"}
+
+
+class FakeContext(object):
+
+    invoked_function_arn = \
+        "arn:aws:lambda:us-east-1:123456789012:function:terminate"
+
+
+class RecordingClient(object):
+
+    """
+    Records the calls made to it, by operation name.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, operation):
+        def call(**kwargs):
+            self.calls.append((operation, kwargs))
+        return(call)
+
+
+class FailingScheduler(object):
+
+    def create_schedule(self, **kwargs):
+        raise(ClientError(
+            {"Error": {"Code": "ValidationException"}},
+            "CreateSchedule"
+        ))
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setattr(state, "_store", MemoryStateStore())
+    monkeypatch.setattr(clock, "_now", lambda: NOW)
+    monkeypatch.setattr(clients, "_clients", {})
+    monkeypatch.setattr(continuation, "CONTINUATION_MODE", "scheduler")
+    aws = {
+        "scheduler": RecordingClient(),
+        "lambda": RecordingClient()
+    }
+    for service_name, client in aws.items():
+        clients.set_client(service_name, client)
+    return(aws)
+
+
+def test_schedule_aims_at_resume_at(aws):
+    delay = continue_hook(HOOK_MESSAGE, HOOK_RECORD, FakeContext(), NOW + 300)
+
+    assert delay == 300
+    (operation, kwargs), = aws["scheduler"].calls
+    assert operation == "create_schedule"
+    assert kwargs["ScheduleExpression"] == "at(1970-01-12T13:51:40)"
+    assert json.loads(kwargs["Target"]["Input"])["detail"] == HOOK_MESSAGE
+    assert aws["lambda"].calls == []
+
+
+def test_schedule_is_due_by_latest(aws):
+    delay = continue_hook(
+        HOOK_MESSAGE,
+        HOOK_RECORD,
+        FakeContext(),
+        NOW + 600,
+        NOW + 200
+    )
+
+    assert delay == 200
+    assert len(aws["scheduler"].calls) == 1
+
+
+def test_invoke_when_latest_is_too_soon_to_schedule(aws):
+    delay = continue_hook(
+        HOOK_MESSAGE,
+        HOOK_RECORD,
+        FakeContext(),
+        NOW + 600,
+        NOW + 30
+    )
+
+    assert delay == 0
+    assert aws["scheduler"].calls == []
+    (operation, kwargs), = aws["lambda"].calls
+    assert operation == "invoke"
+    assert kwargs["InvocationType"] == "Event"
+
+
+def test_heartbeat_mode_leaves_it_to_the_heartbeat(aws, monkeypatch):
+    monkeypatch.setattr(continuation, "CONTINUATION_MODE", "heartbeat")
+
+    assert continue_hook(HOOK_MESSAGE, HOOK_RECORD, FakeContext()) is None
+    assert aws["scheduler"].calls == []
+    assert aws["lambda"].calls == []
+
+
+def test_invoke_mode_carries_the_record(aws, monkeypatch):
+    monkeypatch.setattr(continuation, "CONTINUATION_MODE", "invoke")
+
+    assert continue_hook(HOOK_MESSAGE, HOOK_RECORD, FakeContext()) == 0
+    (operation, kwargs), = aws["lambda"].calls
+    event = json.loads(kwargs["Payload"])
+    assert continuation.read_continuation(event) == HOOK_RECORD
+    assert event["detail"] == HOOK_MESSAGE
+
+
+def test_schedule_waits_at_least_the_minimum_delay(aws):
+    assert continue_hook(HOOK_MESSAGE, HOOK_RECORD, FakeContext()) == 60
+    assert continue_hook(
+        HOOK_MESSAGE,
+        HOOK_RECORD,
+        FakeContext(),
+        NOW + 10
+    ) == 60
+    assert continue_hook(
+        HOOK_MESSAGE,
+        HOOK_RECORD,
+        FakeContext(),
+        NOW + 3600
+    ) == 600
+
+
+def test_invoke_when_the_record_is_too_big_to_schedule(aws):
+    record = dict(HOOK_RECORD, drain_scope={
+        "services": ["service-{}".format(n) for n in range(1000)]
+    })
+
+    assert continue_hook(HOOK_MESSAGE, record, FakeContext(), NOW + 300) \
+        == 0
+    assert aws["scheduler"].calls == []
+    (operation, kwargs), = aws["lambda"].calls
+    assert len(kwargs["Payload"]) > continuation.SCHEDULER_INPUT_LIMIT
+    assert json.loads(kwargs["Payload"])["hook-record"] == record
+
+
+def test_invoke_when_the_schedule_fails(aws):
+    clients.set_client("scheduler", FailingScheduler())
+
+    assert continue_hook(
+        HOOK_MESSAGE,
+        HOOK_RECORD,
+        FakeContext(),
+        NOW + 300
+    ) == 0
+    (operation, kwargs), = aws["lambda"].calls
+    assert operation == "invoke"
+
+
+def test_durable_store_keeps_the_record(aws, monkeypatch):
+    store = MemoryStateStore()
+    store.durable = True
+    monkeypatch.setattr(state, "_store", store)
+    monkeypatch.setattr(continuation, "CONTINUATION_MODE", "invoke")
+
+    continue_hook(HOOK_MESSAGE, HOOK_RECORD, FakeContext())
+
+    (operation, kwargs), = aws["lambda"].calls
+    assert "hook-record" not in json.loads(kwargs["Payload"])
@@ -0,0 +1,207 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import pytest
+
+from fake_aws import ClusterSimulator
+from lifecycle_core import clock
+from lifecycle_core import drain_coordinator
+from lifecycle_core import state
+from lifecycle_core import terminate_hook
+from lifecycle_core.drain_coordinator import DRAIN_ADMISSION_TTL
+from lifecycle_core.drain_coordinator import admit_drain
+from lifecycle_core.drain_coordinator import find_admitted_instances
+from lifecycle_core.drain_coordinator import find_drain_budgets
+from lifecycle_core.drain_coordinator import release_drain_admission
+from lifecycle_core.drain_coordinator import renew_drain_admission
+from lifecycle_core.drain_coordinator import service_drain_budget
+from lifecycle_core.state import MemoryStateStore
+
+HOOK_MESSAGE = {
+    "LifecycleActionToken": "token",
+    "EC2InstanceId": "i-1"
+}
+
+
+class FakeContext(object):
+
+    def get_remaining_time_in_millis(self):
+        return(300000)
+
+
+@pytest.fixture
+def store(monkeypatch, fake_time):
+    store = MemoryStateStore()
+    monkeypatch.setattr(state, "_store", store)
+    monkeypatch.setattr(clock, "_now", fake_time.time)
+
+    def sleep(seconds):
+        fake_time.now += seconds
+    monkeypatch.setattr(clock, "_sleep", sleep)
+    return(store)
+
+
+def _service(desired, minimum_healthy_percent=None, maximum_percent=None):
+    deployment = {}
+    if minimum_healthy_percent is not None:
+        deployment["minimumHealthyPercent"] = minimum_healthy_percent
+    if maximum_percent is not None:
+        deployment["maximumPercent"] = maximum_percent
+    return({
+        "desiredCount": desired,
+        "deploymentConfiguration": deployment
+    })
+
+
+def test_service_drain_budget():
+    assert service_drain_budget(_service(8, 75, 100)) == 2
+    assert service_drain_budget(_service(8, 50, 200)) == 12
+    # Rounding keeps the service within its bounds, so 10 tasks at 75%
+    # must keep 8 running.
+    assert service_drain_budget(_service(10, 75, 100)) == 2
+    assert service_drain_budget(_service(4, 100, 100)) == 0
+    # ECS's defaults are 100% and 200%.
+    assert service_drain_budget(_service(3)) == 3
+    assert service_drain_budget(_service(3, 100, 50)) == 0
+
+
+def test_find_drain_budgets_counts_replica_service_tasks():
+    simulator = ClusterSimulator.build(
+        1, 2, 2,
+        daemon_services=1,
+        standalone_per_instance=1,
+        minimum_healthy_percent=50,
+        maximum_percent=100
+    )
+    arn = list(simulator.instances)[0]
+
+    budgets, api_calls = find_drain_budgets(
+        simulator.ecs,
+        simulator.cluster_name,
+        arn
+    )
+
+    assert budgets == {"service-0": [2, 1], "service-1": [2, 1]}
+    assert api_calls == 3
+
+
+def test_admit_within_the_budgets(store):
+    assert admit_drain("cluster", "i-1", {"web": [1, 2]}) == (True, [])
+    assert admit_drain("cluster", "i-2", {"web": [1, 2], "api": [3, 3]}) \
+        == (True, [])
+    assert admit_drain("cluster", "i-3", {"web": [1, 2], "api": [1, 3]}) \
+        == (False, ["api", "web"])
+    # Instances without tasks of the busy services go ahead.
+    assert admit_drain("cluster", "i-4", {"worker": [1, 1]}) == (True, [])
+
+    assert find_admitted_instances("cluster") == set(["i-1", "i-2", "i-4"])
+
+
+def test_admit_when_nothing_else_is_draining(store):
+    # However far over its budgets, an instance gets its turn alone.
+    assert admit_drain("cluster", "i-1", {"web": [5, 0]}) == (True, [])
+    assert admit_drain("cluster", "i-2", {}) == (True, [])
+    assert admit_drain("cluster", "i-3", {"web": [1, 0]}) == \
+        (False, ["web"])
+
+
+def test_admit_again_is_idempotent(store):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+
+    assert admit_drain("cluster", "i-1", {"web": [1, 1]}) == (True, [])
+
+
+def test_release_lets_the_queue_in(store):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+    assert admit_drain("cluster", "i-2", {"web": [1, 1]}) == (False, ["web"])
+
+    release_drain_admission("cluster", "i-1")
+    assert admit_drain("cluster", "i-2", {"web": [1, 1]}) == (True, [])
+    assert find_admitted_instances("cluster") == set(["i-2"])
+
+
+def test_lapsed_admissions_free_their_budget(store, fake_time):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+
+    fake_time.now += DRAIN_ADMISSION_TTL + 1
+    assert find_admitted_instances("cluster") == set()
+    assert admit_drain("cluster", "i-2", {"web": [1, 1]}) == (True, [])
+
+
+def test_admit_while_the_admissions_are_busy(store):
+    store.acquire_lease(drain_coordinator._lease_key("cluster"), "other", 30)
+
+    assert admit_drain("cluster", "i-1", {"web": [1, 1]}) == (False, [])
+
+
+def test_renew_extends_the_admission(store, fake_time):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+
+    fake_time.now += DRAIN_ADMISSION_TTL - 1
+    assert renew_drain_admission("cluster", "i-1") is True
+    fake_time.now += DRAIN_ADMISSION_TTL - 1
+    assert renew_drain_admission("cluster", "i-1") is True
+
+
+def test_renew_once_the_admission_lapses(store, fake_time):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+
+    fake_time.now += DRAIN_ADMISSION_TTL + 1
+    assert renew_drain_admission("cluster", "i-1") is False
+
+
+def test_renew_while_the_admissions_are_busy(store):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+    store.acquire_lease(drain_coordinator._lease_key("cluster"), "other", 30)
+
+    assert renew_drain_admission("cluster", "i-1") is None
+
+
+def test_lapsed_admission_queues_the_hook_again(store, fake_time,
+                                                monkeypatch):
+    admit_drain("cluster", "i-1", {"web": [1, 1]})
+    record = {
+        "phase": "wait-drained",
+        "cluster_name": "cluster",
+        "container_instance_id": "container-instance",
+        "drain_admitted": True,
+        "admission_renewed_at": fake_time.now
+    }
+
+    fake_time.now += DRAIN_ADMISSION_TTL + 1
+    # Another instance takes the budget our lapsed admission held.
+    assert admit_drain("cluster", "i-2", {"web": [1, 1]}) == (True, [])
+    terminate_hook.renew_admission(HOOK_MESSAGE, record)
+
+    assert record["phase"] == "queued"
+    assert record["requeued_from"] == "wait-drained"
+    assert "drain_admitted" not in record
+    assert "admission_renewed_at" not in record
+
+    monkeypatch.setattr(terminate_hook, "DRAIN_COORDINATION", True)
+    monkeypatch.setattr(
+        terminate_hook,
+        "find_drain_budgets",
+        lambda ecs_c, cluster_name, instance_id: ({"web": [1, 1]}, 1)
+    )
+    drain_coordinator.release_drain_admission("cluster", "i-2")
+
+    # Once admitted again we carry on waiting for the drain.
+    assert terminate_hook.phase_queued(
+        None, None, None, HOOK_MESSAGE, record, FakeContext()
+    ) == "wait-drained"
+    assert record["drain_admitted"] is True
+    assert record["admission_renewed_at"] == fake_time.now
+    assert "requeued_from" not in record
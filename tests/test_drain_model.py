@@ -0,0 +1,119 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import pytest
+
+from lifecycle_core import drain_model
+from lifecycle_core import state
+from lifecycle_core.drain_model import DrainTimeModel
+from lifecycle_core.drain_model import backtest
+from lifecycle_core.drain_model import predict_completion
+from lifecycle_core.drain_model import record_duration
+from lifecycle_core.state import MemoryStateStore
+
+HISTORY = {
+    "drain": [60, 70, 80, 90, 100, 110, 120, 130, 140, 150],
+    "drain:web": [30, 40, 50],
+    "drain:api": [200, 210, 220],
+    "drain:worker": [500, 600]
+}
+
+
+@pytest.fixture
+def store(monkeypatch, fake_time):
+    store = MemoryStateStore()
+    monkeypatch.setattr(state, "_store", store)
+    monkeypatch.setattr(drain_model, "DRAIN_TIME_MODEL", True)
+    return(store)
+
+
+def test_estimate_uses_the_cluster_percentile():
+    model = DrainTimeModel(dict(HISTORY))
+
+    assert model.estimate("drain", percentile=90) == 140
+    assert model.estimate("drain", percentile=50) == 100
+    assert model.estimate("drain", percentile=100) == 150
+
+
+def test_estimate_takes_the_slowest_service():
+    model = DrainTimeModel(dict(HISTORY))
+
+    assert model.estimate("drain", ["web"], percentile=90) == 50
+    assert model.estimate("drain", ["web", "api"], percentile=90) == 220
+
+
+def test_estimate_falls_back_on_the_cluster():
+    model = DrainTimeModel(dict(HISTORY))
+
+    # worker has too few samples of its own to go on.
+    assert model.estimate("drain", ["worker"], percentile=90) == 140
+    assert model.estimate("stable", percentile=90) is None
+
+
+def test_record_keeps_a_rolling_history():
+    model = DrainTimeModel(size=3)
+    for seconds in (10.4, 20.6, 30, 40):
+        model.record("stable", seconds, ["web"])
+
+    assert model.history == {
+        "stable": [21, 30, 40],
+        "stable:web": [21, 30, 40]
+    }
+
+
+def test_backtest_on_a_fixed_history():
+    result = backtest([100, 120, 110, 130, 90], percentile=50)
+
+    # 130 is predicted as 110, finishing late, then 90 as 110 again,
+    # oversleeping by 20 seconds.
+    assert result == {
+        "predictions": 2,
+        "mean_error": 20.0,
+        "late": 1,
+        "mean_overslept": 20.0
+    }
+
+
+def test_backtest_needs_enough_history():
+    assert backtest([100, 120, 110], percentile=90) == {
+        "predictions": 0,
+        "mean_error": None,
+        "late": 0,
+        "mean_overslept": None
+    }
+
+
+def test_predict_completion_from_recorded_durations(store, monkeypatch):
+    monkeypatch.setattr(drain_model, "DRAIN_ESTIMATE_PERCENTILE", 90)
+
+    assert predict_completion("cluster", "drain", 5000.0) is None
+    for seconds in (120, 180, 150):
+        record_duration("cluster", "drain", seconds, ["web"])
+
+    assert predict_completion("cluster", "drain", 5000.0, ["web"]) == 5180.0
+    assert predict_completion("other", "drain", 5000.0) is None
+
+
+def test_history_outlives_the_hook_records(store, fake_time):
+    for seconds in (120, 180, 150):
+        record_duration("cluster", "drain", seconds)
+
+    fake_time.now += 30 * 24 * 3600
+    assert drain_model.load_drain_model("cluster").history == {
+        "drain": [120, 180, 150]
+    }
+
+    fake_time.now += drain_model.DRAIN_HISTORY_TTL
+    assert drain_model.load_drain_model("cluster").history == {}
@@ -0,0 +1,140 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import json
+import threading
+
+import pytest
+
+from lifecycle_core import clock
+from lifecycle_core import metrics
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1700000000.0]
+    monkeypatch.setattr(clock, "_now", lambda: now[0])
+    return(now)
+
+
+def _records(capsys):
+    return([json.loads(line) for line in capsys.readouterr().out.splitlines()])
+
+
+def test_stop_recording_prints_emf(capsys, now):
+    recorder = metrics.start_recording("terminate")
+
+    @metrics.phase
+    def check_instance_drained():
+        now[0] += 2.5
+        recorder.count_api_call("ecs.DescribeContainerInstances")
+        recorder.count_api_call("ecs.DescribeContainerInstances")
+        recorder.add_poll_iterations(2)
+
+    check_instance_drained()
+    recorder.count_api_call("autoscaling.CompleteLifecycleAction")
+    recorder.reinvocations = 3
+    recorder.outcome = "CONTINUE"
+    capsys.readouterr()
+
+    metrics.stop_recording()
+    phase, completion, describe, invocation = _records(capsys)
+
+    assert phase == {
+        "_aws": {
+            "Timestamp": 1700000002500,
+            "CloudWatchMetrics": [{
+                "Namespace": "ECSClusterManager",
+                "Dimensions": [["Hook", "Phase"]],
+                "Metrics": [
+                    {"Name": "ApiCalls", "Unit": "Count"},
+                    {"Name": "Duration", "Unit": "Milliseconds"},
+                    {"Name": "PollIterations", "Unit": "Count"}
+                ]
+            }]
+        },
+        "Hook": "terminate",
+        "Phase": "check_instance_drained",
+        "ApiCalls": 2,
+        "Duration": 2500.0,
+        "PollIterations": 2
+    }
+
+    assert completion["Operation"] == "autoscaling.CompleteLifecycleAction"
+    assert completion["ApiCalls"] == 1
+    assert describe["Operation"] == "ecs.DescribeContainerInstances"
+    assert describe["ApiCalls"] == 2
+    assert describe["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [
+        ["Hook", "Operation"]
+    ]
+
+    assert invocation["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [
+        ["Hook"]
+    ]
+    assert invocation["ApiCalls"] == 3
+    assert invocation["Reinvocations"] == 3
+    assert invocation["CONTINUE"] == 1
+
+
+def test_phase_logs_its_duration(capsys, now):
+    metrics.start_recording("launch")
+
+    @metrics.phase
+    def find_cluster_name():
+        now[0] += 0.25
+
+    find_cluster_name()
+
+    assert _records(capsys) == [{
+        "log": "phase",
+        "hook": "launch",
+        "phase": "find_cluster_name",
+        "duration_ms": 250.0,
+        "api_calls": 0,
+        "poll_iterations": 0
+    }]
+    metrics.stop_recording()
+
+
+def test_bound_workers_count_against_the_invocation(capsys, now):
+    recorder = metrics.start_recording("batch")
+
+    def describe():
+        metrics.current().count_api_call("ecs.DescribeTasks")
+
+    workers = [
+        threading.Thread(target=metrics.bind(describe)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # An unbound thread has no recorder, so its calls go nowhere.
+    worker = threading.Thread(target=describe)
+    worker.start()
+    worker.join()
+
+    assert recorder.api_calls == {"ecs.DescribeTasks": 4}
+    metrics.stop_recording()
+
+
+def test_nothing_is_printed_when_not_recording(capsys):
+    metrics.stop_recording()
+    capsys.readouterr()
+
+    metrics.current().count_api_call("ecs.ListTasks")
+    metrics.stop_recording()
+
+    assert capsys.readouterr().out == ""
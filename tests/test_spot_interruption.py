@@ -0,0 +1,74 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+from lifecycle_core import clients
+from lifecycle_core import clock
+from run_benchmarks import load_handler
+
+spot = load_handler("spot")
+
+NOW = 1700000000.0
+
+
+def _event(detail_type, time=None):
+    event = {
+        "detail-type": detail_type,
+        "detail": {"instance-id": "i-1"}
+    }
+    if time is not None:
+        event["time"] = time
+    return(event)
+
+
+def test_deadline_from_the_warning_time(monkeypatch):
+    monkeypatch.setattr(spot, "SPOT_DEADLINE_MARGIN", 5)
+
+    # 2023-11-14T22:13:20Z is NOW, and EC2 reclaims the instance two
+    # minutes after that.
+    assert spot.find_deadline(_event(
+        spot.INTERRUPTION_WARNING,
+        "2023-11-14T22:13:20Z"
+    )) == NOW + 120 - 5
+
+
+def test_deadline_without_a_warning_time(monkeypatch):
+    monkeypatch.setattr(spot, "SPOT_DEADLINE_MARGIN", 10)
+    monkeypatch.setattr(clock, "_now", lambda: NOW + 30)
+
+    assert spot.find_deadline(_event(spot.INTERRUPTION_WARNING)) == \
+        NOW + 30 + 120 - 10
+
+
+def test_no_deadline_for_a_rebalance_recommendation():
+    assert spot.find_deadline(_event(
+        spot.REBALANCE_RECOMMENDATION,
+        "2023-11-14T22:13:20Z"
+    )) is None
+
+
+def test_rebalance_recommendations_ignored_by_default(monkeypatch):
+    drained = []
+    monkeypatch.setattr(spot, "fast_drain", lambda *args: drained.append(1))
+    monkeypatch.setattr(spot, "SPOT_DRAIN_ON_REBALANCE", False)
+    monkeypatch.setattr(clients, "_clients", {})
+    for service_name in ("ecs", "autoscaling"):
+        clients.set_client(service_name, object())
+
+    spot.lambda_handler(_event(spot.REBALANCE_RECOMMENDATION), None)
+    assert drained == []
+
+    monkeypatch.setattr(spot, "SPOT_DRAIN_ON_REBALANCE", True)
+    spot.lambda_handler(_event(spot.REBALANCE_RECOMMENDATION), None)
+    assert drained == [1]
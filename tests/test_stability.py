@@ -0,0 +1,81 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+from lifecycle_core.stability import evaluate_services
+from lifecycle_core.stability import service_stability
+from lifecycle_core.stability import task_is_stable
+
+
+def _service(deployments=None, desired=2, running=2, pending=0):
+    return({
+        "serviceName": "web",
+        "desiredCount": desired,
+        "runningCount": running,
+        "pendingCount": pending,
+        "deployments": deployments or [
+            {"status": "PRIMARY", "rolloutState": "COMPLETED"}
+        ]
+    })
+
+
+def test_steady_service():
+    assert service_stability(_service()) == []
+
+
+def test_steady_without_a_rollout_state():
+    # Services on older deployment controllers don't report one.
+    assert service_stability(_service([{"status": "PRIMARY"}])) == []
+
+
+def test_deployment_in_progress():
+    assert service_stability(_service([
+        {"status": "PRIMARY", "rolloutState": "IN_PROGRESS"},
+        {"status": "ACTIVE", "rolloutState": "COMPLETED"}
+    ])) == [
+        "1 deployments besides the primary",
+        "primary deployment rollout IN_PROGRESS"
+    ]
+
+
+def test_failed_rollout():
+    assert service_stability(_service([
+        {"status": "PRIMARY", "rolloutState": "FAILED"}
+    ])) == ["primary deployment rollout FAILED"]
+
+
+def test_task_counts():
+    assert service_stability(_service(running=1, pending=1)) == [
+        "running 1 of 2 tasks",
+        "1 tasks pending"
+    ]
+    assert service_stability(_service(desired=0, running=0)) == []
+
+
+def test_evaluate_services_keeps_the_unsteady():
+    assert evaluate_services({
+        "arn:steady": _service(),
+        "arn:scaling": _service(running=3)
+    }) == {"arn:scaling": ["running 3 of 2 tasks"]}
+
+
+def test_task_is_stable():
+    assert task_is_stable({
+        "lastStatus": "RUNNING",
+        "desiredStatus": "RUNNING"
+    })
+    assert not task_is_stable({
+        "lastStatus": "RUNNING",
+        "desiredStatus": "STOPPED"
+    })
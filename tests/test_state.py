@@ -0,0 +1,96 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import pytest
+
+from lifecycle_core.state import DEFAULT_TTL
+from lifecycle_core.state import MemoryStateStore
+from lifecycle_core.state import SQLiteStateStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, fake_time):
+    if request.param == "memory":
+        return(MemoryStateStore())
+    return(SQLiteStateStore())
+
+
+def test_get_returns_what_was_put(store):
+    store.put("hook:1", {"phase": "drain", "attempts": 2})
+
+    assert store.get("hook:1") == {"phase": "drain", "attempts": 2}
+    assert store.get("hook:2") is None
+
+
+def test_items_expire_after_their_ttl(store, fake_time):
+    store.put("short", {"n": 1}, ttl=60)
+    store.put("default", {"n": 2})
+
+    fake_time.now += 60
+    assert store.get("short") is None
+    assert store.get("default") == {"n": 2}
+
+    fake_time.now += DEFAULT_TTL
+    assert store.get("default") is None
+
+
+def test_delete(store):
+    store.put("hook:1", {"phase": "drain"})
+    store.delete("hook:1")
+    store.delete("hook:1")
+
+    assert store.get("hook:1") is None
+
+
+def test_lease_is_held_by_one_owner(store):
+    assert store.acquire_lease("lease:stability", "a", ttl=30)
+    assert not store.acquire_lease("lease:stability", "b", ttl=30)
+
+
+def test_holder_renews_its_lease(store, fake_time):
+    assert store.acquire_lease("lease:stability", "a", ttl=30)
+
+    fake_time.now += 20
+    assert store.acquire_lease("lease:stability", "a", ttl=30)
+
+    # Renewed at 20 seconds, so still held at 40.
+    fake_time.now += 20
+    assert not store.acquire_lease("lease:stability", "b", ttl=30)
+
+
+def test_expired_lease_can_be_taken(store, fake_time):
+    assert store.acquire_lease("lease:stability", "a", ttl=30)
+
+    fake_time.now += 29
+    assert not store.acquire_lease("lease:stability", "b", ttl=30)
+
+    fake_time.now += 1
+    assert store.acquire_lease("lease:stability", "b", ttl=30)
+    assert not store.acquire_lease("lease:stability", "a", ttl=30)
+
+
+def test_only_the_holder_releases_a_lease(store):
+    assert store.acquire_lease("lease:stability", "a", ttl=30)
+
+    store.release_lease("lease:stability", "b")
+    assert not store.acquire_lease("lease:stability", "b", ttl=30)
+
+    store.release_lease("lease:stability", "a")
+    assert store.acquire_lease("lease:stability", "b", ttl=30)
+
+
+def test_leases_are_independent(store):
+    assert store.acquire_lease("lease:one", "a", ttl=30)
+    assert store.acquire_lease("lease:two", "b", ttl=30)
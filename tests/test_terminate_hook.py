@@ -0,0 +1,162 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+import pytest
+
+from fake_aws import ClusterSimulator
+from fake_aws import FakeContext
+from lifecycle_core import clients
+from lifecycle_core import clock
+from lifecycle_core import polling
+from lifecycle_core import ratelimit
+from lifecycle_core import state
+from lifecycle_core import terminate_hook
+from lifecycle_core.hooks import normalize_hook_message
+from lifecycle_core.state import MemoryStateStore
+
+TARGET_GROUP_ARN = "arn:aws:elasticloadbalancing:us-east-1:123456789012:" \
+    "targetgroup/web/0123456789abcdef"
+
+
+class DeregisteringTargets(object):
+
+    """
+    An ELBv2 client whose targets all finish deregistering at a given
+    time.
+    """
+
+    def __init__(self, simulator, until):
+        self._clock = simulator.clock
+        self.until = until
+
+    def describe_target_health(self, TargetGroupArn, Targets):
+        state = "draining" if self._clock.now() < self.until else "unused"
+        return({"TargetHealthDescriptions": [
+            {"Target": target, "TargetHealth": {"State": state}}
+            for target in Targets
+        ]})
+
+
+@pytest.fixture
+def simulator(monkeypatch):
+
+    """
+    Two instances, each running a DAEMON service task, and one REPLICA
+    service task on the instance we drain.  The REPLICA task's
+    replacement is running 35 seconds into the drain, and the task has
+    stopped after 65, leaving only the daemon.
+    """
+
+    simulator = ClusterSimulator.build(2, 1, 1, daemon_services=1)
+    monkeypatch.setattr(clock, "_now", simulator.clock.now)
+    monkeypatch.setattr(clock, "_sleep", simulator.clock.sleep)
+    monkeypatch.setattr(clients, "_clients", {})
+    monkeypatch.setattr(polling, "_convergence", {})
+    # Each simulator's clock starts afresh, so the rate budgets must too.
+    monkeypatch.setattr(ratelimit, "api_budget", ratelimit.ApiBudget(
+        ratelimit.API_RATE_BUDGETS
+    ))
+    clients.set_client("ecs", simulator.ecs)
+
+    task = simulator.match_tasks(service_name="service-0")[0]
+    simulator.draining = task["containerInstanceArn"]
+    simulator.set_instance_status(simulator.draining, "DRAINING")
+    return(simulator)
+
+
+def _deregistration(simulator, until):
+    clients.set_client("elbv2", DeregisteringTargets(
+        simulator,
+        simulator.clock.now() + until
+    ))
+    return({
+        "targets": {
+            TARGET_GROUP_ARN: [{"Id": "i-00000000000000001", "Port": 32768}]
+        },
+        "started_at": simulator.clock.now(),
+        "finished_at": None
+    })
+
+
+@pytest.mark.parametrize("action, targets_until, drained, stopped", [
+    ("ignore", None, True, 0),
+    ("ignore", 200, True, 0),
+    ("stop", None, True, 1),
+    ("stop", 200, True, 1),
+    ("wait", None, False, 0),
+    ("wait", 200, False, 0),
+])
+def test_daemon_tasks_and_deregistration(monkeypatch, simulator, action,
+                                         targets_until, drained, stopped):
+    monkeypatch.setattr(terminate_hook, "DAEMON_TASK_ACTION", action)
+    deregistration = None
+    if targets_until is not None:
+        deregistration = _deregistration(simulator, targets_until)
+    started = simulator.clock.now()
+
+    result = terminate_hook.check_instance_drained(
+        simulator.ecs,
+        simulator.cluster_name,
+        simulator.draining,
+        FakeContext(simulator.clock, timeout=300),
+        deregistration=deregistration
+    )
+
+    # With "stop" the daemon has gone long before the targets finish, so
+    # we carry on polling with nothing left on the instance.
+    assert result is drained
+    # The REPLICA task's own stop doesn't go through the API.
+    assert simulator.calls.get("ecs.StopTask", 0) == stopped
+    if drained and targets_until is not None:
+        assert simulator.clock.now() - started >= targets_until
+        assert deregistration["targets"] == {}
+        assert deregistration["finished_at"] - started >= targets_until
+    elif drained:
+        assert simulator.clock.now() - started < 200
+
+
+def test_no_phase_started_near_the_timeout(monkeypatch, simulator):
+    monkeypatch.setattr(state, "_store", MemoryStateStore())
+    started = []
+
+    def phase(name, seconds, next_phase):
+        def run(ec2_c, ecs_c, asg_c, hook_message, checkpoint, context):
+            started.append(name)
+            simulator.clock.sleep(seconds)
+            return(next_phase)
+        return(run)
+
+    # The drain finishes with 30 seconds left, too few for a stability
+    # pass over a large cluster.
+    monkeypatch.setattr(terminate_hook, "TERMINATE_PHASES", {
+        "resolve": phase("resolve", 0, "wait-drained"),
+        "wait-drained": phase("wait-drained", 270, "wait-stable"),
+        "wait-stable": phase("wait-stable", 0, "complete")
+    })
+    hook_message = normalize_hook_message(simulator.begin_termination())
+
+    action = terminate_hook.process_terminate_hook(
+        simulator.ec2,
+        simulator.ecs,
+        simulator.autoscaling,
+        hook_message,
+        FakeContext(simulator.clock, timeout=300)
+    )
+
+    assert action == "HEARTBEAT"
+    assert started == ["resolve", "wait-drained"]
+    assert state.get_state_store().get(
+        "hook:{}".format(hook_message["LifecycleActionToken"])
+    )["phase"] == "wait-stable"
@@ -0,0 +1,115 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+#    http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+from fake_aws import ClusterSimulator
+from run_benchmarks import load_handler
+
+policy = load_handler("policy")
+
+
+def _container_instance(status="ACTIVE", running=0, pending=0, cpu=0,
+                        memory=0):
+    return({
+        "status": status,
+        "runningTasksCount": running,
+        "pendingTasksCount": pending,
+        "registeredResources": [
+            {"name": "CPU", "integerValue": 2048},
+            {"name": "MEMORY", "integerValue": 8192}
+        ],
+        "remainingResources": [
+            {"name": "CPU", "integerValue": 2048 - cpu},
+            {"name": "MEMORY", "integerValue": 8192 - memory}
+        ]
+    })
+
+
+def _instance(instance_id, zone, market_option=None):
+    instance = {"InstanceId": instance_id, "AvailabilityZone": zone}
+    if market_option is not None:
+        instance["InstanceMarketOption"] = market_option
+    return(instance)
+
+
+def test_drain_cost_prefers_draining_then_fewest_tasks():
+    draining = _container_instance("DRAINING", running=10)
+    busy = _container_instance(running=3, pending=1)
+    quiet = _container_instance(running=2)
+
+    assert sorted([busy, quiet, draining], key=policy.drain_cost) == \
+        [draining, quiet, busy]
+
+
+def test_drain_cost_breaks_ties_on_the_most_reserved_resource():
+    cpu_heavy = _container_instance(running=2, cpu=1536, memory=1024)
+    memory_heavy = _container_instance(running=2, cpu=512, memory=4096)
+
+    assert policy.drain_cost(cpu_heavy) == (True, 2, 0.75)
+    assert policy.drain_cost(memory_heavy) == (True, 2, 0.5)
+    assert policy.drain_cost({
+        "status": "ACTIVE",
+        "runningTasksCount": 0,
+        "pendingTasksCount": 0
+    }) == (True, 0, 0.0)
+
+
+def test_rank_candidates_puts_strangers_first():
+    simulator = ClusterSimulator.build(2, 0, 0)
+    busy, quiet = sorted(simulator.ec2_instances)
+    for _ in range(2):
+        simulator.add_standalone_task(simulator.ec2_instances[busy])
+    offered = [
+        _instance(busy, "us-east-1a"),
+        _instance(quiet, "us-east-1a"),
+        _instance("i-0123456789abcdef0", "us-east-1a")
+    ]
+
+    ranked = policy.rank_candidates(
+        simulator.ecs,
+        simulator.cluster_name,
+        offered
+    )
+
+    assert [i["InstanceId"] for i in ranked] == \
+        ["i-0123456789abcdef0", quiet, busy]
+
+
+def test_choose_instances_by_zone_and_market_option():
+    ranked = [
+        _instance("i-1", "us-east-1a", "spot"),
+        _instance("i-2", "us-east-1a"),
+        _instance("i-3", "us-east-1b"),
+        _instance("i-4", "us-east-1a"),
+        _instance("i-5", "us-east-1b")
+    ]
+
+    assert policy.choose_instances(ranked, [
+        {"AvailabilityZone": "us-east-1a", "Capacity": 2},
+        {"AvailabilityZone": "us-east-1b", "Capacity": 1},
+        {
+            "AvailabilityZone": "us-east-1a",
+            "Capacity": 1,
+            "InstanceMarketOption": "spot"
+        }
+    ]) == ["i-2", "i-4", "i-3", "i-1"]
+
+
+def test_choose_instances_only_has_what_it_was_offered():
+    ranked = [_instance("i-1", "us-east-1a")]
+
+    assert policy.choose_instances(ranked, [
+        {"AvailabilityZone": "us-east-1a", "Capacity": 3},
+        {"AvailabilityZone": "us-east-1a", "Capacity": 1}
+    ]) == ["i-1"]